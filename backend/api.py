@@ -10,18 +10,33 @@
 #                                                                               *
 #*******************************************************************************/
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse, Response, RedirectResponse
 from pydantic import BaseModel
+from typing import Union
 from urllib.parse import urlparse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import BackgroundTasks
-from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
-from crawler.bwa_crawl import crawler
-from crawler.bwa_jobqueue import job_queue
-from crawler.bwa_manifest import bwa_manifest
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode, urljoin
+from crawler.bwa_jobqueue import async_job_queue, job_status_counts
+from crawler.bwa_cache import bwa_cache
+from crawler.bwa_bundle import bwa_bundle
+from crawler.bwa_schedule import scheduler
+from crawler.bwa_search import indexer
+from crawler.bwa_cdx import cdx_feed, cdx_query
+from crawler.bwa_pool import bwa_pool, io_pool, net_pool
+from crawler.bwa_metrics import REGISTRY
+from crawler import bwa_log
+from crawler import bwa_image
+from crawler.bwa_replay import bwa_replay
+from crawler.bwa_content import (
+    bwa_variants, file_etags, media_type, compressible, accepted_encodings,
+    etag_matches, parse_range, read_range, IMMUTABLE, REVALIDATE, VARIANT_MIN_BYTES,
+)
 
 import os
+import re
+import sys
 import subprocess
 import logging
 import json
@@ -29,6 +44,9 @@ import hashlib
 from pathlib import Path
 
 
+# Every logger, uvicorn's included, writes through one queue and a background thread
+bwa_log.setup()
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -37,7 +55,122 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-jobs = job_queue()
+# The crawl stack (Playwright, bwa_crawl) and the QDN client (requests, bwa_manifest,
+# bwa_publish) are imported where they are first used, so a process that only serves
+# job polls and archive content never loads them. BWA_PIPELINE=0 makes a lightweight
+# replica that runs none of the background stages below; one process with the default
+# BWA_PIPELINE=1 runs them for every replica sharing its jobs/ directory.
+PIPELINE = os.environ.get("BWA_PIPELINE", "1") != "0"
+
+# Job files are pickled and fsync'd, every access goes through the io pool
+jobs = async_job_queue()
+# /metrics counts jobs by status from the job files written since its last scrape
+job_statuses = job_status_counts(jobs.queue)
+archive_cache = bwa_cache()
+
+
+def fetch_bundle(content_hash):
+    from crawler.bwa_manifest import bwa_manifest
+    return bwa_manifest(None).fetch_bundle(content_hash)
+
+
+# Delta versions may reference bundles that are not cached yet
+bundles = bwa_bundle(archive_cache, fetch=fetch_bundle)
+
+# The pipeline process builds the background stages at startup; a replica builds one only
+# when a watch, search or CDX request first needs it, so importing this module creates no
+# directories or databases
+publish_stage = None
+watch_stage = None
+search_stage = None
+cdx_stage = None
+
+
+def get_watch_stage():
+    global watch_stage
+    if watch_stage is None:
+        watch_stage = scheduler()
+    return watch_stage
+
+
+def get_search_stage():
+    global search_stage
+    if search_stage is None:
+        search_stage = indexer(bundles)
+    return search_stage
+
+
+def get_cdx_stage():
+    global cdx_stage
+    if cdx_stage is None:
+        cdx_stage = cdx_feed()
+    return cdx_stage
+
+
+replay = bwa_replay(bundles)
+variants = bwa_variants(bundles)
+local_etags = file_etags()
+
+# Virtual path prefix for files served straight out of cached bundles:
+# archive/<content_hash>/<member>
+ARCHIVE_PREFIX = "archive/"
+# Wayback-style replay: /replay/<content_hash>/<captured url>
+REPLAY_PREFIX = "/replay/"
+# Local job files /archive-content may serve
+JOBS_ROOT = Path("jobs").resolve()
+
+@app.on_event("startup")
+async def start_pipeline():
+    global publish_stage
+    if not PIPELINE:
+        return
+    from crawler.bwa_publish import publisher
+
+    # Publishing runs beside the API so crawls never wait on QDN uploads
+    publish_stage = publisher()
+    publish_stage.start()
+    # Watched URLs are re-captured on their own schedules
+    get_watch_stage().start()
+    # Published captures are added to the full-text index
+    get_search_stage().start()
+    # Finished jobs and QDN versions are added to the capture index
+    get_cdx_stage().start()
+
+
+@app.on_event("shutdown")
+async def stop_pipeline():
+    for stage in (watch_stage, search_stage, cdx_stage, publish_stage):
+        if stage is not None:
+            await stage.stop()
+    # only a process that crawled has browsers to close
+    if "crawler.bwa_browser" in sys.modules:
+        await sys.modules["crawler.bwa_browser"].browsers.close()
+    bwa_log.shutdown()
+
+
+@REGISTRY.collector
+def pipeline_metrics():
+    # evaluated on the io pool when /metrics is scraped, never on the request path
+    yield ("bwa_jobs", "gauge", "Jobs on disk by status", [({"status": status}, count) for status, count in job_statuses.counts().items()])
+    if publish_stage is not None:
+        yield ("bwa_publish_queue_depth", "gauge", "Jobs handed to publish workers but not started", [({}, publish_stage.queue.qsize())])
+    if watch_stage is not None:
+        yield ("bwa_watches", "gauge", "Watched URLs", [({}, len(watch_stage.watches or {}))])
+    if search_stage is not None:
+        yield ("bwa_search_versions", "gauge", "Captured versions in the search index", [({}, search_stage.index.count())])
+    usage = archive_cache.usage()
+    yield ("bwa_archive_cache_bytes", "gauge", "Bytes of bundles in the archive cache", [({}, usage["bytes"])])
+    yield ("bwa_archive_cache_entries", "gauge", "Bundles in the archive cache", [({}, usage["entries"])])
+    yield ("bwa_archive_cache_max_bytes", "gauge", "Disk budget of the archive cache", [({}, usage["max_bytes"])])
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Expose pipeline metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(await io_pool.run(REGISTRY.render), media_type="text/plain; version=0.0.4")
+
 
 class ArchiveRequest(BaseModel):
     op: str
@@ -45,6 +178,26 @@ class ArchiveRequest(BaseModel):
     id: str = ""
     depth: int = 1
     assets: bool = False
+    # op "new": capture a cProfile/tracemalloc report under metadata/
+    profile: bool = False
+    # op "new": screenshot profile name or overrides, see crawler.bwa_image
+    screenshot: Union[str, dict] = ""
+    # op "new": crawl even if the page is unchanged since its last capture (crawler.bwa_recrawl)
+    force: bool = False
+    # op "watch": seconds between captures, adapted within min/max (crawler.bwa_schedule)
+    interval: float = 0
+    min_interval: float = 0
+    max_interval: float = 0
+    # op "search": words and "quoted phrases", paged with limit and offset
+    query: str = ""
+    offset: int = 0
+    # op "jobs" filters
+    status: str = ""
+    stage: str = ""
+    min_seconds: float = 0
+    min_rss: int = 0
+    sort: str = ""
+    limit: int = 0
 
 
 def url_key(canonical_url: str) -> str:
@@ -80,46 +233,68 @@ def url_key(canonical_url: str) -> str:
     ).hexdigest()
 
 
-async def get_archive_async(temp_job_id: str, url_key_val: str):
+def filter_jobs(job_list: list, req: ArchiveRequest) -> list:
+    """
+    Filter and order jobs by status, stage timings and peak memory.
+
+    stage + min_seconds keeps jobs whose stage took at least that long ("total"
+    when no stage is given); sort "slowest" orders by that timing, "memory" by
+    peak_rss, both descending.
+    """
+    stage_name = req.stage or "total"
+
+    def seconds(job):
+        return job.get("timings", {}).get(stage_name, 0)
+
+    if req.status:
+        job_list = [job for job in job_list if job.get("status") == req.status]
+    if req.stage or req.min_seconds:
+        job_list = [job for job in job_list if stage_name in job.get("timings", {}) and seconds(job) >= req.min_seconds]
+    if req.min_rss:
+        job_list = [job for job in job_list if job.get("peak_rss", 0) >= req.min_rss]
+    if req.sort == "slowest":
+        job_list = sorted(job_list, key=seconds, reverse=True)
+    elif req.sort == "memory":
+        job_list = sorted(job_list, key=lambda job: job.get("peak_rss", 0), reverse=True)
+    if req.limit:
+        job_list = job_list[:req.limit]
+    return job_list
+
+
+async def get_archive_async(fetch_job_id: str, url_key_val: str):
     """
     Asynchronously fetch archive from QDN and update job status.
     
     Args:
-        temp_job_id: Temporary job ID for tracking
+        fetch_job_id: Job ID used to report fetch progress
         url_key_val: URL key to fetch
     """
+    from crawler.bwa_manifest import bwa_manifest
+
     try:
-        # Create temporary job for tracking
-        jobs.create_job({
-            "id": temp_job_id,
-            "status": "fetching",
-            "message": "Downloading archive from QDN...",
-            "url_key": url_key_val
-        })
-        
-        # Fetch from QDN
-        manifest = bwa_manifest(temp_job_id, "jobs/manifest")  # Correct basedir parameter
-        content_hash = manifest.get_most_recent_zip(url_key_val)
+        # Fetch from QDN into the shared archive cache
+        manifest = bwa_manifest(fetch_job_id, "jobs/manifest")  # Correct basedir parameter
+        content_hash = await net_pool.run(manifest.get_most_recent_zip, url_key_val)
         
         if content_hash:
-            extract_dir = manifest.extract_zip(url_key_val, content_hash)
+            archive_path = ARCHIVE_PREFIX + content_hash
             # Update job with success
-            jobs.update_job(temp_job_id, {
+            await jobs.update_job(fetch_job_id, {
                 "status": "complete",
-                "message": f"Archive ready: {extract_dir}",
-                "path": extract_dir,
+                "message": f"Archive ready: {archive_path}",
+                "path": archive_path,
                 "content_hash": content_hash
             })
         else:
             # Update job with error
-            jobs.update_job(temp_job_id, {
+            await jobs.update_job(fetch_job_id, {
                 "status": "failed",
                 "message": "No archive found for this URL"
             })
             
     except Exception as e:
         # Update job with error
-        jobs.update_job(temp_job_id, {
+        await jobs.update_job(fetch_job_id, {
             "status": "failed", 
             "message": f"Error fetching archive: {str(e)}"
         })
@@ -132,30 +307,40 @@ async def queue_archive(req: ArchiveRequest, background_tasks: BackgroundTasks):
         # Normalize URL string
         # req.url = normalize_url(req.url)
         logging.info(req)
-        id = jobs.create_job({
+        try:
+            bwa_image.options(req.screenshot)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        id = await jobs.create_job({
                                 "status":   "queued",
                                 "message":  "",
                                 "url":      req.url, 
                                 "url_hash": url_key(req.url),
                                 "domain":   urlparse(req.url).netloc,
                                 "depth":    req.depth,
-                                "assets":   req.assets
+                                "assets":   req.assets,
+                                "profile":  req.profile,
+                                "screenshot": req.screenshot or None,
+                                "force":    req.force
                             })
-        job = jobs.get_job(id)
+        job = await jobs.get_job(id)
         crawler_data = json.dumps(job) 
         logging.info(crawler_data)
         
         try:
             logging.info(crawler_data)
-            jobs.update_job(id,{"status":"started"})
+            await jobs.update_job(id,{"status":"started"})
 
-            crawl = crawler(id)
+            # the first crawl of a process imports the crawl stack
+            from crawler.bwa_crawl import crawler
+
+            crawl = await io_pool.run(crawler, id)
             background_tasks.add_task(run_crawl, crawl)  # Run in background
         
         except subprocess.SubprocessError as e:
 
             logging.error(f"Subprocess failed: {e}")
-            jobs.update_job(id,{"status":"failed"})
+            await jobs.update_job(id,{"status":"failed"})
         
         return job
     
@@ -163,73 +348,283 @@ async def queue_archive(req: ArchiveRequest, background_tasks: BackgroundTasks):
         # Get archived job (check local first, then QDN)
         url_key_val = url_key(req.url)
         
-        # Check if archive already exists locally
-        jobs_list = jobs.list_jobs()
-        
-        # Handle both list and dict return types
-        if hasattr(jobs_list, 'items'):
-            # It's a dictionary-like object
-            jobs_dict = jobs_list
-        else:
-            # It's a list
-            jobs_dict = {job_id: job_data for job_id, job_data in jobs_list}
-        
-        for job_id, job_data in jobs_dict.items():
-            if job_data.get('url_key') == url_key_val and job_data.get('status') == 'complete':
-                extract_dir = os.path.join("jobs", "manifest", job_id, "metadata")
-                if os.path.exists(extract_dir):
-                    return {"path": extract_dir, "content_hash": job_data.get('content_hash'), "local": True}
+        # Check if archive already exists locally, the CDX index knows the newest local capture
+        capture = await io_pool.run(get_cdx_stage().index.latest, url_key_val)
+        if capture:
+            extract_dir = os.path.join("jobs", "manifest", f"{capture['job_id']}.d", "metadata")
+            if os.path.exists(extract_dir):
+                return {"path": extract_dir, "content_hash": capture['content_hash'], "local": True}
         
-        # Use a temporary job id for manifest operations
-        temp_job_id = f"get_{hash(url_key_val)}"  # simple hash
+        # Serve repeated views straight from the shared archive cache
+        content_hash = await io_pool.run(archive_cache.get_key, url_key_val)
+        if content_hash:
+            return {"path": ARCHIVE_PREFIX + content_hash, "content_hash": content_hash, "local": True}
+
+        # Track the fetch with its own job so the Q-App can poll it
+        fetch_job_id = await jobs.create_job({
+            "status": "fetching",
+            "message": "Downloading archive from QDN...",
+            "url_key": url_key_val
+        })
         
         # Run as background task to avoid blocking
-        background_tasks.add_task(get_archive_async, temp_job_id, url_key_val)
+        background_tasks.add_task(get_archive_async, fetch_job_id, url_key_val)
         
         # Return immediate response with job ID for status tracking
-        return {"status": "fetching", "job_id": temp_job_id, "url_key": url_key_val}
+        return {"status": "fetching", "job_id": fetch_job_id, "url_key": url_key_val}
     
     elif req.op == "jobs":
-        return jobs.list_jobs()
+        return filter_jobs(await jobs.list_jobs(), req)
     
     elif req.op == "job":
-        job = jobs.get_job(req.id)
+        job = await jobs.get_job(req.id)
         if not job:
             raise HTTPException(404, "Job not found")
         return job
+
+    elif req.op == "watch":
+        # Capture a URL again and again, as often as it changes
+        if not urlparse(req.url).scheme or not urlparse(req.url).netloc:
+            raise HTTPException(400, "Invalid URL")
+        try:
+            bwa_image.options(req.screenshot)
+            return await get_watch_stage().add(
+                req.url,
+                {"depth": req.depth, "assets": req.assets, "screenshot": req.screenshot or None},
+                interval=req.interval or None,
+                min_interval=req.min_interval or None,
+                max_interval=req.max_interval or None,
+            )
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+
+    elif req.op == "unwatch":
+        if not await get_watch_stage().remove(req.url):
+            raise HTTPException(404, "URL is not watched")
+        return {"url": req.url, "watched": False}
+
+    elif req.op == "watches":
+        return await get_watch_stage().list()
+
+    elif req.op == "search":
+        # Ranked full-text hits over every indexed capture, optionally of one URL
+        try:
+            hits = await io_pool.run(
+                get_search_stage().index.search, req.query, req.limit or 20, req.offset,
+                url_key(req.url) if req.url else None,
+            )
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        return {"query": req.query, "hits": hits}
     
     else:
         raise HTTPException(400, "Invalid operation")
 
 
-@app.get("/archive-content")
-async def serve_archive_content(path: str):
+@app.get("/cdx")
+async def cdx_search(
+    url: str,
+    matchType: str = "",
+    from_: str = Query("", alias="from"),
+    to: str = "",
+    closest: str = "",
+    sort: str = "",
+    collapse: str = "",
+    limit: int = 0,
+    fl: str = "",
+    filter: list[str] = Query([]),
+    output: str = "cdx",
+    showResumeKey: bool = False,
+    resumeKey: str = "",
+):
     """
-    Serve archived HTML content for display in the Q-App viewer.
+    Query captures by URL, URL prefix, host or domain and time, CDX server style.
+
+    output "cdx" streams one space separated line per capture, "json" one JSON
+    object per line. See crawler.bwa_cdx for the parameters.
     """
+    if output not in ("cdx", "json"):
+        raise HTTPException(400, "output must be cdx or json")
     try:
-        # Validate the path to prevent directory traversal
-        file_path = Path(path).resolve()
-        
-        # Ensure the path is within allowed directories (jobs/extracted or similar)
-        if not str(file_path).startswith("/app/jobs/") and not str(file_path).startswith("./jobs/"):
-            raise HTTPException(403, "Access denied: Path outside allowed directory")
-        
-        if not file_path.exists():
-            raise HTTPException(404, "File not found")
-        
-        if not file_path.is_file():
-            raise HTTPException(400, "Path is not a file")
-        
-        # Read the file content
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        
-        return PlainTextResponse(content, media_type="text/html")
-        
-    except Exception as e:
-        logging.error(f"Error serving archive content: {e}")
-        raise HTTPException(500, f"Internal server error: {str(e)}")
+        query = cdx_query(url, matchType, from_, to, closest, sort, collapse, limit, fl, filter, resumeKey)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    async def lines():
+        async for row in get_cdx_stage().index.stream(query):
+            if "resumeKey" in row:
+                if showResumeKey:
+                    yield json.dumps(row) + "\n" if output == "json" else "\n" + row["resumeKey"] + "\n"
+            elif output == "json":
+                yield json.dumps(row) + "\n"
+            else:
+                yield " ".join("-" if value is None else str(value) for value in row.values()) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson" if output == "json" else "text/plain")
+
+
+@app.get("/pools")
+async def pool_stats():
+    """
+    Report the worker pools blocking work runs on.
+
+    A saturation near 1 with a growing queue means the pool is the bottleneck;
+    raise BWA_IO_WORKERS, BWA_NET_WORKERS or BWA_PUBLISH_CONCURRENCY.
+    """
+    return bwa_pool.all_stats()
+
+
+@app.get("/archive-content")
+async def serve_archive_content(path: str, request: Request):
+    """
+    Serve archived content for display in the Q-App viewer.
+
+    Paths of the form archive/<content_hash>/<member> are streamed straight
+    out of the cached bundle; other paths are read from the local jobs tree.
+    Responses stream in chunks with their real media type, a strong ETag,
+    If-None-Match and single-range support. Bundle members never change, so
+    they are immutable and text members are sent precompressed when accepted.
+    """
+    if path.startswith(ARCHIVE_PREFIX):
+        return await serve_bundle_member(path, request)
+    return await serve_local_file(path, request)
+
+
+async def serve_bundle_member(path: str, request: Request):
+    content_hash, _, member = path[len(ARCHIVE_PREFIX):].partition("/")
+    content_hash = archive_cache.strip_hash(content_hash)
+    # the first read of a delta may download its base bundle, so it runs on the net pool
+    if not member or await net_pool.run(bundles.member_info, content_hash, member) is None:
+        raise HTTPException(404, "File not found")
+
+    content_type = media_type(member)
+    size = await io_pool.run(bundles.member_size, content_hash, member)
+    etag = f"{content_hash}-{hashlib.sha256(member.encode('utf-8')).hexdigest()[:16]}"
+    headers = {"Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", f'"{etag}"') != f'"{etag}"':
+        range_header = None
+
+    encoding = None
+    if compressible(content_type):
+        headers["Vary"] = "Accept-Encoding"
+        if not range_header and (size is None or size >= VARIANT_MIN_BYTES):
+            encoding = next(iter(accepted_encodings(request.headers.get("accept-encoding"))), None)
+    headers["ETag"] = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        variant_path = await io_pool.run(variants.get, content_hash, member, encoding)
+        if variant_path:
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(os.path.getsize(variant_path))
+            return StreamingResponse(read_range(open(variant_path, "rb"), 0, None), media_type=content_type, headers=headers)
+        headers["ETag"] = f'"{etag}"'
+
+    return await send_ranged(
+        lambda: bundles.open_member(content_hash, member), size, content_type, headers, range_header
+    )
+
+
+async def serve_local_file(path: str, request: Request):
+    # Validate the path to prevent directory traversal
+    file_path = Path(path).resolve()
+    if not file_path.is_relative_to(JOBS_ROOT):
+        raise HTTPException(403, "Access denied: Path outside allowed directory")
+    if not file_path.exists():
+        raise HTTPException(404, "File not found")
+    if not file_path.is_file():
+        raise HTTPException(400, "Path is not a file")
+
+    # Local jobs may still be crawling, so clients revalidate against the content ETag
+    etag = await io_pool.run(local_etags.get, file_path)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) != etag:
+        range_header = None
+    return await send_ranged(
+        lambda: open(file_path, "rb"), file_path.stat().st_size, media_type(file_path.name), headers, range_header
+    )
+
+
+async def send_ranged(opener, size, content_type, headers, range_header):
+    """
+    Stream a file object, or the byte range the client asked for.
+
+    :param opener: Called in a worker thread to open the file object
+    :param size: Size of the file, None if unknown (ranges are then ignored)
+    """
+    byte_range = parse_range(range_header, size)
+    if byte_range is False:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    f = await io_pool.run(opener)
+    if f is None:
+        raise HTTPException(404, "File not found")
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(read_range(f, start, end - start + 1), status_code=206, media_type=content_type, headers=headers)
+
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(read_range(f, 0, None), media_type=content_type, headers=headers)
+
+
+@app.get("/replay/{content_hash}/{url:path}")
+async def replay_url(content_hash: str, url: str, request: Request):
+    """
+    Replay one captured URL out of an archived version.
+
+    Reads only the WARC record of that URL through the bundle's offset index,
+    rewrites links in HTML and CSS back into /replay/<content_hash>/ and marks
+    the response immutable, since a content hash never changes.
+    """
+    if not url:
+        manifest = await net_pool.run(bundles.manifest, content_hash)
+        if not manifest.get("target_url"):
+            raise HTTPException(404, "Archive not found")
+        return RedirectResponse(REPLAY_PREFIX + f"{content_hash}/{manifest['target_url']}")
+
+    # proxies and browsers collapse the double slash of an embedded scheme
+    url = re.sub(r"^(https?):/+", r"\1://", url)
+    if request.url.query:
+        url += "?" + request.url.query
+
+    etag = f'"{archive_cache.strip_hash(content_hash)}-{hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    found = await net_pool.run(replay.record, content_hash, url)
+    if found is None:
+        raise HTTPException(404, f"{url} is not in archive {content_hash}")
+    status, headers, body, _ = found
+
+    prefix = REPLAY_PREFIX + archive_cache.strip_hash(content_hash) + "/"
+    content_type = "application/octet-stream"
+    response_headers = {}
+    for name, value in headers:
+        lowered = name.lower()
+        if lowered == "content-type":
+            content_type = value
+        elif lowered == "location":
+            response_headers["Location"] = prefix + urljoin(url, value)
+        elif lowered not in ("etag", "cache-control", "expires", "last-modified", "date", "vary"):
+            response_headers[name] = value
+
+    body = bwa_replay.rewrite(body, content_type, url, prefix.encode("utf-8"))
+    response_headers["ETag"] = etag
+    response_headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return Response(body, status_code=status, media_type=content_type, headers=response_headers)
 
 
 async def run_crawl(crawl):
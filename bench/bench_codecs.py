@@ -0,0 +1,137 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# Compare bundle packing codecs on real captures.
+#
+#   python -m bench.bench_codecs                      # every capture under jobs/manifest/*.d
+#   python -m bench.bench_codecs path/to/job.d ... --levels 3 10 19 -o codecs.json
+#
+# For each capture and variant this reports the CPU time to pack the bundle, the ZIP size
+# and the base64 size actually sent to QDN. The zstd variants need the 'zstandard' package.
+
+import io
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import base64
+import zipfile
+import argparse
+from crawler import bwa_codec
+from crawler.bwa_delta import bwa_delta
+
+MEMBERS = [
+    "metadata/crawl.log",
+    "metadata/job.json",
+    "metadata/snapshot.html",
+    "metadata/snapshot.png",
+]
+
+
+def read_members(capture):
+    files = {}
+    for member in ["warc/crawl.warc.gz", *MEMBERS]:
+        path = os.path.join(capture, member)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                files[member] = f.read()
+    return files
+
+
+def warc_to_zstd(warc_gz, level):
+    # re-encode a per-record gzip WARC as one zstd frame per record
+    out = io.BytesIO()
+    for entry in bwa_delta.scan(io.BytesIO(warc_gz)):
+        record = gzip.decompress(warc_gz[entry["offset"]:entry["offset"] + entry["length"]])
+        out.write(bwa_codec.compress_warc_record(record, level))
+    return out.getvalue()
+
+
+def pack(files, variant, level):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for member, data in files.items():
+            if variant == "legacy":
+                # everything deflated, as publish() used to do
+                zip_file.writestr(member, data)
+            elif variant == "stored-aware":
+                bwa_codec.write_member(zip_file, member, data, codec="deflate")
+            elif variant == "zstd-bundle":
+                bwa_codec.write_member(zip_file, member, data, codec="zstd", level=level)
+            elif variant == "zstd-warc+bundle":
+                if member == "warc/crawl.warc.gz":
+                    member, data = bwa_codec.warc_member("zstd"), warc_to_zstd(data, level)
+                bwa_codec.write_member(zip_file, member, data, codec="zstd", level=level)
+    return buffer.getvalue()
+
+
+def measure(files, variant, level):
+    started = time.process_time()
+    bundle = pack(files, variant, level)
+    encoded = base64.b64encode(bundle)
+    return {
+        "variant": variant,
+        "level": level,
+        "cpu_seconds": round(time.process_time() - started, 4),
+        "zip_bytes": len(bundle),
+        "base64_bytes": len(encoded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bundle codecs on real captures")
+    parser.add_argument("captures", nargs="*", help="capture directories (default: jobs/manifest/*.d)")
+    parser.add_argument("--levels", type=int, nargs="+", default=[3, 10, 19], help="zstd levels to try")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    captures = args.captures or sorted(glob.glob("jobs/manifest/*.d"))
+    if not captures:
+        parser.error("no captures found")
+
+    variants = [("legacy", None), ("stored-aware", None)]
+    if bwa_codec.zstandard is not None:
+        for level in args.levels:
+            variants += [("zstd-bundle", level), ("zstd-warc+bundle", level)]
+    else:
+        print("zstandard not installed, skipping zstd variants", file=sys.stderr)
+
+    results = []
+    for capture in captures:
+        files = read_members(capture)
+        if "warc/crawl.warc.gz" not in files:
+            continue
+        raw_bytes = sum(len(data) for data in files.values())
+        for variant, level in variants:
+            result = measure(files, variant, level)
+            result.update({"capture": capture, "raw_bytes": raw_bytes})
+            results.append(result)
+            print(f"{os.path.basename(capture):40} {variant:18} {str(level or ''):>3} "
+                  f"cpu {result['cpu_seconds']:8.4f}s  zip {result['zip_bytes']:>10}  b64 {result['base64_bytes']:>10}")
+
+    totals = {}
+    for result in results:
+        key = f"{result['variant']}:{result['level'] or ''}"
+        total = totals.setdefault(key, {"cpu_seconds": 0.0, "zip_bytes": 0, "base64_bytes": 0})
+        for field in total:
+            total[field] += result[field]
+    print(json.dumps(totals, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "totals": totals}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# End-to-end crawl benchmark against local fixtures, no network needed.
+#
+#   python -m bench.bench_crawl -o baseline.json
+#   python -m bench.bench_crawl --profiles static js --pages 20 --workers 4 -o run.json
+#   python -m bench.bench_crawl --compare baseline.json --tolerance 0.15
+#
+# A fixture site (bench.fixtures) and a QDN stand-in (bench.qdn_server) are started on
+# free ports, and the pipeline runs in a scratch directory:
+#   crawl    crawler.run() for every fixture page, WORKERS at a time on the browser pool
+#   publish  bwa_manifest.publish() of every capture to the QDN stand-in
+#   fetch    get_most_recent_zip() of every page with an empty cache
+# Each phase reports pages/sec and p50/p95/max latency; the run also reports the peak
+# RSS of this process and its browsers, and the bytes written to disk and uploaded.
+# With --compare, the run fails (exit 1) when a figure regressed by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from bench.fixtures import fixture_site, fixture_server, PROFILES
+from bench.qdn_server import qdn_server
+
+# figures compared by --compare, and whether higher is better
+COMPARED = {
+    "pages_per_sec": True,
+    "p50": False,
+    "p95": False,
+}
+
+
+def url_key(url):
+    # same key as backend.api.url_key
+    return "url-sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def percentile(values, pct):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return round(ordered[int(rank) - 1], 4)
+
+
+def summarize(latencies, seconds, failures):
+    return {
+        "pages": len(latencies),
+        "failed": failures,
+        "seconds": round(seconds, 4),
+        "pages_per_sec": round(len(latencies) / seconds, 3) if seconds else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": round(max(latencies), 4) if latencies else None,
+    }
+
+
+def disk_usage(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class rss_sampler:
+    def __init__(self, interval = 0.25):
+        """
+        Track the peak resident memory of this process and its children.
+        """
+        from crawler.bwa_trace import tree_rss
+        self.tree_rss = tree_rss
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.tree_rss())
+            self.stopped.wait(self.interval)
+
+    def phase(self):
+        # start a new phase, returning the peak of the previous one
+        peak, self.peak = self.peak, self.tree_rss()
+        return peak
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+async def crawl_phase(urls, workers):
+    from crawler.bwa_crawl import crawler
+    from crawler.bwa_jobqueue import async_job_queue
+    from crawler.bwa_browser import browsers
+    from urllib.parse import urlparse
+
+    jobs = async_job_queue()
+    slots = asyncio.Semaphore(workers)
+    latencies, crawled, failures = [], {}, 0
+
+    async def one(url):
+        nonlocal failures
+        async with slots:
+            job_id = await jobs.create_job({
+                "status": "queued",
+                "message": "",
+                "url": url,
+                "url_hash": url_key(url),
+                "domain": urlparse(url).netloc,
+                "depth": 0,
+                "assets": True,
+            })
+            started = time.perf_counter()
+            await crawler(job_id).run()
+            seconds = time.perf_counter() - started
+            job = await jobs.get_job(job_id)
+            if job and job.get("status") == "crawled":
+                latencies.append(seconds)
+                crawled[job_id] = url
+            else:
+                failures += 1
+                logging.warning(f"Crawl of {url} failed: {job and job.get('message')}")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(url) for url in urls))
+    finally:
+        await browsers.close()
+    return summarize(latencies, time.perf_counter() - started, failures), crawled
+
+
+def publish_phase(crawled):
+    from crawler.bwa_manifest import bwa_manifest
+
+    latencies, failures, uploaded = [], 0, 0
+    started = time.perf_counter()
+    for job_id, url in crawled.items():
+        manifest = bwa_manifest(job_id)
+        began = time.perf_counter()
+        try:
+            published = manifest.publish(url_key(url))
+        except Exception as e:
+            logging.warning(f"Publish of {url} failed: {e}")
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+        uploaded += manifest.published_bytes
+        if published is None:
+            failures += 1
+    return summarize(latencies, time.perf_counter() - started, failures), uploaded
+
+
+def fetch_phase(urls):
+    from crawler.bwa_manifest import bwa_manifest
+
+    latencies, failures = [], 0
+    started = time.perf_counter()
+    for url in urls:
+        began = time.perf_counter()
+        content_hash = bwa_manifest(None).get_most_recent_zip(url_key(url))
+        if content_hash:
+            latencies.append(time.perf_counter() - began)
+        else:
+            failures += 1
+    return summarize(latencies, time.perf_counter() - started, failures)
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def run(args):
+    site = fixture_site(seed=args.seed, pages=args.pages, media_px=args.media_px)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bwa-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    previous_cwd = os.getcwd()
+
+    with fixture_server(site) as fixtures, qdn_server() as qdn:
+        # every pipeline path is relative to the working directory
+        os.chdir(workdir)
+        try:
+            from crawler.bwa_manifest import bwa_manifest
+            bwa_manifest.QDN_API_BASE = qdn.url
+            urls = site.urls(fixtures.url, args.profiles, args.pages)
+
+            with rss_sampler() as sampler:
+                crawl, crawled = asyncio.run(crawl_phase(urls, args.workers))
+                crawl["peak_rss"] = sampler.phase()
+                captured = disk_usage("jobs/manifest")
+
+                publish, uploaded = publish_phase(crawled)
+                publish["peak_rss"] = sampler.phase()
+
+                # fetch from QDN, not from the cache publish() just seeded
+                shutil.rmtree("jobs/cache", ignore_errors=True)
+                fetch = fetch_phase(list(crawled.values()))
+                fetch["peak_rss"] = sampler.phase()
+                cached = disk_usage("jobs/cache")
+        finally:
+            os.chdir(previous_cwd)
+            if not args.keep and not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "profiles": list(args.profiles),
+            "pages": args.pages,
+            "workers": args.workers,
+            "seed": args.seed,
+            "media_px": args.media_px,
+            "urls": len(urls),
+        },
+        "environment": environment(),
+        "phases": {"crawl": crawl, "publish": publish, "fetch": fetch},
+        "peak_rss": max(crawl["peak_rss"], publish["peak_rss"], fetch["peak_rss"]),
+        "bytes": {"captured": captured, "uploaded": uploaded, "cached": cached},
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    Return the figures of result that are worse than baseline by more than tolerance.
+    """
+    regressions = []
+    checks = [(f"phases.{phase}.{field}", higher, result["phases"][phase].get(field), stats.get(field))
+              for phase, stats in baseline.get("phases", {}).items() if phase in result["phases"]
+              for field, higher in COMPARED.items()]
+    checks.append(("peak_rss", False, result.get("peak_rss"), baseline.get("peak_rss")))
+    checks += [(f"bytes.{name}", False, result["bytes"].get(name), value)
+               for name, value in baseline.get("bytes", {}).items()]
+    for name, higher, now, before in checks:
+        if not now or not before:
+            continue
+        change = (now - before) / before
+        worse = -change if higher else change
+        print(f"{name:32} {before:>14} -> {now:>14}  {change:+.1%}")
+        if worse > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawl, publish and fetch against local fixtures")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=PROFILES, help="fixture profiles to crawl")
+    parser.add_argument("--pages", type=int, default=10, help="pages per profile")
+    parser.add_argument("--workers", type=int, default=2, help="concurrent crawls")
+    parser.add_argument("--seed", type=int, default=1, help="fixture seed")
+    parser.add_argument("--media-px", type=int, default=1024, help="size of the media profile's images")
+    parser.add_argument("--workdir", help="run here instead of a temporary directory (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show pipeline logs")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
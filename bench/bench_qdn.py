@@ -0,0 +1,221 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# QDN lookup and publish scalability against the local stand-in (bench.qdn_server).
+#
+#   python -m bench.bench_qdn --resources 1000 10000 30000 -o qdn.json
+#   python -m bench.bench_qdn --resources 5000 --latency 0.02 --bandwidth 1000000 --error-rate 0.01
+#
+# For every resource count a fresh stand-in is seeded and, in a scratch directory:
+#   list         one raw resource listing
+#   cold_lookup  get_most_recent_zip() with an empty cache (downloads every bundle once)
+#   warm_lookup  get_most_recent_zip() of other url_keys, bundles cached, key map empty
+#   batch_hashes get_latest_hashes() for every published url_key in one scan
+#   publish      publish(scan=False) of synthetic captures, --workers at a time
+#   large        with --large-mb, publish and cold fetch of one capture that large,
+#                in BWA_CHUNK_SIZE pieces over BWA_CHUNK_WORKERS transfers (see bwa_chunks)
+# The server's own request, byte and error counts are reported beside the timings.
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import logging
+import argparse
+import tempfile
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from bench.bench_crawl import url_key, summarize, environment
+from bench.qdn_server import qdn_server, qdn_store, synthetic_warc, SERVICE, NAME
+
+
+def make_capture(index, screenshot_bytes = 2048):
+    """
+    Write a capture into jobs/manifest and queue its job, as a finished crawl would.
+
+    :param screenshot_bytes: Size of its incompressible screenshot, which sets the bundle size
+    :returns: (job_id, url)
+    """
+    from crawler.bwa_jobqueue import job_queue
+
+    url = f"https://publish.invalid/{index}"
+    job_id = job_queue().create_job({"status": "crawled", "message": "", "url": url, "url_hash": url_key(url),
+                                     "domain": "publish.invalid", "depth": 0, "assets": True})
+    basedir = os.path.join("jobs/manifest", f"{job_id}.d")
+    files = {
+        # offset keeps these WARCs apart from the seeded ones
+        "warc/crawl.warc.gz": synthetic_warc(10 ** 9 + index),
+        "metadata/job.json": json.dumps({"url": url}).encode(),
+        "metadata/crawl.log": b"",
+        "metadata/snapshot.html": f"<html><body>{index}</body></html>".encode(),
+        "metadata/snapshot.png": os.urandom(screenshot_bytes),
+    }
+    for member, data in files.items():
+        path = os.path.join(basedir, member)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return job_id, url
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def run_size(args, resources):
+    from crawler.bwa_manifest import bwa_manifest
+
+    store = qdn_store()
+    url_keys = args.url_keys or max(1, resources // 4)
+    _, seed_seconds = timed(store.seed, resources, url_keys)
+    keys = [url_key(f"https://synthetic.invalid/page/{key}") for key in range(min(url_keys, resources))]
+    picks = random.Random(args.seed).sample(keys, min(len(keys), args.lookups + 1))
+
+    result = {"resources": resources, "url_keys": len(keys), "seed_seconds": round(seed_seconds, 3)}
+    with qdn_server(store, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+                    error_rate=args.error_rate, seed=args.seed) as qdn:
+        bwa_manifest.QDN_API_BASE = qdn.url
+
+        response, seconds = timed(requests.get, f"{qdn.url}/arbitrary/resources", {"service": SERVICE, "name": NAME})
+        result["list"] = {"seconds": round(seconds, 4), "bytes": len(response.content)}
+
+        qdn.reset()
+        found, seconds = timed(bwa_manifest(None).get_most_recent_zip, picks[0])
+        result["cold_lookup"] = {"seconds": round(seconds, 4), "found": bool(found), "server": qdn.stats()}
+
+        qdn.reset()
+        latencies, failures = [], 0
+        started = time.perf_counter()
+        for key in picks[1:]:
+            found, seconds = timed(bwa_manifest(None).get_most_recent_zip, key)
+            if found:
+                latencies.append(seconds)
+            else:
+                failures += 1
+        result["warm_lookup"] = {**summarize(latencies, time.perf_counter() - started, failures), "server": qdn.stats()}
+
+        captures = [make_capture(index) for index in range(args.publishes)]
+        qdn.reset()
+        _, seconds = timed(bwa_manifest(None).get_latest_hashes, [url_key(url) for _, url in captures])
+        result["batch_hashes"] = {"seconds": round(seconds, 4), "server": qdn.stats()}
+
+        def publish(capture):
+            job_id, url = capture
+            manifest = bwa_manifest(job_id)
+            try:
+                published, seconds = timed(manifest.publish, url_key(url), None, False)
+            except Exception as e:
+                logging.warning(f"Publish of {url} failed: {e}")
+                return None
+            return seconds if published else None
+
+        qdn.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.workers) as pool:
+            outcomes = list(pool.map(publish, captures))
+        latencies = [seconds for seconds in outcomes if seconds is not None]
+        result["publish"] = {**summarize(latencies, time.perf_counter() - started, len(outcomes) - len(latencies)),
+                             "server": qdn.stats()}
+
+        if args.large_mb:
+            result["large"] = large_transfer(args.large_mb, qdn)
+    return result
+
+
+def large_transfer(megabytes, qdn):
+    """
+    Publish one large capture and fetch it back with an empty cache.
+    """
+    from crawler.bwa_manifest import bwa_manifest
+    from crawler import bwa_chunks
+
+    job_id, url = make_capture(10 ** 6, megabytes * 1024 * 1024)
+    manifest = bwa_manifest(job_id)
+    qdn.reset()
+    published, publish_seconds = timed(manifest.publish, url_key(url), None, False)
+    upload = qdn.stats()
+
+    shutil.rmtree("jobs/cache", ignore_errors=True)
+    qdn.reset()
+    path, fetch_seconds = timed(bwa_manifest(None).fetch_bundle, published["content_hash"])
+    size = os.path.getsize(path) if path else 0
+    return {
+        "bundle_bytes": size,
+        "chunk_size": bwa_chunks.CHUNK_SIZE,
+        "chunk_workers": bwa_chunks.WORKERS,
+        "publish_seconds": round(publish_seconds, 3),
+        "publish_mib_per_sec": round(size / 2**20 / publish_seconds, 2) if size else None,
+        "fetch_seconds": round(fetch_seconds, 3),
+        "fetch_mib_per_sec": round(size / 2**20 / fetch_seconds, 2) if size else None,
+        "server": {"upload": upload, "fetch": qdn.stats()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QDN lookups and publishes against the local stand-in")
+    parser.add_argument("--resources", type=int, nargs="+", default=[1000, 10000], help="resource counts to try")
+    parser.add_argument("--url-keys", type=int, help="url_keys the resources are spread over (default: resources / 4)")
+    parser.add_argument("--lookups", type=int, default=5, help="warm lookups per resource count")
+    parser.add_argument("--publishes", type=int, default=20, help="captures published per resource count")
+    parser.add_argument("--workers", type=int, default=2, help="concurrent publishes")
+    parser.add_argument("--large-mb", type=int, default=0, help="also publish and fetch one capture of this many MiB")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stand-in adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds, up to this much")
+    parser.add_argument("--bandwidth", type=int, help="stand-in bytes per second per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in requests failing with 503")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-v", "--verbose", action="store_true", help="show pipeline logs")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    previous_cwd = os.getcwd()
+    results = []
+    for resources in args.resources:
+        workdir = tempfile.mkdtemp(prefix="bwa-qdn-")
+        os.chdir(workdir)
+        try:
+            result = run_size(args, resources)
+        finally:
+            os.chdir(previous_cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append(result)
+        print(f"{resources:>7} resources  list {result['list']['seconds']:7.3f}s  "
+              f"cold {result['cold_lookup']['seconds']:8.3f}s  warm p50 {result['warm_lookup']['p50']}s  "
+              f"batch {result['batch_hashes']['seconds']:7.3f}s  publish p50 {result['publish']['p50']}s "
+              f"({result['publish']['pages_per_sec']}/s)")
+        if "large" in result:
+            large = result["large"]
+            print(f"{'':>7} large bundle {large['bundle_bytes'] / 2**20:.1f} MiB  publish {large['publish_seconds']}s "
+                  f"({large['publish_mib_per_sec']} MiB/s)  fetch {large['fetch_seconds']}s ({large['fetch_mib_per_sec']} MiB/s)")
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "environment": environment(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
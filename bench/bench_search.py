@@ -0,0 +1,136 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# Measure the search index at archive scale on synthetic pages.
+#
+#   python -m bench.bench_search                               # 100000 versions
+#   python -m bench.bench_search -n 300000 --words 400 -o search.json
+#
+# Builds a fresh index in a temporary directory from pages of Zipf-distributed words,
+# then reports indexing throughput, the database size and the latency percentiles of
+# single word, multi word, prefix and phrase queries.
+
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+from crawler.bwa_search import search_index
+
+
+def percentile(values, pct):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return round(ordered[int(rank) - 1], 4)
+
+
+def vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def pages(count, words, vocab, rng):
+    # Zipf-like word frequencies, as in real text
+    cum_weights, total = [], 0.0
+    for rank in range(len(vocab)):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    for n in range(count):
+        body = rng.choices(vocab, cum_weights=cum_weights, k=words)
+        url = f"https://site{n % 1000}.example/{'/'.join(rng.choices(vocab, k=2))}"
+        yield {
+            "content_hash": "sha256:" + hashlib.sha256(f"{n}".encode()).hexdigest(),
+            "url_key": "url-sha256:" + hashlib.sha256(url.encode()).hexdigest(),
+            "url": url,
+            "job_id": f"{n:032x}",
+            "captured_at": time.time(),
+            "title": " ".join(body[:6]),
+            "text": " ".join(body),
+        }
+
+
+def queries(vocab, rng, count):
+    # common, mid and rare words mixed into the query shapes the API sees
+    common, rare = vocab[:200], vocab[200:5000]
+    shapes = {
+        "word": lambda: rng.choice(rare),
+        "two words": lambda: f"{rng.choice(common)} {rng.choice(rare)}",
+        "prefix": lambda: rng.choice(rare)[:4] + "*",
+        "phrase": lambda: f'"{rng.choice(common)} {rng.choice(common)}"',
+        "common word": lambda: rng.choice(common[:20]),
+    }
+    return {shape: [make() for _ in range(count)] for shape, make in shapes.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--versions", type=int, default=100000, help="versions to index")
+    parser.add_argument("--words", type=int, default=250, help="words per page")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    parser.add_argument("--queries", type=int, default=200, help="queries per shape")
+    parser.add_argument("--limit", type=int, default=20, help="hits per query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = vocabulary(args.vocabulary, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = search_index(os.path.join(tmp, "search.db"))
+        started = time.perf_counter()
+        batch = []
+        for doc in pages(args.versions, args.words, vocab, rng):
+            batch.append(doc)
+            if len(batch) == 1000:
+                index.add(batch)
+                batch = []
+        index.add(batch)
+        build_seconds = time.perf_counter() - started
+
+        results = {
+            "versions": index.count(),
+            "words_per_page": args.words,
+            "build_seconds": round(build_seconds, 2),
+            "versions_per_second": round(args.versions / build_seconds, 1),
+            "db_bytes": sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)),
+            "queries": {},
+        }
+        for shape, texts in queries(vocab, rng, args.queries).items():
+            latencies, hits = [], 0
+            for text in texts:
+                started = time.perf_counter()
+                hits += len(index.search(text, limit=args.limit))
+                latencies.append((time.perf_counter() - started) * 1000)
+            results["queries"][shape] = {
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "mean_hits": round(hits / len(texts), 1),
+            }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# Measure how fast an API process starts and how much memory it holds.
+#
+#   python -m bench.bench_startup -o baseline.json
+#   python -m bench.bench_startup --runs 20 --requests 200 --pipeline 0
+#   python -m bench.bench_startup --modules crawler.bwa_crawl crawler.bwa_manifest
+#   python -m bench.bench_startup --compare baseline.json --tolerance 0.15
+#
+# For every role (BWA_PIPELINE=0 replica, BWA_PIPELINE=1 pipeline process), in fresh
+# interpreters and an empty scratch directory:
+#   import  time and RSS of "import backend.api", and which heavy modules it loaded
+#   serve   uvicorn until GET /pools answers, RSS when idle and after --requests job polls
+# --modules measures plain imports of other modules the same way. A bare interpreter is
+# measured too, as the floor every figure includes.
+# With --compare, the run fails (exit 1) when a figure regressed by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from bench.bench_crawl import environment
+from crawler.bwa_trace import rss
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules a lightweight API process should not load
+HEAVY = [
+    "playwright", "aiofiles", "requests", "PIL",
+    "crawler.bwa_crawl", "crawler.bwa_browser", "crawler.bwa_manifest", "crawler.bwa_publish",
+]
+
+# figures compared by --compare, lower is better for all of them
+COMPARED = ["import_ms_p50", "import_rss_mib", "ready_ms_p50", "idle_rss_mib", "busy_rss_mib"]
+
+# runs in the fresh interpreter; reports import time, RSS and the modules now loaded
+CHILD = """
+import os, sys, json, time
+started = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+seconds = time.perf_counter() - started
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+print(json.dumps({"seconds": seconds, "rss": rss, "modules": sorted(sys.modules)}))
+"""
+
+
+def percentile(values, pct):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return round(ordered[int(rank) - 1], 4)
+
+
+def mib(value):
+    return round(value / 2**20, 1) if value else None
+
+
+def child_env(pipeline):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    if pipeline is not None:
+        env["BWA_PIPELINE"] = str(pipeline)
+    return env
+
+
+def measure_import(modules, pipeline, runs, workdir):
+    """
+    Import modules in fresh interpreters.
+
+    :returns: dict with import_ms_p50/p95, import_rss_mib and the HEAVY modules loaded
+    """
+    seconds, sizes, loaded = [], [], set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", CHILD, *modules], cwd=workdir, env=child_env(pipeline),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"import {' '.join(modules) or '(none)'} failed: {result.stderr.strip().splitlines()[-1:]}")
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        seconds.append(report["seconds"] * 1000)
+        sizes.append(report["rss"])
+        loaded |= {name for name in HEAVY if name in report["modules"]}
+    return {
+        "import_ms_p50": percentile(seconds, 50),
+        "import_ms_p95": percentile(seconds, 95),
+        "import_rss_mib": mib(percentile(sizes, 50)),
+        "heavy_loaded": sorted(loaded),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url, data = None, timeout = 5):
+    body = json.dumps(data).encode() if data is not None else None
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+def measure_serve(pipeline, runs, requests, workdir, timeout):
+    """
+    Start uvicorn with the API until it answers, then poll jobs.
+
+    :returns: dict with ready_ms_p50/p95, idle_rss_mib and busy_rss_mib
+    """
+    ready, idle, busy = [], [], []
+    for _ in range(runs):
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(port), "--log-level", "warning"],
+                                   cwd=workdir, env=child_env(pipeline), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited: {process.stderr.read().decode(errors='replace').strip()[-500:]}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"API not ready after {timeout}s")
+                try:
+                    if get(base + "/pools", timeout=1)[0] == 200:
+                        break
+                except OSError:
+                    time.sleep(0.01)
+            ready.append((time.perf_counter() - started) * 1000)
+            idle.append(rss(process.pid))
+            for _ in range(requests):
+                get(base + "/job", {"op": "jobs", "limit": 20})
+            busy.append(rss(process.pid))
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    return {
+        "ready_ms_p50": percentile(ready, 50),
+        "ready_ms_p95": percentile(ready, 95),
+        "idle_rss_mib": mib(percentile(idle, 50)),
+        "busy_rss_mib": mib(percentile(busy, 50)),
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="bwa-startup-")
+    try:
+        results = {
+            "config": {"runs": args.runs, "requests": args.requests, "pipeline": args.pipeline},
+            "environment": environment(),
+            "interpreter": measure_import([], None, args.runs, workdir),
+            "roles": {},
+            "modules": {},
+        }
+        for pipeline in args.pipeline:
+            role = "replica" if pipeline == 0 else "pipeline"
+            # every run starts from an empty jobs/ directory
+            shutil.rmtree(os.path.join(workdir, "jobs"), ignore_errors=True)
+            figures = measure_import(["backend.api"], pipeline, args.runs, workdir)
+            if not args.no_serve:
+                figures.update(measure_serve(pipeline, args.runs, args.requests, workdir, args.timeout))
+            results["roles"][role] = figures
+        for name in args.modules:
+            results["modules"][name] = measure_import([name], None, args.runs, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(result, baseline, tolerance):
+    """
+    Return the figures of result that are worse than baseline by more than tolerance.
+    """
+    regressions = []
+    checks = [(f"{group}.{name}.{field}", result[group][name].get(field), figures.get(field))
+              for group in ("roles", "modules")
+              for name, figures in baseline.get(group, {}).items() if name in result[group]
+              for field in COMPARED]
+    for name, now, before in checks:
+        if not now or not before:
+            continue
+        change = (now - before) / before
+        print(f"{name:40} {before:>10} -> {now:>10}  {change:+.1%}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API startup time and memory per process")
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes per measurement")
+    parser.add_argument("--requests", type=int, default=100, help="job polls before the busy RSS is taken")
+    parser.add_argument("--pipeline", type=int, nargs="*", default=[0, 1], choices=[0, 1], help="BWA_PIPELINE roles to measure, none for --modules only")
+    parser.add_argument("--modules", nargs="*", default=[], help="also measure plain imports of these modules")
+    parser.add_argument("--no-serve", action="store_true", help="measure imports only, without uvicorn")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for the API to answer")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
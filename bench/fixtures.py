@@ -0,0 +1,277 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# Generated fixture sites served from memory, for reproducible crawl benchmarks.
+#
+#   python -m bench.fixtures --port 8800          # browse http://127.0.0.1:8800/
+#
+# Every page is derived from (seed, path), so two runs with the same seed serve the same
+# bytes. Profiles:
+#   static  - text pages with a few links and one stylesheet
+#   js      - pages built client-side by scripts that fetch JSON
+#   media   - pages with large, incompressible images
+#   deep    - a link tree DEPTH levels deep (every page links to its children)
+#   shared  - pages that all pull the same set of shared CSS/JS/images
+
+import zlib
+import json
+import random
+import struct
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PROFILES = ("static", "js", "media", "deep", "shared")
+
+WORDS = (
+    "archive qortal network data snapshot crawler capture replay bundle manifest delta warc "
+    "record page screenshot browser chain version content hash index cache node peer block"
+).split()
+
+
+def png(width, height, seed):
+    """
+    Return a valid RGB PNG filled with seeded noise, so it does not compress.
+    """
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b"")
+
+
+class fixture_site:
+    def __init__(self, seed = 1, pages = 50, depth = 4, fanout = 3, media_px = 1024, shared_assets = 20):
+        """
+        A deterministic set of fixture pages.
+
+        :param seed: Seed for every generated byte
+        :param pages: Pages per profile
+        :param depth: Levels of the deep profile's link tree
+        :param fanout: Children per page in the deep profile
+        :param media_px: Width and height of the media profile's images
+        :param shared_assets: Number of assets every shared page references
+        """
+        self.seed = seed
+        self.pages = pages
+        self.depth = depth
+        self.fanout = fanout
+        self.media_px = media_px
+        self.shared_assets = shared_assets
+        self.cache = {}
+        self.lock = threading.Lock()
+
+
+    def urls(self, base, profiles = PROFILES, count = None):
+        """
+        Return the page URLs of the given profiles.
+
+        :param base: Server root, e.g. "http://127.0.0.1:8800"
+        :param profiles: Profiles to include
+        :param count: Pages per profile, defaults to the site's page count
+        """
+        count = count or self.pages
+        urls = []
+        for profile in profiles:
+            if profile == "deep":
+                # walk the tree breadth first until count pages are listed
+                queue, paths = [()], []
+                while queue and len(paths) < count:
+                    node = queue.pop(0)
+                    paths.append(self._deep_path(node))
+                    if len(node) < self.depth:
+                        queue += [node + (child,) for child in range(self.fanout)]
+                urls += [base + path for path in paths]
+            else:
+                urls += [f"{base}/{profile}/{i}.html" for i in range(count)]
+        return urls
+
+
+    @staticmethod
+    def _deep_path(node):
+        return "/deep/" + "".join(f"{child}/" for child in node) + "index.html"
+
+
+    def _text(self, rng, words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+    def _page(self, title, body, head = ""):
+        return (f"<!doctype html><html><head><meta charset=\"utf-8\"><title>{title}</title>{head}</head>"
+                f"<body><h1>{title}</h1>{body}</body></html>").encode("utf-8")
+
+
+    def render(self, path):
+        """
+        Return (content_type, body) for a path, or None if it does not exist.
+        """
+        with self.lock:
+            hit = self.cache.get(path)
+        if hit is not None:
+            return hit
+        result = self._render(path)
+        # keep generated bodies, large images are expensive to build
+        if result is not None:
+            with self.lock:
+                self.cache[path] = result
+        return result
+
+
+    def _render(self, path):
+        rng = random.Random(f"{self.seed}:{path}")
+        parts = path.strip("/").split("/")
+        name = parts[-1]
+        stem = name.rsplit(".", 1)[0]
+
+        if path in ("/", "/index.html"):
+            links = "".join(f'<li><a href="/{profile}/0.html">{profile}</a></li>' for profile in PROFILES if profile != "deep")
+            return "text/html", self._page("Fixtures", f'<ul>{links}<li><a href="/deep/index.html">deep</a></li></ul>')
+
+        if parts[0] == "assets":
+            if name.endswith(".css"):
+                return "text/css", f"body{{font-family:sans-serif;color:#{rng.randrange(1 << 24):06x}}}\n/* {self._text(rng, 400)} */".encode()
+            if name.endswith(".js"):
+                return "application/javascript", (f"/* {self._text(rng, 300)} */\n"
+                    "document.addEventListener('DOMContentLoaded',function(){var d=document.createElement('div');"
+                    f"d.textContent='{stem}';document.body.appendChild(d);}});").encode()
+            if name.endswith(".png"):
+                return "image/png", png(64, 64, f"{self.seed}:{path}")
+            return None
+
+        if parts[0] == "api" and name.endswith(".json"):
+            items = [{"id": i, "title": self._text(rng, 6), "body": self._text(rng, 40)} for i in range(50)]
+            return "application/json", json.dumps(items).encode()
+
+        if parts[0] == "media" and name.endswith(".png"):
+            return "image/png", png(self.media_px, self.media_px, f"{self.seed}:{path}")
+
+        if not stem.isdigit() and parts[0] != "deep":
+            return None
+
+        if parts[0] == "static":
+            i = int(stem)
+            links = "".join(f'<a href="/static/{(i + k) % self.pages}.html">next {k}</a> ' for k in range(1, 4))
+            body = "".join(f"<p>{self._text(rng, 120)}</p>" for _ in range(8))
+            return "text/html", self._page(f"Static {i}", body + links, '<link rel="stylesheet" href="/assets/site.css">')
+
+        if parts[0] == "js":
+            i = int(stem)
+            script = (
+                f"<script>fetch('/api/items-{i}.json').then(r=>r.json()).then(items=>{{"
+                "const ul=document.createElement('ul');"
+                "for(const it of items){const li=document.createElement('li');li.innerHTML='<b>'+it.title+'</b> '+it.body;ul.appendChild(li);}"
+                "document.body.appendChild(ul);});</script>"
+            )
+            scripts = "".join(f'<script src="/assets/app-{k}.js"></script>' for k in range(5))
+            return "text/html", self._page(f"JS {i}", f'<div id="app"></div>{scripts}{script}')
+
+        if parts[0] == "media":
+            i = int(stem)
+            images = "".join(f'<img src="/media/img-{i}-{k}.png" width="400">' for k in range(3))
+            return "text/html", self._page(f"Media {i}", f"<p>{self._text(rng, 40)}</p>{images}")
+
+        if parts[0] == "shared":
+            i = int(stem)
+            head = "".join(f'<link rel="stylesheet" href="/assets/shared-{k}.css">' for k in range(self.shared_assets // 2))
+            assets = "".join(f'<script src="/assets/shared-{k}.js"></script>' for k in range(self.shared_assets // 4))
+            images = "".join(f'<img src="/assets/shared-{k}.png">' for k in range(self.shared_assets // 4))
+            return "text/html", self._page(f"Shared {i}", f"<p>{self._text(rng, 80)}</p>{assets}{images}", head)
+
+        if parts[0] == "deep" and name == "index.html":
+            node = tuple(int(part) for part in parts[1:-1] if part.isdigit())
+            if len(node) != len(parts) - 2 or len(node) > self.depth:
+                return None
+            children = ""
+            if len(node) < self.depth:
+                children = "".join(f'<a href="{self._deep_path(node + (child,))}">child {child}</a> ' for child in range(self.fanout))
+            return "text/html", self._page(f"Deep {'/'.join(map(str, node)) or 'root'}", f"<p>{self._text(rng, 60)}</p>{children}")
+
+        return None
+
+
+class fixture_server:
+    def __init__(self, site = None, host = "127.0.0.1", port = 0):
+        """
+        Serve a fixture_site over HTTP from a background thread.
+
+        :param site: The fixture_site, a default one is created if omitted
+        :param host: Interface to bind
+        :param port: Port to bind, 0 picks a free one
+        """
+        self.site = site or fixture_site()
+        site = self.site
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                found = site.render(self.path.split("?", 1)[0])
+                if found is None:
+                    self.send_error(404)
+                    return
+                content_type, body = found
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "max-age=3600")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fixture-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated fixture sites")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    server = fixture_server(fixture_site(seed=args.seed, pages=args.pages), args.host, args.port)
+    print(f"Serving fixtures on {server.url}/")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# A local stand-in for the parts of the Qortal QDN API the pipeline uses:
+#
+#   GET  /arbitrary/resources?service=&name=              resource listing (identifier, limit,
+#                                                          offset and reverse are honoured too)
+#   GET  /arbitrary/<service>/<name>/<identifier>         raw resource bytes
+#   POST /arbitrary/<service>/<name>/<identifier>         the same (bwa_manifest uses POST)
+#   POST /arbitrary/<service>/<name>/<identifier>/zip     publish, JSON {"data": base64}
+#
+# and, for load tests only:
+#   GET  /_qdn/stats                                       requests, bytes and errors per endpoint
+#   POST /_qdn/reset                                       zero the counters
+#
+# Resources live in memory. Point the pipeline at it with QORTAL_API_URL, or set
+# bwa_manifest.QDN_API_BASE to qdn_server.url in-process.
+#
+#   python -m bench.qdn_server --port 62392 --resources 20000 --url-keys 2000 \
+#       --latency 0.05 --jitter 0.02 --bandwidth 2000000 --error-rate 0.01
+#
+# Seeded resources are valid archive bundles (manifest plus a one-record WARC that hashes
+# to the identifier), chained per url_key through previous_hash. Their bytes are rebuilt
+# on request, so tens of thousands of them cost a few MB. Latency, jitter and injected
+# errors draw from one seeded generator.
+
+import io
+import gzip
+import json
+import time
+import base64
+import random
+import hashlib
+import zipfile
+import argparse
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SERVICE = "WEBSITE_ARCHIVE"
+NAME = "big-web-archive"
+SEED_EPOCH = 1700000000
+
+
+def synthetic_warc(index):
+    """
+    Return a small, deterministic gzipped WARC response record.
+    """
+    url = f"https://synthetic.invalid/{index}"
+    payload = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html><body>synthetic {index}</body></html>".encode()
+    record = (
+        "WARC/1.0\r\n"
+        "WARC-Type: response\r\n"
+        f"WARC-Target-URI: {url}\r\n"
+        f"WARC-Date: {datetime.fromtimestamp(SEED_EPOCH + index, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+        f"WARC-Record-ID: <urn:uuid:{hashlib.md5(url.encode()).hexdigest()}>\r\n"
+        "Content-Type: application/http; msgtype=response\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n"
+    ).encode() + payload + b"\r\n\r\n"
+    # mtime=0 so the identifier does not depend on when the bundle is rebuilt
+    return gzip.compress(record, mtime=0)
+
+
+def synthetic_bundle(index, url_keys, previous_hash):
+    """
+    Return (identifier, zip bytes) of one seeded archive bundle.
+
+    :param index: Resource number
+    :param url_keys: Number of distinct url_keys resources are spread over
+    :param previous_hash: Identifier of the previous version of the same url_key, or None
+    """
+    warc = synthetic_warc(index)
+    identifier = hashlib.sha256(warc).hexdigest()
+    key = index % url_keys
+    url = f"https://synthetic.invalid/page/{key}"
+    manifest = {
+        "schema": "big-web-archive/v1",
+        "url_key": "url-sha256:" + hashlib.sha256(url.encode()).hexdigest(),
+        "target_url": url,
+        "domain": "synthetic.invalid",
+        "crawl_depth": 0,
+        "timestamp": datetime.fromtimestamp(SEED_EPOCH + index, timezone.utc).isoformat(),
+        "content_hash": "sha256:" + identifier,
+        "previous_hash": previous_hash and "sha256:" + previous_hash,
+        "warc": "warc/crawl.warc.gz",
+        "codec": {"warc": "gzip", "bundle": "deflate"},
+        "artifacts": {},
+        "digests": {"warc/crawl.warc.gz": "sha256:" + identifier},
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("manifest.json", json.dumps(manifest, indent=2))
+        zip_file.writestr("warc/crawl.warc.gz", warc, compress_type=zipfile.ZIP_STORED)
+    return identifier, buffer.getvalue()
+
+
+class qdn_store:
+    def __init__(self):
+        """
+        In-memory QDN resources keyed by (service, name, identifier).
+        """
+        self.resources = {}
+        self.lock = threading.Lock()
+
+    def put(self, service, name, identifier, data, created = None):
+        """
+        Add or replace a resource.
+
+        :param data: The resource bytes, or a callable returning them on each fetch
+        :param created: Creation time in ms, defaults to now
+        """
+        size = None if callable(data) else len(data)
+        with self.lock:
+            self.resources[(service, name, identifier)] = {
+                "service": service,
+                "name": name,
+                "identifier": identifier,
+                "size": size,
+                "created": created or int(time.time() * 1000),
+                "data": data,
+            }
+
+    def get(self, service, name, identifier):
+        with self.lock:
+            entry = self.resources.get((service, name, identifier))
+        if entry is None:
+            return None
+        return entry["data"]() if callable(entry["data"]) else entry["data"]
+
+    def listing(self, service = None, name = None, identifier = None):
+        """
+        Return resource entries without their data, oldest first.
+        """
+        with self.lock:
+            entries = list(self.resources.values())
+        return sorted(
+            ({key: value for key, value in entry.items() if key != "data" and value is not None}
+             for entry in entries
+             if (service is None or entry["service"] == service)
+             and (name is None or entry["name"] == name)
+             and (identifier is None or entry["identifier"] == identifier)),
+            key=lambda entry: (entry["created"], entry["identifier"]),
+        )
+
+    def seed(self, count, url_keys = None, service = SERVICE, name = NAME):
+        """
+        Add count synthetic archive bundles.
+
+        :param count: Number of resources
+        :param url_keys: Distinct url_keys they are versions of, defaults to count (one version each)
+        :returns: list of the seeded identifiers
+        """
+        url_keys = max(1, url_keys or count)
+        identifiers = []
+        for index in range(count):
+            previous = identifiers[index - url_keys] if index >= url_keys else None
+            identifier = hashlib.sha256(synthetic_warc(index)).hexdigest()
+            self.put(service, name, identifier,
+                     lambda index=index, previous=previous: synthetic_bundle(index, url_keys, previous)[1],
+                     created=(SEED_EPOCH + index) * 1000)
+            identifiers.append(identifier)
+        return identifiers
+
+    def clear(self):
+        with self.lock:
+            self.resources.clear()
+
+
+class qdn_server:
+    def __init__(self, store = None, host = "127.0.0.1", port = 0, latency = 0.0, jitter = 0.0,
+                 bandwidth = None, error_rate = 0.0, seed = 1):
+        """
+        Serve a qdn_store over HTTP from a background thread.
+
+        :param store: The qdn_store, a new empty one if omitted
+        :param host: Interface to bind
+        :param port: Port to bind, 0 picks a free one
+        :param latency: Seconds added before every response
+        :param jitter: Up to this many seconds added on top of latency, uniformly drawn
+        :param bandwidth: Bytes per second each request body and response is held to, None for no cap
+        :param error_rate: Fraction of QDN requests answered with 503
+        :param seed: Seed for jitter and injected errors
+        """
+        self.store = store or qdn_store()
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+        server = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 128
+        self.thread = None
+
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def count(self, endpoint, bytes_in = 0, bytes_out = 0, error = False, seconds = 0.0):
+        with self.counters_lock:
+            entry = self.counters.setdefault(endpoint, {"requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0})
+            entry["requests"] += 1
+            entry["errors"] += int(error)
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["seconds"] += seconds
+
+
+    def stats(self):
+        """
+        Return requests, errors, bytes and time spent per endpoint.
+        """
+        with self.counters_lock:
+            return {endpoint: {**entry, "seconds": round(entry["seconds"], 4)} for endpoint, entry in self.counters.items()}
+
+
+    def reset(self):
+        with self.counters_lock:
+            self.counters.clear()
+
+
+    def _throttle(self, size):
+        if self.bandwidth and size:
+            time.sleep(size / self.bandwidth)
+
+
+    def reply(self, request, status, body, content_type = "application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if not self.bandwidth:
+            request.wfile.write(body)
+            return
+        # paced in 16 KiB chunks so large bundles trickle like they would from a peer
+        for start in range(0, len(body), 16 * 1024):
+            chunk = body[start:start + 16 * 1024]
+            request.wfile.write(chunk)
+            self._throttle(len(chunk))
+
+
+    def route(self, method, parts):
+        if parts[:1] == ["_qdn"]:
+            return "admin"
+        if parts[:2] == ["arbitrary", "resources"] and method == "GET":
+            return "list"
+        if len(parts) == 5 and parts[0] == "arbitrary" and parts[4] == "zip" and method == "POST":
+            return "publish"
+        if len(parts) == 4 and parts[0] == "arbitrary":
+            return "fetch"
+        return "unknown"
+
+
+    def handle(self, request, method):
+        """
+        Route one request to the listing, fetch, publish or admin endpoint.
+        """
+        started = time.perf_counter()
+        url = urlparse(request.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        endpoint = self.route(method, parts)
+
+        if endpoint == "admin":
+            if parts[1:] == ["stats"] and method == "GET":
+                self.reply(request, 200, self.stats())
+            elif parts[1:] == ["reset"] and method == "POST":
+                self.reset()
+                self.reply(request, 200, {"reset": True})
+            else:
+                self.reply(request, 404, {"error": "NOT_FOUND"})
+            return
+
+        with self.rng_lock:
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            failing = self.error_rate and self.rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        self._throttle(len(body))
+
+        if failing:
+            status, payload, content_type = 503, {"error": "INJECTED_FAILURE"}, "application/json"
+        else:
+            status, payload, content_type = self.respond(endpoint, method, parts, url, body)
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode("utf-8")
+        # counted before replying, so a client that reads stats right after sees its own request
+        self.count(endpoint, len(body), len(payload), status >= 400, time.perf_counter() - started)
+        self.reply(request, status, payload, content_type)
+
+
+    def respond(self, endpoint, method, parts, url, body):
+        if endpoint == "list":
+            query = parse_qs(url.query)
+            first = lambda name: query.get(name, [None])[0]
+            entries = self.store.listing(first("service"), first("name"), first("identifier"))
+            if first("reverse") == "true":
+                entries.reverse()
+            offset = int(first("offset") or 0)
+            limit = int(first("limit") or 0)
+            entries = entries[offset:offset + limit] if limit else entries[offset:]
+            return 200, entries, "application/json"
+
+        if endpoint == "publish":
+            try:
+                data = base64.b64decode(json.loads(body)["data"], validate=True)
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "INVALID_DATA"}, "application/json"
+            self.store.put(parts[1], parts[2], parts[3], data)
+            return 200, {"identifier": parts[3], "size": len(data)}, "application/json"
+
+        if endpoint == "fetch":
+            data = self.store.get(parts[1], parts[2], parts[3])
+            if data is None:
+                return 404, {"error": "RESOURCE_NOT_FOUND"}, "application/json"
+            return 200, data, "application/octet-stream"
+
+        return 404, {"error": "NOT_FOUND"}, "application/json"
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="qdn-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local QDN stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=62392)
+    parser.add_argument("--resources", type=int, default=0, help="synthetic bundles to seed")
+    parser.add_argument("--url-keys", type=int, help="url_keys the seeded bundles are versions of")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds, up to this much")
+    parser.add_argument("--bandwidth", type=int, help="bytes per second per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 503")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    store = qdn_store()
+    if args.resources:
+        started = time.perf_counter()
+        store.seed(args.resources, args.url_keys)
+        print(f"Seeded {args.resources} resources in {time.perf_counter() - started:.1f}s")
+    server = qdn_server(store, args.host, args.port, args.latency, args.jitter, args.bandwidth, args.error_rate, args.seed)
+    print(f"Serving QDN stand-in on {server.url}/")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,21 +10,289 @@
 #                                                                               *
 #*******************************************************************************/
 
+# Batch crawls without the API.
+#
+#   python -m crawler urls.txt --workers 8                 # one URL per line, '#' comments
+#   cat urls.txt | python -m crawler - --out /data/run1    # from stdin, into /data/run1/jobs
+#   python -m crawler urls.txt --out /data/run1 --resume   # carry on after an interruption
+#   python -m crawler --data '{"url": "https://example.com"}'
+#
+# Every URL becomes a job in <out>/jobs/queue with its capture (WARC, HTML, screenshot,
+# job.json) in <out>/jobs/manifest/<job_id>.d, exactly as the API would leave it, so the
+# publish stage can pick the captures up later. WORKERS crawls run at once on BROWSERS
+# shared Chromiums (default: one per worker).
+#
+# Each finished URL is appended to <out>/crawl-state.jsonl as it completes. --resume skips
+# URLs that already crawled there (and, with --skip-failed, the ones that failed). At the
+# end, or on Ctrl-C, <out>/crawl-report.json summarizes the run: counts, pages/sec,
+# p50/p95 crawl time, peak RSS of the crawler and its browsers, and bytes written.
+
+import os
+import sys
+import json
+import time
 import asyncio
+import hashlib
+import logging
 import argparse
-import json
-import bwa_crawl
+from urllib.parse import urlparse
+
+
+def url_key(url):
+    # same key as backend.api.url_key
+    return "url-sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def percentile(values, pct):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, -(-len(ordered) * pct // 100) - 1)], 4)
+
+
+def disk_usage(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def read_urls(source):
+    """
+    Read URLs from a file or "-" for stdin, skipping blanks, comments and repeats.
+    """
+    f = sys.stdin if source == "-" else open(source, "r")
+    try:
+        seen, urls = set(), []
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#") and url not in seen:
+                seen.add(url)
+                urls.append(url)
+        return urls
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_state(path):
+    """
+    Return the last recorded result per URL of an earlier run.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by the interruption
+                continue
+            done[entry["url"]] = entry
+    return done
+
+
+class batch:
+    def __init__(self, urls, workers, state_path, options):
+        """
+        Crawl a list of URLs with a fixed number of workers.
+
+        :param urls: URLs to crawl
+        :param workers: Crawls running at once
+        :param state_path: JSONL file every finished URL is appended to
+        :param options: Extra job fields, e.g. depth, assets, profile
+        """
+        from .bwa_jobqueue import async_job_queue
+
+        self.urls = urls
+        self.workers = workers
+        self.state_path = state_path
+        self.options = options
+        self.jobs = async_job_queue()
+        self.results = []
+
+
+    def record(self, entry):
+        self.results.append(entry)
+        with open(self.state_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+
+
+    async def crawl(self, url):
+        from .bwa_crawl import crawler
+        from .bwa_pool import io_pool
+
+        entry = {"url": url, "job_id": None, "status": "failed", "message": "", "seconds": None, "bytes": 0, "peak_rss": 0}
+        if not urlparse(url).scheme or not urlparse(url).netloc:
+            entry["message"] = "Invalid URL"
+            return entry
+
+        job_id = await self.jobs.create_job({
+            "status": "queued",
+            "message": "",
+            "url": url,
+            "url_hash": url_key(url),
+            "domain": urlparse(url).netloc,
+            **self.options,
+        })
+        entry["job_id"] = job_id
+        await self.jobs.update_job(job_id, {"status": "started"})
+        crawl = await io_pool.run(crawler, job_id)
+
+        started = time.perf_counter()
+        try:
+            await crawl.run()
+        except Exception:
+            # run() already stored the failure on the job
+            pass
+        entry["seconds"] = round(time.perf_counter() - started, 4)
+
+        job = await self.jobs.get_job(job_id) or {}
+        entry["status"] = "failed" if job.get("fault") else job.get("status", "failed")
+        entry["message"] = job.get("message", "")
+        entry["peak_rss"] = job.get("peak_rss", 0)
+        entry["bytes"] = await io_pool.run(disk_usage, crawl.basedir)
+        return entry
+
+
+    async def worker(self, queue):
+        while True:
+            url = await queue.get()
+            if url is None:
+                return
+            entry = await self.crawl(url)
+            self.record(entry)
+            seconds = f"{entry['seconds']:.2f}s" if entry["seconds"] is not None else "-"
+            print(f"[{len(self.results)}/{len(self.urls)}] {entry['status']:8} {seconds:>8} {url}", file=sys.stderr)
+
+
+    async def run(self):
+        """
+        Crawl every URL, returning when all are done or the run is cancelled.
+        """
+        from .bwa_browser import browsers
+
+        queue = asyncio.Queue()
+        for url in self.urls:
+            queue.put_nowait(url)
+        for _ in range(self.workers):
+            queue.put_nowait(None)
+        try:
+            await asyncio.gather(*(self.worker(queue) for _ in range(self.workers)))
+        finally:
+            await browsers.close()
+
+
+def report(urls, results, skipped, seconds, interrupted, args):
+    crawled = [entry for entry in results if entry["status"] == "crawled"]
+    unchanged = [entry for entry in results if entry["status"] == "unchanged"]
+    latencies = [entry["seconds"] for entry in crawled]
+    return {
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "interrupted": interrupted,
+        "workers": args.workers,
+        "browsers": args.browsers or args.workers,
+        "seconds": round(seconds, 3),
+        "urls": len(urls),
+        "crawled": len(crawled),
+        "unchanged": len(unchanged),
+        "failed": len(results) - len(crawled) - len(unchanged),
+        "skipped": len(skipped),
+        "pages_per_sec": round(len(crawled) / seconds, 3) if seconds else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "peak_rss": max([entry["peak_rss"] or 0 for entry in results], default=0),
+        "bytes_written": sum(entry["bytes"] for entry in results),
+        "results": results,
+        "failures": [{"url": entry["url"], "message": entry["message"]} for entry in results if entry["status"] not in ("crawled", "unchanged")],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m crawler", description="Crawl a list of URLs without the API")
+    parser.add_argument("urls", nargs="?", help="file with one URL per line, or - for stdin")
+    parser.add_argument("--data", type=json.loads, help="a single job as JSON, e.g. '{\"url\": \"https://example.com\"}'")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 2, help="crawls running at once (default: CPUs)")
+    parser.add_argument("--browsers", type=int, help="Chromium processes shared by the workers (default: one per worker)")
+    parser.add_argument("--out", default=".", help="directory the jobs/ tree and the reports are written to")
+    parser.add_argument("--resume", action="store_true", help="skip URLs an earlier run in --out already crawled")
+    parser.add_argument("--skip-failed", action="store_true", help="with --resume, skip URLs that failed too")
+    parser.add_argument("--timeout", type=int, help="navigation and idle timeout in ms (default: BWA_CRAWL_TIMEOUT)")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--no-assets", action="store_true")
+    parser.add_argument("--profile", action="store_true", help="profile every crawl (they then run one at a time)")
+    parser.add_argument("--screenshot", help="screenshot profile: png, jpeg or webp (default: BWA_SCREENSHOT)")
+    parser.add_argument("--force", action="store_true", help="crawl pages even if they are unchanged since their last published capture")
+    parser.add_argument("--report", help="summary report path (default: <out>/crawl-report.json)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show every crawl's log")
+    args = parser.parse_args()
+
+    if args.data is not None:
+        if not isinstance(args.data, dict) or "url" not in args.data:
+            parser.error("--data must be a JSON object with a url")
+        urls = [args.data["url"]]
+    elif args.urls:
+        urls = read_urls(args.urls)
+    else:
+        parser.error("give a URL file, - for stdin, or --data")
+
+    # keep per-crawl logs out of the way of the progress lines, each job's crawl.log has them
+    from .bwa_log import setup
+    setup(sys.stderr, None if args.verbose else logging.WARNING)
+
+    report_path = os.path.abspath(args.report or os.path.join(args.out, "crawl-report.json"))
+    os.makedirs(args.out, exist_ok=True)
+    # every pipeline path is relative to the working directory
+    os.chdir(args.out)
+    state_path = "crawl-state.jsonl"
+
+    done = read_state(state_path) if args.resume else {}
+    if not args.resume and os.path.exists(state_path):
+        os.remove(state_path)
+    keep = ("crawled", "unchanged", "failed") if args.skip_failed else ("crawled", "unchanged")
+    skipped = {url for url in urls if done.get(url, {}).get("status") in keep}
+    pending = [url for url in urls if url not in skipped]
+
+    from .bwa_crawl import crawler
+    from .bwa_browser import browsers
+    from . import bwa_image
+    if args.timeout:
+        crawler.TIMEOUT = args.timeout
+    browsers.resize(args.browsers or args.workers)
+
+    options = {"depth": args.depth, "assets": not args.no_assets, "profile": args.profile, "screenshot": args.screenshot, "force": args.force}
+    if args.data is not None:
+        options.update({key: value for key, value in args.data.items() if key in ("depth", "assets", "profile", "screenshot", "force")})
+    try:
+        bwa_image.options(options["screenshot"])
+    except ValueError as e:
+        parser.error(str(e))
+    run = batch(pending, max(1, min(args.workers, len(pending) or 1)), state_path, options)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--data', type=json.loads)
-args = parser.parse_args()
+    started = time.perf_counter()
+    interrupted = False
+    try:
+        asyncio.run(run.run())
+    except KeyboardInterrupt:
+        interrupted = True
+    summary = report(urls, run.results, skipped, time.perf_counter() - started, interrupted, args)
+    with open(report_path, "w") as f:
+        json.dump(summary, f, indent=2)
 
-job = args.data
-crawler = bwa_crawl.crawler(job)
+    print(f"{summary['crawled']} crawled, {summary['unchanged']} unchanged, {summary['failed']} failed, {summary['skipped']} skipped "
+          f"in {summary['seconds']}s ({summary['pages_per_sec']} pages/s), report in {report_path}")
+    if interrupted:
+        print("Interrupted, run again with --resume to continue", file=sys.stderr)
+        sys.exit(130)
+    sys.exit(1 if summary["failed"] else 0)
 
-async def run_job():
-    job = await crawler.run()
-    return job
 
 if __name__ == "__main__":
-    asyncio.run(run_job())
+    main()
@@ -0,0 +1,330 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from .bwa_metrics import REGISTRY
+from .bwa_trace import rss, parent, children, memory_available
+
+# A bounded set of long-lived Chromium processes shared by all crawls in this process.
+# A crawl borrows one browser, opens its own context (cookies, cache and HAR recording are
+# per context) and gives the browser back. At most BWA_BROWSER_POOL crawls run at once;
+# the rest wait for a slot instead of launching more Chromiums.
+#
+# A watchdog samples the resident memory of every browser process tree every
+# BWA_WATCHDOG_INTERVAL seconds:
+#   - a browser over BWA_BROWSER_MAX_RSS, or one that served BWA_BROWSER_MAX_PAGES crawls,
+#     is closed when it is returned (at once if idle) and relaunched on demand
+#   - a crawl whose browser passes BWA_JOB_MAX_RSS is cancelled, failed and its browser closed
+#   - when free memory (cgroup limit, else host) drops below BWA_MEM_LOW, idle browsers are
+#     closed and one fewer crawl may run per interval; above BWA_MEM_HIGH the limit grows
+#     back towards the pool size
+
+MiB = 1024 * 1024
+
+
+class pooled_browser:
+    def __init__(self, browser, pid):
+        """
+        One Chromium of the pool and its memory.
+
+        :param browser: The Playwright browser
+        :param pid: Pid of the Chromium main process, None if it could not be found
+        """
+        self.browser = browser
+        self.pid = pid
+        self.pages = 0
+        self.rss = 0
+        self.peak_rss = 0
+        self.lease_peak_rss = 0
+        self.recycle = None
+        self.on_limit = None
+
+
+    def sample(self):
+        # the main process plus its renderers, GPU and utility processes
+        if self.pid is None:
+            return 0
+        return rss(self.pid) + sum(rss(child) for child in children(self.pid))
+
+
+class browser_pool:
+    SIZE = int(os.environ.get("BWA_BROWSER_POOL", 2))
+    MAX_RSS = int(os.environ.get("BWA_BROWSER_MAX_RSS", 1536 * MiB))
+    MAX_PAGES = int(os.environ.get("BWA_BROWSER_MAX_PAGES", 100))
+    JOB_MAX_RSS = int(os.environ.get("BWA_JOB_MAX_RSS", 3072 * MiB))
+    MEM_LOW = float(os.environ.get("BWA_MEM_LOW", 0.15))
+    MEM_HIGH = float(os.environ.get("BWA_MEM_HIGH", 0.30))
+    INTERVAL = float(os.environ.get("BWA_WATCHDOG_INTERVAL", 2.0))
+
+    def __init__(self, size = None):
+        """
+        Initialize the pool, browsers are launched on first use.
+
+        :param size: Number of browsers, defaults to BWA_BROWSER_POOL (2)
+        """
+        self.size = size or self.SIZE
+        self.limit = self.size
+        self.playwright = None
+        self.driver_pids = set()
+        self.idle = []
+        self.leased = {}
+        self.in_use = 0
+        self.waiting = 0
+        self.launches = 0
+        self.recycled = {}
+        self.killed = 0
+        self.memory_pressure = None
+        self.available = asyncio.Condition()
+        self.start_lock = asyncio.Lock()
+        self.launch_lock = asyncio.Lock()
+        self.watchdog = None
+        self.logger = logging.getLogger("bwa_browser")
+
+
+    @staticmethod
+    def _direct_children():
+        me = os.getpid()
+        return {pid for pid in children(me) if parent(pid) == me}
+
+
+    async def _launch(self):
+        async with self.start_lock:
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+                # the Playwright driver; each Chromium main process is its child
+                self.driver_pids = await asyncio.to_thread(self._direct_children)
+        # launches take turns so the new Chromium can be told apart from the others
+        async with self.launch_lock:
+            before = set(await asyncio.to_thread(children, os.getpid()))
+            browser = await self.playwright.chromium.launch(headless=True)
+            after = set(await asyncio.to_thread(children, os.getpid()))
+        pid = None
+        for candidate in after - before:
+            if await asyncio.to_thread(parent, candidate) in self.driver_pids:
+                pid = candidate
+                break
+        self.launches += 1
+        self.logger.info(f"Launched browser #{self.launches} (pid {pid})")
+        return pooled_browser(browser, pid)
+
+
+    async def _retire(self, entry, reason):
+        self.recycled[reason] = self.recycled.get(reason, 0) + 1
+        self.logger.info(f"Recycling browser {entry.pid} ({reason}, {entry.rss // MiB} MiB, {entry.pages} crawls)")
+        try:
+            await entry.browser.close()
+        except Exception as e:
+            self.logger.warning(f"Closing browser failed: {e}")
+
+
+    async def _checkin(self, entry):
+        if not entry.browser.is_connected():
+            self.recycled["crashed"] = self.recycled.get("crashed", 0) + 1
+            return
+        entry.rss = await asyncio.to_thread(entry.sample)
+        reason = entry.recycle
+        if reason is None and self.MAX_RSS and entry.rss > self.MAX_RSS:
+            reason = "rss"
+        if reason is None and self.MAX_PAGES and entry.pages >= self.MAX_PAGES:
+            reason = "pages"
+        if reason is None and self.memory_pressure is not None and 1 - self.memory_pressure < self.MEM_LOW:
+            reason = "pressure"
+        if reason:
+            await self._retire(entry, reason)
+        else:
+            self.idle.append(entry)
+
+
+    @asynccontextmanager
+    async def browser(self, on_limit = None):
+        """
+        Borrow a browser for the duration of a crawl.
+
+            async with browsers.browser() as browser:
+                context = await browser.new_context()
+
+        Browsers that crashed or were closed by the borrower are replaced on the next checkout.
+
+        :param on_limit: Called with the browser's RSS if it passes BWA_JOB_MAX_RSS while borrowed
+        """
+        if self.watchdog is None or self.watchdog.done():
+            self.watchdog = asyncio.create_task(self._watch())
+        async with self.available:
+            self.waiting += 1
+            try:
+                await self.available.wait_for(lambda: self.in_use < self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_use += 1
+        entry = None
+        try:
+            while self.idle and entry is None:
+                candidate = self.idle.pop()
+                if candidate.browser.is_connected():
+                    entry = candidate
+            if entry is None:
+                entry = await self._launch()
+            entry.pages += 1
+            entry.lease_peak_rss = 0
+            entry.on_limit = on_limit
+            self.leased[id(entry.browser)] = entry
+            yield entry.browser
+        finally:
+            try:
+                if entry is not None:
+                    entry.on_limit = None
+                    self.leased.pop(id(entry.browser), None)
+                    await self._checkin(entry)
+            finally:
+                async with self.available:
+                    self.in_use -= 1
+                    self.available.notify_all()
+
+
+    def usage(self, browser):
+        """
+        Return the memory of a borrowed browser.
+
+        :returns: dict with rss and peak_rss (bytes, since it was borrowed) and pages, or None
+        """
+        entry = self.leased.get(id(browser))
+        if entry is None:
+            return None
+        return {"rss": entry.rss, "peak_rss": entry.lease_peak_rss, "pages": entry.pages}
+
+
+    async def check(self):
+        """
+        Sample browser memory once: recycle, cancel over-limit crawls and adapt concurrency.
+        """
+        entries = list(self.leased.values()) + list(self.idle)
+        sizes = await asyncio.to_thread(lambda: [entry.sample() for entry in entries])
+        for entry, size in zip(entries, sizes):
+            entry.rss = size
+            entry.peak_rss = max(entry.peak_rss, size)
+            entry.lease_peak_rss = max(entry.lease_peak_rss, size)
+            if entry.on_limit is not None and self.JOB_MAX_RSS and size > self.JOB_MAX_RSS:
+                self.killed += 1
+                entry.recycle = "job_limit"
+                on_limit, entry.on_limit = entry.on_limit, None
+                self.logger.warning(f"Browser {entry.pid} at {size // MiB} MiB, over the job limit; cancelling its crawl")
+                on_limit(size)
+            elif self.MAX_RSS and size > self.MAX_RSS:
+                if entry in self.idle:
+                    self.idle.remove(entry)
+                    await self._retire(entry, "rss")
+                else:
+                    entry.recycle = entry.recycle or "rss"
+
+        memory = await asyncio.to_thread(memory_available)
+        if not memory or not memory[1]:
+            return
+        free = memory[0] / memory[1]
+        self.memory_pressure = round(1 - free, 3)
+        if free < self.MEM_LOW:
+            # idle browsers hold memory no crawl is using
+            while self.idle:
+                await self._retire(self.idle.pop(), "pressure")
+            if self.limit > 1:
+                self.limit -= 1
+                self.logger.warning(f"Memory {free:.0%} free, running at most {self.limit} crawls")
+        elif free > self.MEM_HIGH and self.limit < self.size:
+            async with self.available:
+                self.limit += 1
+                self.available.notify_all()
+            self.logger.info(f"Memory {free:.0%} free, running at most {self.limit} crawls")
+
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                self.logger.warning(f"Browser watchdog failed: {e}")
+
+
+    def resize(self, size):
+        """
+        Change how many browsers the pool may run; only while no crawl holds or waits for one.
+
+        :param size: Number of browsers
+        """
+        if self.in_use or self.waiting:
+            raise RuntimeError("Cannot resize a browser pool in use")
+        self.size = max(1, int(size))
+        self.limit = self.size
+
+
+    def stats(self):
+        """
+        Return the pool's size and current limit, browsers in use and idle, waiting crawls,
+        launches, recycles by reason, crawls killed, browser memory and memory pressure.
+        """
+        entries = list(self.leased.values()) + list(self.idle)
+        return {
+            "size": self.size,
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "idle": len(self.idle),
+            "waiting": self.waiting,
+            "launches": self.launches,
+            "utilization": round(self.in_use / self.size, 3),
+            "rss": sum(entry.rss for entry in entries),
+            "recycled": dict(self.recycled),
+            "killed": self.killed,
+            "memory_pressure": self.memory_pressure,
+        }
+
+
+    async def close(self):
+        """
+        Stop the watchdog, close idle browsers and stop Playwright.
+        """
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            await asyncio.gather(self.watchdog, return_exceptions=True)
+            self.watchdog = None
+        while self.idle:
+            entry = self.idle.pop()
+            try:
+                await entry.browser.close()
+            except Exception as e:
+                self.logger.warning(f"Closing browser failed: {e}")
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+            self.driver_pids = set()
+
+
+browsers = browser_pool()
+
+
+@REGISTRY.collector
+def browser_metrics():
+    stats = browsers.stats()
+    yield ("bwa_browser_pool_size", "gauge", "Browsers the pool may run", [({}, stats["size"])])
+    yield ("bwa_browser_pool_limit", "gauge", "Crawls allowed at once after memory pressure", [({}, stats["limit"])])
+    yield ("bwa_browser_pool_in_use", "gauge", "Browsers lent to crawls", [({}, stats["in_use"])])
+    yield ("bwa_browser_pool_waiting", "gauge", "Crawls waiting for a browser", [({}, stats["waiting"])])
+    yield ("bwa_browser_pool_utilization", "gauge", "Browsers in use divided by pool size", [({}, stats["utilization"])])
+    yield ("bwa_browser_launches_total", "counter", "Chromium processes launched", [({}, stats["launches"])])
+    yield ("bwa_browser_rss_bytes", "gauge", "Resident memory of all pooled browsers", [({}, stats["rss"])])
+    yield ("bwa_browser_recycled_total", "counter", "Browsers closed by the watchdog, by reason",
+           [({"reason": reason}, count) for reason, count in stats["recycled"].items()])
+    yield ("bwa_browser_jobs_killed_total", "counter", "Crawls cancelled over BWA_JOB_MAX_RSS", [({}, stats["killed"])])
+    if stats["memory_pressure"] is not None:
+        yield ("bwa_memory_pressure", "gauge", "Fraction of the memory limit in use", [({}, stats["memory_pressure"])])
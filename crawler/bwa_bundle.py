@@ -0,0 +1,266 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import json
+import logging
+import zipfile
+import tempfile
+import threading
+from collections import OrderedDict
+from .bwa_cache import bwa_cache
+from .bwa_delta import bwa_delta
+from .bwa_metrics import stage, cache_result
+from . import bwa_codec
+
+class bwa_bundle:
+    OPEN_MAX = int(os.environ.get("BWA_BUNDLE_OPEN_MAX", 64))
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, cache = None, open_max = None, fetch = None):
+        """
+        Initialize the bundle reader.
+
+        Purpose: Reads individual files out of cached archive bundles without extracting them.
+
+        Inputs:
+        - cache (bwa_cache, optional): The shared archive cache, a default one is created if omitted.
+        - open_max (int, optional): Number of ZIP central directories kept open, defaults to BWA_BUNDLE_OPEN_MAX (64).
+        - fetch (callable, optional): Called with a content hash to pull a missing bundle into the cache,
+          returns the cached path or None. Needed to read delta bundles whose base is not cached yet.
+
+        Outputs: None
+
+        Means: Keeps an LRU of open ZipFile objects so repeated reads skip re-parsing the central directory.
+        """
+        self.cache = cache or bwa_cache()
+        self.open_max = self.OPEN_MAX if open_max is None else open_max
+        self.fetch = fetch
+        self.zips = OrderedDict()
+        self.manifests = {}
+        self.lock = threading.Lock()
+        self.delta = bwa_delta(self)
+        self.logger = logging.getLogger("bwa_bundle")
+
+    def open(self, content_hash):
+        """
+        Return an open ZipFile for a cached bundle.
+
+        Purpose: Shares one parsed central directory per bundle between all readers.
+
+        Inputs:
+        - content_hash (str): The content hash of the bundle.
+
+        Outputs: zipfile.ZipFile or None: The open bundle, or None if it is not cached.
+
+        Means: Looks the bundle up in the LRU, opens it from the cache on a miss and closes the
+        least recently used bundle when more than open_max are held. Members that are still being
+        read keep their bundle's file handle alive until they are closed.
+        """
+        key = self.cache.strip_hash(content_hash)
+        with self.lock:
+            zip_file = self.zips.get(key)
+            if zip_file is not None:
+                self.zips.move_to_end(key)
+                cache_result("bundle", True)
+                return zip_file
+
+        cache_result("bundle", False)
+        zip_path = self.cache.get(key)
+        if not zip_path and self.fetch:
+            zip_path = self.fetch(key)
+        if not zip_path:
+            return None
+        zip_file = zipfile.ZipFile(zip_path, "r")
+
+        with self.lock:
+            if key in self.zips:
+                # lost a race with another opener, keep theirs
+                zip_file.close()
+                self.zips.move_to_end(key)
+                return self.zips[key]
+            self.zips[key] = zip_file
+            while len(self.zips) > self.open_max:
+                stale_key, stale = self.zips.popitem(last=False)
+                self.manifests.pop(stale_key, None)
+                stale.close()
+        return zip_file
+
+    def manifest(self, content_hash):
+        """
+        Return the manifest of a bundle.
+
+        :param content_hash: The content hash of the bundle
+        :returns: The manifest dict, or an empty dict if the bundle is unavailable
+        """
+        key = self.cache.strip_hash(content_hash)
+        manifest = self.manifests.get(key)
+        if manifest is not None:
+            return manifest
+        zip_file = self.open(key)
+        if zip_file is None:
+            return {}
+        try:
+            manifest = json.loads(zip_file.read("manifest.json").decode("utf-8"))
+        except KeyError:
+            manifest = {}
+        with self.lock:
+            if key in self.zips:
+                self.manifests[key] = manifest
+        return manifest
+
+    def resolve(self, content_hash, member):
+        """
+        Find the bundle that stores a member.
+
+        Purpose: Delta bundles leave out unchanged artifacts and point at the bundle holding them.
+
+        Inputs:
+        - content_hash (str): The content hash of the version being read.
+        - member (str): Path of the file inside the version, e.g. "metadata/snapshot.html".
+
+        Outputs: tuple: (content hash, member) to read the bytes from.
+        """
+        key = self.cache.strip_hash(content_hash)
+        origin = self.manifest(key).get("inherited", {}).get(member)
+        return (origin or key, member)
+
+    def member_info(self, content_hash, member):
+        """
+        Return the ZipInfo of one file inside a bundle.
+
+        :param content_hash: The content hash of the bundle
+        :param member: Path of the file inside the bundle, e.g. "metadata/snapshot.html"
+        :returns: zipfile.ZipInfo of the stored member (which may be a delta WARC or a .zst
+                  encoding of it), or None if the bundle or member does not exist
+        """
+        content_hash, member = self.resolve(content_hash, member)
+        zip_file = self.open(content_hash)
+        if zip_file is None:
+            return None
+        if member == "warc/crawl.warc.gz":
+            member = self.manifest(content_hash).get("warc", member)
+        for name in (member, member + ".zst"):
+            try:
+                return zip_file.getinfo(name)
+            except KeyError:
+                continue
+        return None
+
+    def member_size(self, content_hash, member):
+        """
+        Return the size of one file inside a bundle as readers see it.
+
+        :param content_hash: The content hash of the bundle
+        :param member: Path of the file inside the bundle
+        :returns: Size in bytes after any zstd decoding, or None if unknown (a delta WARC is
+                  only sized once reassembled) or the member does not exist
+        """
+        content_hash, member = self.resolve(content_hash, member)
+        if member == "warc/crawl.warc.gz":
+            manifest = self.manifest(content_hash)
+            if manifest.get("delta"):
+                return None
+            member = manifest.get("warc", member)
+        zip_file = self.open(content_hash)
+        if zip_file is None:
+            return None
+        try:
+            return zip_file.getinfo(member).file_size
+        except KeyError:
+            pass
+        try:
+            with zip_file.open(member + ".zst", "r") as f:
+                return bwa_codec.content_size(f)
+        except KeyError:
+            return None
+
+    def open_member(self, content_hash, member, raw = False):
+        """
+        Open one file inside a bundle for reading.
+
+        :param content_hash: The content hash of the bundle
+        :param member: Path of the file inside the bundle
+        :param raw: Read the member exactly as stored in this bundle, without resolving
+                    inherited artifacts, reassembling a delta WARC or decoding zstd members
+        :returns: A binary file object, or None if the bundle or member does not exist
+        """
+        with stage("extract"):
+            return self._open_member(content_hash, member, raw)
+
+    def _open_member(self, content_hash, member, raw = False):
+        if not raw:
+            content_hash, member = self.resolve(content_hash, member)
+            if member == "warc/crawl.warc.gz":
+                manifest = self.manifest(content_hash)
+                if manifest.get("delta"):
+                    return self.reassemble(content_hash)
+                member = manifest.get("warc", member)
+        zip_file = self.open(content_hash)
+        if zip_file is None:
+            return None
+        try:
+            return zip_file.open(member, "r")
+        except KeyError:
+            if raw:
+                return None
+        # members packed with the zstd bundle codec
+        try:
+            return bwa_codec.open_zstd(zip_file.open(member + ".zst", "r"))
+        except KeyError:
+            return None
+
+    def reassemble(self, content_hash):
+        """
+        Return the complete WARC of a delta version as a temporary file.
+
+        :param content_hash: The content hash of a delta bundle
+        :returns: A binary file object positioned at the start of the WARC
+        """
+        out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        resolved = self.delta.reassemble(content_hash, out)
+        self.logger.info(f"Reassembled {content_hash} with {resolved} records from earlier versions")
+        out.seek(0)
+        return out
+
+    def stream(self, content_hash, member, chunk_size = None):
+        """
+        Yield one file inside a bundle in chunks.
+
+        Purpose: Lets the API start sending a member before the rest of the bundle is touched.
+
+        Inputs:
+        - content_hash (str): The content hash of the bundle.
+        - member (str): Path of the file inside the bundle.
+        - chunk_size (int, optional): Bytes per chunk, defaults to 64 KiB.
+
+        Outputs: Iterator of bytes.
+
+        Means: Opens the member through the shared ZipFile and reads it chunk by chunk, only
+        decompressing the bytes of that member.
+        """
+        f = self.open_member(content_hash, member)
+        if f is None:
+            return
+        with f:
+            for chunk in iter(lambda: f.read(chunk_size or self.CHUNK_SIZE), b""):
+                yield chunk
+
+    def close(self):
+        """
+        Close every open bundle.
+        """
+        with self.lock:
+            self.manifests.clear()
+            while self.zips:
+                _, zip_file = self.zips.popitem(last=False)
+                zip_file.close()
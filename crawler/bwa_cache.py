@@ -0,0 +1,363 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import io
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import zipfile
+import threading
+from contextlib import contextmanager
+from .bwa_metrics import cache_result
+
+# jobs/cache/
+# ├── blobs/<content_hash>.zip     one archive bundle per content hash (*.part: a chunked download being reassembled)
+# ├── keys/<url_key>               most recent content hash seen for a url_key
+# ├── validators/<url_key>.json    ETag, Last-Modified and fingerprint of the last published capture
+# ├── index/<content_hash>.json    WARC record offsets, built by bwa_replay on first replay
+# ├── variants/<content_hash>/     gzip/br copies of text members, built by bwa_variants
+# └── locks/<content_hash>.lock    fill lock, held while a bundle is downloading
+
+class bwa_cache:
+    CACHE_DIR = os.environ.get("BWA_CACHE_DIR", "jobs/cache")
+    MAX_BYTES = int(os.environ.get("BWA_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+    KEY_TTL = int(os.environ.get("BWA_CACHE_KEY_TTL", 300))
+
+    def __init__(self, cache_dir = None, max_bytes = None):
+        """
+        Initialize the shared archive cache.
+
+        Purpose: Keeps one copy of every downloaded archive bundle on disk, shared by all jobs.
+
+        Inputs:
+        - cache_dir (str, optional): Cache root, defaults to BWA_CACHE_DIR or "jobs/cache".
+        - max_bytes (int, optional): Disk budget, defaults to BWA_CACHE_MAX_BYTES (2 GiB).
+
+        Outputs: None
+
+        Means: Only sets up paths; each directory below the cache root is created by the first write
+        into it, so a process that never caches anything leaves no trace on disk.
+        """
+        self.cache_dir = cache_dir or self.CACHE_DIR
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+        self.blob_dir = os.path.join(self.cache_dir, "blobs")
+        self.key_dir = os.path.join(self.cache_dir, "keys")
+        self.lock_dir = os.path.join(self.cache_dir, "locks")
+        self.validator_dir = os.path.join(self.cache_dir, "validators")
+        self.logger = logging.getLogger("bwa_cache")
+
+    @staticmethod
+    def strip_hash(content_hash):
+        """
+        Return the bare hex digest of a content hash.
+
+        Purpose: Cache entries are keyed by hex digest regardless of how the hash was written.
+
+        Inputs:
+        - content_hash (str): Hash with or without the "sha256:" prefix.
+
+        Outputs: str: The hex digest.
+        """
+        return content_hash.replace("sha256:", "")
+
+    @staticmethod
+    def _writable(dirpath):
+        # cache directories are created on first write, see __init__
+        os.makedirs(dirpath, exist_ok=True)
+        return dirpath
+
+    def blob_path(self, content_hash):
+        """
+        Return the on-disk path of the bundle for a content hash.
+        """
+        return os.path.join(self.blob_dir, f"{self.strip_hash(content_hash)}.zip")
+
+    def spool_path(self, content_hash):
+        """
+        Return a private file path next to the blob of a content hash, for assembling a download in place.
+        """
+        self._writable(self.blob_dir)
+        return f"{self.blob_path(content_hash)}.{os.getpid()}.{threading.get_ident()}.part"
+
+    def _key_path(self, url_key):
+        return os.path.join(self.key_dir, url_key.replace(":", "_"))
+
+    @staticmethod
+    def verify(zip_bytes, content_hash):
+        """
+        Check that a bundle carries the WARC it claims to.
+
+        Purpose: Rejects truncated or tampered downloads before they enter the cache.
+
+        Inputs:
+        - zip_bytes (bytes or str): The downloaded ZIP bundle, or the path of a file holding it.
+        - content_hash (str): The expected content hash (SHA256 of the WARC).
+
+        Outputs: bool: True if the WARC inside the bundle hashes to content_hash.
+
+        Means: Streams the WARC named by the manifest out of the ZIP through SHA256 and compares digests. Delta
+        bundles carry only part of the WARC, so their delta WARC is checked against the digest the
+        manifest records for it, and the manifest must name content_hash.
+        """
+        try:
+            source = zip_bytes if isinstance(zip_bytes, str) else io.BytesIO(zip_bytes)
+            with zipfile.ZipFile(source, "r") as zip_file:
+                manifest = {}
+                if "manifest.json" in zip_file.namelist():
+                    manifest = json.loads(zip_file.read("manifest.json").decode("utf-8"))
+                delta = manifest.get("delta")
+                if delta:
+                    if bwa_cache.strip_hash(manifest.get("content_hash", "")) != bwa_cache.strip_hash(content_hash):
+                        return False
+                    member, expected = manifest["warc"], delta["warc_sha256"]
+                else:
+                    member, expected = manifest.get("warc", "warc/crawl.warc.gz"), content_hash
+                digest = hashlib.sha256()
+                with zip_file.open(member) as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+        except (KeyError, ValueError, OSError, zipfile.BadZipFile):
+            return False
+        return digest.hexdigest() == bwa_cache.strip_hash(expected)
+
+    def get(self, content_hash):
+        """
+        Look up a cached bundle.
+
+        Purpose: Serves repeated requests for the same archive from local disk.
+
+        Inputs:
+        - content_hash (str): The content hash of the bundle.
+
+        Outputs: str or None: Path to the cached ZIP, or None on a miss.
+
+        Means: Checks for the blob and bumps its mtime so it becomes most recently used.
+        """
+        path = self.blob_path(content_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            cache_result("archive", False)
+            return None
+        cache_result("archive", True)
+        return path
+
+    @contextmanager
+    def _fill_lock(self, content_hash):
+        lock_path = os.path.join(self._writable(self.lock_dir), f"{self.strip_hash(content_hash)}.lock")
+        with open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fill(self, content_hash, fetch):
+        """
+        Return a cached bundle, downloading it once if missing.
+
+        Purpose: Collapses concurrent requests for the same archive into a single download.
+
+        Inputs:
+        - content_hash (str): The content hash of the bundle.
+        - fetch (callable): Called with no arguments on a miss, returns the ZIP bytes, the path of a
+          spool_path() file holding them, or None.
+
+        Outputs: str or None: Path to the cached ZIP, or None if the download failed or did not verify.
+
+        Means: Takes an exclusive per-hash file lock, re-checks the cache, calls fetch, verifies the
+        WARC hash and stores it with put().
+        """
+        path = self.get(content_hash)
+        if path:
+            return path
+
+        with self._fill_lock(content_hash):
+            # another filler may have finished while we waited on the lock
+            path = self.get(content_hash)
+            if path:
+                return path
+
+            zip_bytes = fetch()
+            if not zip_bytes:
+                return None
+            if not self.verify(zip_bytes, content_hash):
+                self.logger.error(f"Hash mismatch for bundle {content_hash}, not caching")
+                if isinstance(zip_bytes, str):
+                    os.remove(zip_bytes)
+                return None
+
+            return self.put(content_hash, zip_bytes)
+
+    def put(self, content_hash, zip_bytes):
+        """
+        Store verified bundle bytes under their content hash.
+
+        :param content_hash: The content hash of the bundle
+        :param zip_bytes: The ZIP bytes, or a spool_path() file holding them, which is moved into place
+        :returns: Path to the cached ZIP
+
+        Every bundle enters the cache here, so this is where least recently used ones are evicted
+        to keep it within BWA_CACHE_MAX_BYTES.
+        """
+        self._writable(self.blob_dir)
+        path = self.blob_path(content_hash)
+        if isinstance(zip_bytes, str):
+            os.replace(zip_bytes, path)
+            self.logger.info(f"Cached bundle {self.strip_hash(content_hash)} ({os.path.getsize(path)} bytes)")
+            self.evict()
+            return path
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zip_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.logger.info(f"Cached bundle {self.strip_hash(content_hash)} ({len(zip_bytes)} bytes)")
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Evict least recently used bundles until the cache fits its disk budget.
+
+        Purpose: Bounds the disk used by downloaded archives.
+
+        Inputs: None
+
+        Outputs: int: Number of bytes freed.
+
+        Means: Orders blobs by mtime (bumped on every hit) and removes the oldest first.
+        """
+        entries = []
+        total = 0
+        if not os.path.isdir(self.blob_dir):
+            return 0
+        with os.scandir(self.blob_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".zip"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            # drop the replay offset index and precompressed variants built for this bundle
+            key = os.path.basename(path)[:-4]
+            index_path = os.path.join(self.cache_dir, "index", key + ".json")
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            shutil.rmtree(os.path.join(self.cache_dir, "variants", key), ignore_errors=True)
+            freed += size
+            self.logger.info(f"Evicted {os.path.basename(path)} ({size} bytes)")
+        return freed
+
+    def usage(self):
+        """
+        Return the number of bundles and bytes currently cached.
+        """
+        count = 0
+        total = 0
+        if not os.path.isdir(self.blob_dir):
+            return {"entries": 0, "bytes": 0, "max_bytes": self.max_bytes}
+        with os.scandir(self.blob_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".zip"):
+                    count += 1
+                    total += entry.stat().st_size
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes}
+
+    def get_key(self, url_key):
+        """
+        Return the most recent content hash recorded for a url_key.
+
+        Purpose: Lets repeated views resolve the latest version without listing QDN.
+
+        Inputs:
+        - url_key (str): The normalized URL key.
+
+        Outputs: str or None: The content hash, or None if unknown, expired, or its bundle was evicted.
+        """
+        path = self._key_path(url_key)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.KEY_TTL:
+                cache_result("key", False)
+                return None
+            with open(path, "r") as f:
+                content_hash = f.read().strip()
+        except FileNotFoundError:
+            cache_result("key", False)
+            return None
+        if not self.get(content_hash):
+            cache_result("key", False)
+            return None
+        cache_result("key", True)
+        return content_hash
+
+    def set_key(self, url_key, content_hash):
+        """
+        Record the most recent content hash for a url_key.
+        """
+        self._writable(self.key_dir)
+        path = self._key_path(url_key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.strip_hash(content_hash))
+        os.replace(tmp_path, path)
+
+    def get_validators(self, url_key):
+        """
+        Return what the last published capture of a url_key looked like.
+
+        Purpose: Lets a re-crawl ask the site whether anything changed before rendering the page.
+
+        Inputs:
+        - url_key (str): The normalized URL key.
+
+        Outputs: dict or None: etag, last_modified, fingerprint and status of the main document,
+        plus the content_hash, job_id and captured_at of the version they belong to.
+
+        Means: Validators never expire with the key TTL; the re-crawl decides how old is too old.
+        """
+        try:
+            with open(os.path.join(self.validator_dir, f"{url_key.replace(':', '_')}.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set_validators(self, url_key, validators):
+        """
+        Record the validators of the capture just published for a url_key.
+        """
+        path = os.path.join(self._writable(self.validator_dir), f"{url_key.replace(':', '_')}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(validators, f)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        """
+        Remove every cached bundle, key and validator.
+        """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
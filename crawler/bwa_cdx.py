@@ -0,0 +1,561 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import json
+import time
+import uuid
+import base64
+import asyncio
+import logging
+import sqlite3
+import calendar
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from .bwa_jobqueue import job_queue, job_feed
+from .bwa_pool import io_pool, net_pool
+from .bwa_metrics import REGISTRY, counter
+
+# Capture index in the style of a CDX server, a SQLite table in jobs/cdx/captures.db.
+#
+# One row per capture: every finished local job (complete, failed or unchanged) and every
+# version listed on QDN that no local job accounts for. Rows are keyed for lookups by
+# SURT, the URL rewritten so that its host reads from the top level down
+# (https://www.example.com/Blog/?b=2&a=1 -> com,example)/blog/?a=1&b=2), which turns
+# "everything under a path", "everything on a host" and "everything in a domain" into one
+# range scan of the (surt, timestamp) index.
+#
+#   GET /cdx?url=example.com/blog/&matchType=prefix&from=202403&to=202406
+#   GET /cdx?url=example.com&closest=20240501120000&limit=1
+#   GET /cdx?url=*.example.com&collapse=timestamp:8&output=json&fl=timestamp,url,digest
+#
+# Results are streamed page by page with keyset pagination, and showResumeKey=true ends
+# a response with a key that resumes right after it, so no query or page costs more than
+# the rows it returns, however many captures the index holds. Finished jobs are picked
+# up from the job files written since the last scan (see job_feed), not the whole queue.
+#
+#   BWA_CDX_DB      jobs/cdx/captures.db
+#   BWA_CDX_SYNC    600    seconds between QDN listings
+#   BWA_CDX_POLL    5      seconds between scans for finished local jobs
+
+DB_PATH = os.environ.get("BWA_CDX_DB", "jobs/cdx/captures.db")
+
+# rows fetched per query while streaming
+PAGE_SIZE = 500
+
+FIELDS = {
+    "urlkey": "surt",
+    "timestamp": "timestamp",
+    "url": "url",
+    "url_key": "url_key",
+    "domain": "domain",
+    "status": "status",
+    "statuscode": "http_status",
+    "digest": "content_hash",
+    "job_id": "job_id",
+    "source": "source",
+}
+DEFAULT_FIELDS = ["urlkey", "timestamp", "url", "status", "statuscode", "digest", "job_id"]
+MATCH_TYPES = ("exact", "prefix", "host", "domain")
+FINISHED = ("complete", "failed", "unchanged")
+
+INDEXED = REGISTRY.register(counter("bwa_cdx_indexed_total", "Captures added to the CDX index by source", ["source"]))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS captures (
+    capture TEXT PRIMARY KEY,
+    surt TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    url TEXT,
+    url_key TEXT,
+    domain TEXT,
+    status TEXT,
+    http_status INTEGER,
+    content_hash TEXT,
+    job_id TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_surt ON captures (surt, timestamp, capture);
+CREATE INDEX IF NOT EXISTS captures_content_hash ON captures (content_hash);
+CREATE INDEX IF NOT EXISTS captures_url_key ON captures (url_key, timestamp);
+"""
+
+
+def surt(url):
+    """
+    Return the SURT form of a URL, the key captures are sorted and matched by.
+
+    :param url: Absolute URL, or one without a scheme ("example.com/blog/")
+    """
+    parts = urlsplit(url.strip() if "://" in url else "http://" + url.strip())
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split(".")))
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        key += f":{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return (key + ")" + (parts.path or "/") + ("?" + query if query else "")).lower()
+
+
+def format_timestamp(seconds):
+    """
+    Return epoch seconds as a 14 digit CDX timestamp (YYYYMMDDhhmmss, UTC).
+    """
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime(seconds))
+
+
+def parse_timestamp(value, end = False):
+    """
+    Parse a CDX timestamp, any prefix of YYYYMMDDhhmmss, or an ISO 8601 time.
+
+    :param value: "2024", "202403", "20240315120000", "2024-03-15T12:00:00Z", ...
+    :param end: Return the last second of a partial timestamp instead of the first
+    :returns: Epoch seconds
+    :raises ValueError: if the value is neither
+    """
+    value = value.strip()
+    try:
+        if value.isdigit() and 4 <= len(value) <= 14 and len(value) % 2 == 0:
+            fields = [int(value[:4])] + [int(value[i:i + 2]) for i in range(4, len(value), 2)]
+            if end:
+                fields += [12, 0, 23, 59, 59][len(fields) - 1:]
+                if len(value) < 8:
+                    fields[2] = calendar.monthrange(fields[0], fields[1])[1]
+            else:
+                fields += [1, 1, 0, 0, 0][len(fields) - 1:]
+            return calendar.timegm(datetime(*fields).timetuple())
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp {value!r}, expected YYYY[MM[DD[hh[mm[ss]]]]] or ISO 8601")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def encode_key(row):
+    return base64.urlsafe_b64encode(json.dumps([row["surt"], row["timestamp"], row["capture"]]).encode()).decode()
+
+
+def decode_key(key):
+    try:
+        return json.loads(base64.urlsafe_b64decode(key.encode()))
+    except ValueError:
+        raise ValueError("Invalid resumeKey")
+
+
+class cdx_query:
+    def __init__(self, url, match_type = "", start = "", end = "", closest = "", sort = "", collapse = "",
+                 limit = 0, fields = "", filters = (), resume_key = ""):
+        """
+        A parsed and validated capture query, parameters as the CDX server API names them.
+
+        :param url: URL or URL prefix; "example.com/*" implies prefix and "*.example.com" domain matching
+        :param match_type: exact, prefix, host or domain
+        :param start: Earliest capture time ("from"), see parse_timestamp()
+        :param end: Latest capture time ("to")
+        :param closest: Order by distance from this time
+        :param sort: "reverse" for descending URL and time order, default ascending
+        :param collapse: Drop rows whose field equals the previous row's, "field" or "field:N" for a prefix of N characters
+        :param limit: Maximum number of rows, 0 for all
+        :param fields: Comma separated fields to return ("fl"), defaults to DEFAULT_FIELDS
+        :param filters: "field:value" must match, "!field:value" must not
+        :param resume_key: Continue after the last row of a previous response
+        :raises ValueError: on any invalid parameter
+        """
+        url = url.strip()
+        if not url:
+            raise ValueError("url is required")
+        if url.startswith("*."):
+            url, match_type = url[2:], match_type or "domain"
+        elif url.endswith("*"):
+            url, match_type = url.rstrip("*"), match_type or "prefix"
+        self.match_type = match_type or "exact"
+        if self.match_type not in MATCH_TYPES:
+            raise ValueError(f"Unknown matchType {self.match_type!r}, expected one of {', '.join(MATCH_TYPES)}")
+
+        key = surt(url)
+        host = key.split(")", 1)[0]
+        # where[0:2] is the surt range for the non exact matches, page() narrows it
+        if self.match_type == "exact":
+            self.where, self.args = ["surt = ?"], [key]
+        else:
+            low = key if self.match_type == "prefix" else host + ")"
+            if self.match_type == "domain":
+                # ")" ends the host and "," starts a subdomain, "-" sorts right after both
+                high = host + "-"
+            else:
+                high = low[:-1] + chr(ord(low[-1]) + 1)
+            self.where, self.args = ["surt >= ?", "surt < ?"], [low, high]
+
+        if start:
+            self.where.append("timestamp >= ?")
+            self.args.append(parse_timestamp(start))
+        if end:
+            self.where.append("timestamp <= ?")
+            self.args.append(parse_timestamp(end, end=True))
+        for spec in filters:
+            negate = spec.startswith("!")
+            name, _, value = spec.lstrip("!").partition(":")
+            if name not in FIELDS or not _:
+                raise ValueError(f"Invalid filter {spec!r}, expected [!]field:value with field one of {', '.join(FIELDS)}")
+            if name == "timestamp":
+                raise ValueError("Filter captures by time with from and to")
+            column = FIELDS[name]
+            self.where.append(f"({column} IS NULL OR {column} != ?)" if negate else f"{column} = ?")
+            self.args.append(int(value) if column == "http_status" and value.isdigit() else value)
+
+        self.closest = parse_timestamp(closest) if closest else None
+        self.reverse = sort == "reverse"
+        if sort not in ("", "reverse", "closest"):
+            raise ValueError(f"Unknown sort {sort!r}")
+
+        self.collapse = None
+        if collapse:
+            name, _, width = collapse.partition(":")
+            if name not in FIELDS or (width and not width.isdigit()):
+                raise ValueError(f"Invalid collapse {collapse!r}, expected field or field:N")
+            self.collapse = (name, int(width) if width else None)
+
+        self.limit = max(0, int(limit))
+        self.fields = [name.strip() for name in fields.split(",") if name.strip()] if fields else DEFAULT_FIELDS
+        unknown = [name for name in self.fields if name not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {', '.join(unknown)}")
+
+        self.after = decode_key(resume_key) if resume_key else None
+        if self.after and self.closest is not None:
+            raise ValueError("resumeKey cannot be combined with closest")
+
+
+    def collapse_value(self, row):
+        name, width = self.collapse
+        value = row[name]
+        return value[:width] if width and isinstance(value, str) else value
+
+
+class cdx_index:
+    def __init__(self, path = None):
+        """
+        SQLite index of captures by SURT and time.
+
+        :param path: Database file, defaults to BWA_CDX_DB
+        """
+        self.path = path or DB_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+
+        db = self.connect()
+        with self.write_lock, db:
+            db.executescript(SCHEMA)
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', ?)", (uuid.uuid4().hex,))
+        self.generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+
+    def connect(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            self.local.db = db
+        return db
+
+
+    def add(self, captures):
+        """
+        Add or update captures in one transaction.
+
+        A local capture replaces the QDN row of the same version; a QDN version is only
+        added if no capture of the same URL has its content hash yet.
+
+        :param captures: dicts with capture, url, url_key, timestamp, status, http_status,
+                         content_hash, job_id and source ("local" or "qdn")
+        :returns: Number of rows written
+        """
+        db = self.connect()
+        written = 0
+        with self.write_lock, db:
+            for capture in captures:
+                row = {
+                    **capture,
+                    "surt": surt(capture["url"]),
+                    "domain": (urlsplit(capture["url"]).hostname or "").lower(),
+                    "timestamp": int(capture["timestamp"]),
+                }
+                if row["source"] == "qdn":
+                    known = db.execute("SELECT 1 FROM captures WHERE content_hash = ? AND url_key = ? LIMIT 1",
+                                       (row["content_hash"], row["url_key"])).fetchone()
+                    if known:
+                        continue
+                elif row["content_hash"]:
+                    db.execute("DELETE FROM captures WHERE capture = ?", ("qdn:" + row["content_hash"],))
+                db.execute(
+                    "INSERT OR REPLACE INTO captures (capture, surt, timestamp, url, url_key, domain, status, http_status, content_hash, job_id, source) "
+                    "VALUES (:capture, :surt, :timestamp, :url, :url_key, :domain, :status, :http_status, :content_hash, :job_id, :source)",
+                    row,
+                )
+                written += 1
+        return written
+
+
+    def has_version(self, identifier):
+        """
+        Return True if a QDN resource (named by its content hash) is indexed already.
+        """
+        content_hash = identifier if identifier.startswith("sha256:") else "sha256:" + identifier
+        return self.connect().execute("SELECT 1 FROM captures WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone() is not None
+
+
+    def latest(self, url_key, status = "complete", source = "local"):
+        """
+        Return the newest capture of a URL, None if there is none (blocking).
+
+        :param url_key: The url_key of the URL
+        :param status: Only captures with this status
+        :param source: Only captures from this source
+        """
+        return self.connect().execute(
+            "SELECT * FROM captures WHERE url_key = ? AND status = ? AND source = ? ORDER BY timestamp DESC LIMIT 1",
+            (url_key, status, source),
+        ).fetchone()
+
+
+    def page(self, query, after = None, size = PAGE_SIZE):
+        """
+        Return one page of a query in SURT and time order (blocking).
+
+        :param query: The cdx_query
+        :param after: (surt, timestamp, capture) of the last row already returned
+        :param size: Rows per page
+        """
+        where, args = list(query.where), list(query.args)
+        if after:
+            # start the surt range at the key itself so SQLite seeks to it instead of
+            # scanning the range up to it
+            if query.match_type != "exact":
+                if query.reverse:
+                    where[1], args[1] = "surt <= ?", after[0]
+                else:
+                    args[0] = after[0]
+            where.append("(surt, timestamp, capture) < (?, ?, ?)" if query.reverse else "(surt, timestamp, capture) > (?, ?, ?)")
+            args += after
+        order = "DESC" if query.reverse else "ASC"
+        return self.connect().execute(
+            f"SELECT * FROM captures WHERE {' AND '.join(where)} "
+            f"ORDER BY surt {order}, timestamp {order}, capture {order} LIMIT ?",
+            [*args, size],
+        ).fetchall()
+
+
+    def closest(self, query, size):
+        """
+        Return up to size captures nearest to query.closest, nearest first (blocking).
+        """
+        db = self.connect()
+        where = " AND ".join(query.where)
+        # walk the time order out from the target on both sides, then merge
+        before = db.execute(f"SELECT * FROM captures WHERE {where} AND timestamp <= ? ORDER BY timestamp DESC LIMIT ?",
+                            [*query.args, query.closest, size]).fetchall()
+        after = db.execute(f"SELECT * FROM captures WHERE {where} AND timestamp > ? ORDER BY timestamp ASC LIMIT ?",
+                           [*query.args, query.closest, size]).fetchall()
+        return sorted([*before, *after], key=lambda row: abs(row["timestamp"] - query.closest))[:size]
+
+
+    async def stream(self, query, page_size = PAGE_SIZE):
+        """
+        Yield the rows of a query as dicts of the requested fields, fetching page by page on the io pool.
+
+        The last item is {"resumeKey": ...} when rows remain after the limit.
+        """
+        emitted = 0
+        previous = None
+        last = None
+        if query.closest is not None:
+            pages = [await io_pool.run(self.closest, query, query.limit or page_size)]
+        else:
+            pages = None
+        after = query.after
+
+        while True:
+            if pages is not None:
+                if not pages:
+                    return
+                rows = pages.pop()
+            else:
+                rows = await io_pool.run(self.page, query, after, page_size)
+            if not rows:
+                return
+            for row in rows:
+                after = [row["surt"], row["timestamp"], row["capture"]]
+                fields = {name: row[column] for name, column in FIELDS.items()}
+                fields["timestamp"] = format_timestamp(row["timestamp"])
+                if query.collapse:
+                    value = query.collapse_value(fields)
+                    if value == previous:
+                        continue
+                    previous = value
+                if query.limit and emitted == query.limit:
+                    if pages is None:
+                        yield {"resumeKey": encode_key(last)}
+                    return
+                emitted += 1
+                last = row
+                yield {name: fields[name] for name in query.fields}
+            if pages is None and len(rows) < page_size:
+                return
+
+
+class cdx_feed:
+    SYNC_INTERVAL = float(os.environ.get("BWA_CDX_SYNC", 600))
+    POLL_INTERVAL = float(os.environ.get("BWA_CDX_POLL", 5.0))
+    BATCH_SIZE = 256
+
+    def __init__(self, index = None, basedir = "jobs/manifest"):
+        """
+        Background stage that feeds finished local jobs and QDN versions into the capture index.
+
+        :param index: The cdx_index, defaults to one at BWA_CDX_DB
+        :param basedir: Base directory of crawl output, for the QDN listing
+        """
+        self.index = index or cdx_index()
+        self.basedir = basedir
+        self.jobs = job_queue()
+        self.feed = job_feed(self.unindexed, self.jobs)
+        self.tasks = []
+        self.logger = logging.getLogger("bwa_cdx")
+
+
+    def start(self):
+        """
+        Start the local and QDN feeds on the running event loop.
+        """
+        self.tasks = [asyncio.create_task(self.run_local()), asyncio.create_task(self.run_sync())]
+        return self.tasks
+
+
+    async def stop(self):
+        """
+        Cancel both feeds.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+    def capture(self, job):
+        """
+        Return the index row of a finished local job.
+        """
+        timestamp = job.get("crawled_at")
+        if not timestamp:
+            # failed and unchanged jobs never reach the crawled state
+            try:
+                timestamp = os.path.getmtime(self.jobs._job_path(job["id"]))
+            except OSError:
+                timestamp = time.time()
+        return {
+            "capture": job["id"],
+            "url": job["url"],
+            "url_key": job["url_hash"],
+            "timestamp": timestamp,
+            "status": job["status"],
+            "http_status": (job.get("validators") or {}).get("status"),
+            "content_hash": job.get("content_hash"),
+            "job_id": job["id"],
+            "source": "local",
+        }
+
+
+    def unindexed(self, job):
+        return (job.get("status") in FINISHED and job.get("url") and job.get("url_hash")
+                and job.get("cdx") != self.index.generation)
+
+
+    def index_local(self):
+        """
+        Index finished jobs not yet in this index (blocking).
+
+        :returns: Number of jobs indexed
+        """
+        jobs = list(self.feed.refresh().values())[:self.BATCH_SIZE]
+        if jobs:
+            INDEXED.inc(self.index.add([self.capture(job) for job in jobs]), source="local")
+            for job in jobs:
+                self.jobs.update_job(job["id"], {"cdx": self.index.generation})
+                self.feed.discard(job["id"])
+        return len(jobs)
+
+
+    def sync(self):
+        """
+        Index the QDN versions no local job accounts for (blocking).
+
+        :returns: Number of versions added
+        """
+        from .bwa_manifest import bwa_manifest
+
+        manifests = bwa_manifest(None, self.basedir).scan_manifests(skip=self.index.has_version)
+        captures = []
+        for identifier, manifest, _ in manifests:
+            try:
+                timestamp = parse_timestamp(manifest["timestamp"])
+            except (KeyError, ValueError):
+                continue
+            captures.append({
+                "capture": "qdn:" + manifest["content_hash"],
+                "url": manifest.get("target_url", ""),
+                "url_key": manifest.get("url_key"),
+                "timestamp": timestamp,
+                "status": "complete",
+                "http_status": None,
+                "content_hash": manifest["content_hash"],
+                "job_id": None,
+                "source": "qdn",
+            })
+        added = self.index.add(captures)
+        INDEXED.inc(added, source="qdn")
+        return added
+
+
+    async def run_local(self):
+        while True:
+            try:
+                if not await io_pool.run(self.index_local):
+                    await asyncio.sleep(self.POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"CDX indexing of local jobs failed: {e}")
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+
+    async def run_sync(self):
+        while True:
+            try:
+                added = await net_pool.run(self.sync)
+                if added:
+                    self.logger.info(f"Indexed {added} versions from QDN")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"CDX sync with QDN failed: {e}")
+            await asyncio.sleep(self.SYNC_INTERVAL)
@@ -0,0 +1,208 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import io
+import json
+import time
+import hashlib
+import zipfile
+import requests
+import concurrent.futures
+from .bwa_pool import bwa_pool
+from .bwa_metrics import REGISTRY, counter
+
+# Bundles larger than BWA_CHUNK_SIZE (4 MiB) are published in pieces of that size, each
+# its own QDN resource, so no single request has to carry a whole large capture:
+#   c-<first 62 hex of the piece's sha256>   one resource per piece; content addressed, so
+#                                            a piece two versions share is one resource
+#   <content hash>                           the head: a ZIP holding only manifest.json,
+#                                            the bundle's manifest plus "chunks"
+#
+#   "chunks": {"size": 4194304, "bytes": 9876543, "parts": ["sha256:...", ...]}
+#
+# Pieces go up and come down on the "chunks" pool (BWA_CHUNK_WORKERS, default 8), shared
+# by every transfer, and each is retried BWA_CHUNK_RETRIES times on its own. The head is
+# published last, so a listed version always has its pieces. A fetched piece is checked
+# against its hash and written at its offset in a spool file, which the cache verifies
+# and adopts; memory holds at most one piece per worker. Request timeouts allow
+# BWA_QDN_MIN_RATE bytes/sec (64 KiB/s) on top of 10 seconds.
+
+CHUNK_SIZE = int(os.environ.get("BWA_CHUNK_SIZE", 4 * 1024 * 1024))
+WORKERS = int(os.environ.get("BWA_CHUNK_WORKERS", 8))
+RETRIES = int(os.environ.get("BWA_CHUNK_RETRIES", 4))
+BACKOFF = float(os.environ.get("BWA_CHUNK_BACKOFF", 1.0))
+MIN_RATE = float(os.environ.get("BWA_QDN_MIN_RATE", 64 * 1024))
+
+PREFIX = "c-"
+# heads are a manifest in a ZIP, anything larger is a whole bundle
+HEAD_MAX_BYTES = 1024 * 1024
+
+CHUNK_RETRIES = REGISTRY.register(counter("bwa_chunk_retries_total", "Chunk transfers retried", ["direction"]))
+
+chunk_pool = bwa_pool("chunks", WORKERS)
+
+
+def timeout(size):
+    """
+    Return the seconds a QDN request carrying size bytes may take.
+    """
+    return 10 + size / MIN_RATE
+
+
+def identifier(digest):
+    """
+    Return the QDN identifier of a piece from its "sha256:" digest (identifiers are at most 64 characters).
+    """
+    return PREFIX + digest.replace("sha256:", "")[:64 - len(PREFIX)]
+
+
+def is_chunk(resource_identifier):
+    return resource_identifier.startswith(PREFIX)
+
+
+def transient(error):
+    # same rule as publisher.transient; a corrupt piece is fetched again too
+    if isinstance(error, ValueError):
+        return True
+    response = getattr(error, "response", None)
+    return response is None or response.status_code == 429 or response.status_code >= 500
+
+
+def retried(direction, call, *args):
+    """
+    Call a piece transfer, retrying transient failures with exponential backoff.
+    """
+    for attempt in range(1, RETRIES + 1):
+        try:
+            return call(*args)
+        except (requests.RequestException, ValueError) as e:
+            if not transient(e) or attempt == RETRIES:
+                raise
+            CHUNK_RETRIES.inc(direction=direction)
+            time.sleep(BACKOFF * 2 ** (attempt - 1))
+
+
+def run_all(fn, count):
+    """
+    Run fn(0) .. fn(count - 1) on the chunk pool; the first failure cancels the rest and is raised.
+    """
+    futures = [chunk_pool.submit(fn, index) for index in range(count)]
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        raise
+
+
+def split(data, size = None):
+    """
+    Cut bundle bytes into pieces.
+
+    :returns: (chunks dict for the manifest, list of memoryviews of the pieces)
+    """
+    size = size or CHUNK_SIZE
+    view = memoryview(data)
+    pieces = [view[start:start + size] for start in range(0, len(data), size)]
+    chunks = {
+        "size": size,
+        "bytes": len(data),
+        "parts": ["sha256:" + hashlib.sha256(piece).hexdigest() for piece in pieces],
+    }
+    return chunks, pieces
+
+
+def head(manifest, chunks):
+    """
+    Build the head resource of a chunked bundle: a ZIP with the manifest and its chunk list.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("manifest.json", json.dumps({**manifest, "chunks": chunks}, indent=2))
+    return buffer.getvalue()
+
+
+def read_head(data):
+    """
+    Return the "chunks" of a downloaded head resource, or None if data is a whole bundle.
+    """
+    if len(data) > HEAD_MAX_BYTES:
+        return None
+    try:
+        with zipfile.ZipFile(io.BytesIO(data), "r") as zip_file:
+            if zip_file.namelist() != ["manifest.json"]:
+                return None
+            return json.loads(zip_file.read("manifest.json").decode("utf-8")).get("chunks")
+    except (ValueError, zipfile.BadZipFile):
+        return None
+
+
+def upload(chunks, pieces, put, sent = None):
+    """
+    Publish the pieces of a bundle in parallel.
+
+    :param put: put(identifier, data) publishes one resource and returns the bytes sent
+    :param sent: Set of identifiers already published, e.g. by an earlier attempt; updated
+    :returns: Bytes sent
+    """
+    sent = set() if sent is None else sent
+
+    def one(index):
+        name = identifier(chunks["parts"][index])
+        if name in sent:
+            return 0
+        size = retried("upload", put, name, pieces[index])
+        sent.add(name)
+        return size
+
+    return sum(run_all(one, len(pieces)))
+
+
+def download(chunks, get, path):
+    """
+    Fetch the pieces of a bundle in parallel and write them into path.
+
+    :param get: get(identifier, size) returns the bytes of one resource, raising on failure
+    :param path: File to reassemble the bundle in, removed again on failure
+    :returns: path
+    :raises ValueError: if a piece still does not match its hash after the retries
+    """
+    size, total, parts = chunks["size"], chunks["bytes"], chunks["parts"]
+    if not parts or len(parts) != -(-total // size):
+        raise ValueError("chunk list does not cover the bundle")
+
+    def fetch(index):
+        expected = min(size, total - index * size)
+        data = get(identifier(parts[index]), expected)
+        if len(data) != expected or "sha256:" + hashlib.sha256(data).hexdigest() != parts[index]:
+            raise ValueError(f"chunk {index} does not match its hash")
+        return data
+
+    try:
+        with open(path, "wb") as f:
+            f.truncate(total)
+
+            def one(index):
+                os.pwrite(f.fileno(), retried("download", fetch, index), index * size)
+
+            run_all(one, len(parts))
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path
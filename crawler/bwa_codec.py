@@ -0,0 +1,147 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import zipfile
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for the zstd codecs
+    zstandard = None
+
+# Codecs for data we compress ourselves:
+#   WARC   - "gzip": one gzip member per record (warc/crawl.warc.gz, the WARC standard)
+#            "zstd": one zstd frame per record  (warc/crawl.warc.zst)
+#   bundle - "deflate": small members we produce are ZIP_DEFLATED
+#            "zstd": they are zstd-compressed, stored as <member>.zst and listed in the manifest
+# Members that are already compressed (gzip WARC, PNG/JPEG/WebP, zstd) are always ZIP_STORED.
+
+WARC_CODEC = os.environ.get("BWA_WARC_CODEC", "gzip")
+BUNDLE_CODEC = os.environ.get("BWA_BUNDLE_CODEC", "deflate")
+ZSTD_LEVEL = int(os.environ.get("BWA_ZSTD_LEVEL", 10))
+
+WARC_MEMBERS = {
+    "gzip": "warc/crawl.warc.gz",
+    "zstd": "warc/crawl.warc.zst",
+}
+
+PRECOMPRESSED = (".gz", ".zst", ".br", ".png", ".jpg", ".jpeg", ".webp", ".zip")
+
+
+def require_zstd():
+    """
+    Raise a clear error when a zstd codec is selected without the zstandard package.
+    """
+    if zstandard is None:
+        raise RuntimeError("zstd codec selected but the 'zstandard' package is not installed")
+
+
+def warc_member(codec = None):
+    """
+    Return the bundle path of the WARC written with a codec.
+
+    :param codec: "gzip" or "zstd", defaults to BWA_WARC_CODEC
+    """
+    return WARC_MEMBERS[codec or WARC_CODEC]
+
+
+def compress_type(member):
+    """
+    Return the ZIP compression for a bundle member.
+
+    :param member: Path of the member inside the bundle
+    :returns: zipfile.ZIP_STORED for data that is already compressed, zipfile.ZIP_DEFLATED otherwise
+    """
+    if member.lower().endswith(PRECOMPRESSED):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def write_member(zip_file, member, data, codec = None, level = None):
+    """
+    Add one member to a bundle with the right compression.
+
+    :param zip_file: zipfile.ZipFile open for writing
+    :param member: Logical path of the member
+    :param data: The member bytes
+    :param codec: Bundle codec, defaults to BWA_BUNDLE_CODEC
+    :param level: zstd level, defaults to BWA_ZSTD_LEVEL
+    :returns: The path the member was stored under
+    """
+    codec = codec or BUNDLE_CODEC
+    if codec == "zstd" and compress_type(member) == zipfile.ZIP_DEFLATED:
+        require_zstd()
+        compressor = zstandard.ZstdCompressor(level=level or ZSTD_LEVEL)
+        member += ".zst"
+        data = compressor.compress(data)
+    zip_file.writestr(member, data, compress_type=compress_type(member))
+    return member
+
+
+def open_zstd(f):
+    """
+    Wrap a zstd-compressed file object in a decompressing reader.
+
+    :param f: Binary file object holding one or more zstd frames
+    :returns: Binary file object of the decompressed data
+    """
+    require_zstd()
+    return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+
+
+def content_size(f):
+    """
+    Return the decompressed size recorded in the first zstd frame of a member.
+
+    :param f: Binary file object positioned at the start of the frame
+    :returns: Size in bytes, or None if the frame does not record it
+    """
+    require_zstd()
+    size = zstandard.frame_content_size(f.read(18))
+    return size if size >= 0 else None
+
+
+def compress_warc_record(record_bytes, level = None):
+    """
+    Compress one uncompressed WARC record into a standalone zstd frame.
+
+    :param record_bytes: The serialized record
+    :param level: zstd level, defaults to BWA_ZSTD_LEVEL
+    """
+    require_zstd()
+    return zstandard.ZstdCompressor(level=level or ZSTD_LEVEL, write_content_size=True).compress(record_bytes)
+
+
+def read_frame(f, offset, length):
+    """
+    Decompress a single zstd frame of a per-record zstd WARC.
+
+    :param f: Seekable binary file object
+    :param offset: Byte offset of the frame
+    :param length: Compressed length of the frame
+    :returns: The decompressed record bytes
+    """
+    require_zstd()
+    f.seek(offset)
+    return zstandard.ZstdDecompressor().decompress(f.read(length))
+
+
+def warc_reader(f, member):
+    """
+    Return a stream warcio's ArchiveIterator can read, whatever codec the WARC uses.
+
+    :param f: Binary file object of the WARC member
+    :param member: Path of the member, used to pick the codec
+    """
+    if member.endswith(".zst"):
+        return open_zstd(f)
+    return f
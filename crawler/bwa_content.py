@@ -0,0 +1,269 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import gzip
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from .bwa_metrics import cache_result
+
+try:
+    import brotli
+except ImportError:  # optional, br variants are skipped without it
+    brotli = None
+
+# HTTP helpers for serving archived files:
+#   - media types for bundle members (snapshot.html, snapshot.png, crawl.warc.gz, ...)
+#   - strong ETags and If-None-Match / If-Range matching
+#   - single byte ranges
+#   - precompressed gzip/br variants of text members, kept beside the cache as
+#     jobs/cache/variants/<content_hash>/<member>.gz|.br
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+mimetypes.add_type("application/warc", ".warc")
+mimetypes.add_type("image/webp", ".webp")
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+VARIANT_MIN_BYTES = 1024
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def media_type(member):
+    """
+    Return the Content-Type to serve a file with.
+
+    :param member: File name or path inside a bundle
+    """
+    name = member[:-4] if member.endswith(".zst") else member
+    guessed, encoding = mimetypes.guess_type(name)
+    if encoding == "gzip":
+        # crawl.warc.gz and friends are downloads, not transfer-encoded text
+        return "application/gzip"
+    return guessed or "application/octet-stream"
+
+
+def compressible(content_type):
+    """
+    Tell whether precompressing a media type is worth it.
+    """
+    return content_type.startswith(COMPRESSIBLE)
+
+
+def etag_matches(header, etag):
+    """
+    Weak comparison of an If-None-Match header against an ETag.
+
+    :param header: The If-None-Match header value, may be None
+    :param etag: The quoted ETag of the representation
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header into one byte range.
+
+    :param header: The Range header value, may be None
+    :param size: Size of the representation in bytes
+    :returns: (start, end) inclusive, None to serve the whole file (no range, multiple
+              ranges or an unknown unit), or False if the range cannot be satisfied
+    """
+    if not header or size is None:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return (max(size - length, 0), size - 1)
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return (start, min(end, size - 1))
+
+
+def read_range(f, start, length, chunk_size = 64 * 1024):
+    """
+    Yield length bytes of a file object starting at start.
+
+    :param f: Binary file object, closed when the generator finishes
+    :param start: First byte to send
+    :param length: Number of bytes to send, None for everything after start
+    """
+    with f:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def accepted_encodings(header):
+    """
+    Return the precompressed encodings a client accepts, best first.
+
+    :param header: The Accept-Encoding header value, may be None
+    """
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return [encoding for encoding in ENCODINGS if encoding in accepted and (encoding != "br" or brotli)]
+
+
+class bwa_variants:
+    def __init__(self, bundles):
+        """
+        Precompressed gzip/br copies of text members, built once per bundle member.
+
+        :param bundles: bwa_bundle reader over the shared cache
+        """
+        self.bundles = bundles
+        self.variant_dir = os.path.join(bundles.cache.cache_dir, "variants")
+        self.locks = OrderedDict()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("bwa_variants")
+
+    def path(self, content_hash, member, encoding):
+        """
+        Return where the variant of one member is kept.
+        """
+        key = self.bundles.cache.strip_hash(content_hash)
+        return os.path.join(self.variant_dir, key, member + ENCODINGS[encoding])
+
+    def _member_lock(self, path):
+        with self.lock:
+            lock = self.locks.get(path)
+            if lock is None:
+                lock = self.locks[path] = threading.Lock()
+                while len(self.locks) > 1024:
+                    self.locks.popitem(last=False)
+            return lock
+
+    def get(self, content_hash, member, encoding):
+        """
+        Return the path of a precompressed variant, building it on first use.
+
+        Purpose: Text members are compressed once instead of on every view.
+
+        Inputs:
+        - content_hash (str): The content hash of the bundle.
+        - member (str): Path of the file inside the bundle.
+        - encoding (str): "gzip" or "br".
+
+        Outputs: str or None: Path of the variant, or None if the member does not exist.
+
+        Means: Streams the member through the encoder into a temporary file beside the
+        variant and renames it into place, so readers never see a partial variant.
+        """
+        path = self.path(content_hash, member, encoding)
+        if os.path.exists(path):
+            cache_result("variant", True)
+            return path
+        cache_result("variant", False)
+        with self._member_lock(path):
+            if os.path.exists(path):
+                return path
+            f = self.bundles.open_member(content_hash, member)
+            if f is None:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with f, open(tmp_path, "wb") as out:
+                    if encoding == "gzip":
+                        # mtime=0 keeps the bytes, and so the ETag, identical across rebuilds
+                        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as gz:
+                            shutil.copyfileobj(f, gz, 64 * 1024)
+                    else:
+                        compressor = brotli.Compressor(quality=11)
+                        for chunk in iter(lambda: f.read(64 * 1024), b""):
+                            out.write(compressor.process(chunk))
+                        out.write(compressor.finish())
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self.logger.info(f"Built {encoding} variant of {member} in {content_hash}")
+        return path
+
+
+class file_etags:
+    def __init__(self, size = 4096):
+        """
+        Strong ETags for local job files, hashed once per (path, size, mtime).
+
+        :param size: Number of files remembered
+        """
+        self.size = size
+        self.etags = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Return the strong ETag of a local file.
+
+        :param path: Path of the file
+        :returns: The quoted sha256 of the file contents
+        """
+        st = os.stat(path)
+        key = (str(path), st.st_size, st.st_mtime_ns)
+        with self.lock:
+            etag = self.etags.get(key)
+            if etag is not None:
+                self.etags.move_to_end(key)
+                return etag
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        etag = f'"{digest.hexdigest()}"'
+
+        with self.lock:
+            self.etags[key] = etag
+            while len(self.etags) > self.size:
+                self.etags.popitem(last=False)
+        return etag
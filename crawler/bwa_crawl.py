@@ -13,97 +13,82 @@
 import os
 import io
 import json
+import time
+import asyncio
 import datetime
+import shutil
 import logging
-import sys
 from warcio import StatusAndHeaders, WARCWriter
 from datetime import datetime, UTC
-from playwright.async_api import async_playwright
 from .bwa_snapshot import snapshot
 from .bwa_jobqueue import job_queue
+from .bwa_pool import io_pool, net_pool
+from .bwa_cache import bwa_cache
+from .bwa_browser import browsers, browser_pool
+from .bwa_metrics import stage, JOBS_FINISHED
+from .bwa_trace import job_trace, job_profile
+from .bwa_log import job_log
+from . import bwa_codec
+from . import bwa_recrawl
 
 class crawler:
+    TIMEOUT = int(os.environ.get("BWA_CRAWL_TIMEOUT", 30000))
+    HAR_MAX_BYTES = int(os.environ.get("BWA_HAR_MAX_BYTES", 1024 ** 3))
 
-    def __init__(self, job_id, basedir = "jobs/manifest"):
+    def __init__(self, job_id, basedir = "jobs/manifest", user_agent = None):
         self.job_id = job_id
+        self.user_agent = user_agent
         self.jobs = job_queue()
         self.job = self.jobs.get_job(self.job_id)
         self.basedir = os.path.join(basedir, f"{job_id}.d")
 
-        # configure logger for this instance only (don't configure globally)
-        self.logger = logging.getLogger(f"bwa_crawl.{job_id}")
-        self.logger.setLevel(logging.DEBUG)
-        
-        # Only add handler if logger doesn't already have one
-        if not self.logger.handlers:
-            handler = logging.StreamHandler(sys.stdout)
-            handler.setFormatter(logging.Formatter(
-                "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-            ))
-            self.logger.addHandler(handler)
-
-        # ensure Uvicorn loggers propagate
-        for name in ("uvicorn.error", "uvicorn.access"):
-            uv_logger = logging.getLogger(name)
-            uv_logger.handlers.clear()
-            uv_logger.propagate = True
-
-
-    def fault(self, state, msg):
+        self.logger = logging.getLogger("bwa_crawl")
+
+
+    async def fault(self, state, msg):
             self.job["fault"] = state
+            self.job["status"] = "failed"
             self.job["message"] = msg
-            self.jobs.update_job(self.job_id,self.job)
+            await io_pool.run(self.jobs.update_job, self.job_id, self.job)
             self.logger.error(msg)
 
 
-    def status(self, state,  msg):
+    async def status(self, state,  msg):
             self.job["status"] = state
             self.job["message"] = msg
-            self.jobs.update_job(self.job_id,self.job)
+            await io_pool.run(self.jobs.update_job, self.job_id, self.job)
             self.logger.info(msg)
 
 
-    async def warc(self, url: str, timeout: int = 30000, user_agent: str = None):
+    async def warc(self, har_path):
         """
-        Crawl a URL using Playwright's async API, record HAR, then convert that HAR
-        into a WARC object in memory, ready to be written to a .warc.gz file.
+        Convert the HAR recorded during the crawl into a WARC object in memory,
+        ready to be written to a .warc.gz file.
 
-        :param url: target URL
-        :param timeout: max navigation timeout (ms)
-        :param user_agent: optional user agent
-        :return: an in-memory BufferWARCWriter
+        :param har_path: HAR written by Playwright when the crawl's context closed
+        :return: an in-memory BytesIO holding the WARC
         """
+        # Parsing and compressing run on the io pool, off the event loop
+        with stage("warc"):
+            return await io_pool.run(self.har_to_warc, har_path)
 
-        har_path = "temp_capture.har"
 
-        # 1) Run Playwright async and record HAR
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context_args = {"record_har_path": har_path}
-            if user_agent:
-                context_args["user_agent"] = user_agent
-
-            context = await browser.new_context(**context_args)
-            page = await context.new_page()
-
-            await page.goto(url, timeout=timeout)
-            try:
-                await page.wait_for_load_state("networkidle", timeout=timeout)
-            except Exception:
-                pass  # Ignore timeout, HAR may still be recorded
-
-            await context.close()
-            await browser.close()
+    def har_to_warc(self, har_path):
+        """
+        Convert a recorded HAR file into an in-memory WARC and remove the HAR.
 
-        # 2) Load the HAR JSON
+        :param har_path: Path of the HAR written by Playwright
+        :return: BytesIO positioned at the start of the WARC
+        """
         if not os.path.exists(har_path):
             raise Exception(f"HAR file {har_path} not created, possibly due to navigation failure")
         with open(har_path, "r", encoding="utf-8") as f:
             har_data = json.load(f)
 
-        # 3) Prepare an in-memory WARC writer
+        # 3) Prepare an in-memory WARC writer; zstd WARCs get one frame per record
         warc_buffer = io.BytesIO()
-        warc_writer = WARCWriter(warc_buffer, gzip=True)
+        zstd = bwa_codec.WARC_CODEC == "zstd"
+        warc_writer = WARCWriter(warc_buffer, gzip=not zstd)
 
         # 4) Convert HAR entries into WARC response records
         for entry in har_data.get("log", {}).get("entries", []):
@@ -147,7 +132,12 @@ class crawler:
                 warc_headers_dict={'WARC-Date': timestamp}
             )
 
-            warc_writer.write_record(warc_record)
+            if zstd:
+                record_buffer = io.BytesIO()
+                WARCWriter(record_buffer, gzip=False).write_record(warc_record)
+                warc_buffer.write(bwa_codec.compress_warc_record(record_buffer.getvalue()))
+            else:
+                warc_writer.write_record(warc_record)
 
         warc_buffer.seek(0)
         os.remove(har_path)
@@ -167,39 +157,182 @@ class crawler:
             return False
 
 
+    async def capture(self, url):
+        """
+        Load a page in a pooled browser and store its HTML, screenshot and WARC.
+
+        The DOM and the screenshot are taken together, the three files are written together.
+
+        :param url: target URL
+        :return: the job's snapshot
+        """
+        # one browser from the shared pool, one context per job; the HAR is recorded
+        # while the page is snapshotted and written when the context closes
+        har_path = os.path.join(self.basedir, "capture.har")
+        os.makedirs(self.basedir, exist_ok=True)
+
+        snap = await io_pool.run(snapshot, self.job_id, self.basedir)
+        # share one job dict so snapshot and crawler updates do not overwrite each other
+        snap.job = self.job
+
+        # the browser watchdog cancels this crawl if its browser passes BWA_JOB_MAX_RSS
+        task = asyncio.current_task()
+        killed = []
+
+        def over_limit(size):
+            killed.append(size)
+            task.cancel()
+
+        memory = self.job["memory"] = {}
+        try:
+            async with browsers.browser(on_limit=over_limit) as browser:
+                context_args = {"record_har_path": har_path}
+                if self.user_agent:
+                    context_args["user_agent"] = self.user_agent
+                context = await browser.new_context(**context_args)
+
+                try:
+                    page = await context.new_page()
+
+                    with stage("navigate"):
+                        response = await page.goto(url, timeout=self.TIMEOUT)
+                    # the next crawl of this URL revalidates against these first
+                    await self.record_validators(response)
+                    with stage("idle"):
+                        try:
+                            await page.wait_for_load_state("networkidle", timeout=self.TIMEOUT)
+                        except Exception:
+                            pass  # Ignore timeout, HAR may still be recorded
+
+                    html, shot, mhtml = await snap.capture_page(page)
+
+                finally:
+                    with stage("har"):
+                        await context.close()
+                    usage = browsers.usage(browser)
+                    if usage:
+                        memory["browser_peak_rss"] = usage["peak_rss"]
+        except BaseException as e:
+            if not killed:
+                raise
+            # whatever the cancellation interrupted, the crawl failed on memory
+            if task.cancelling():
+                task.uncancel()
+            raise MemoryError(f"Browser used {killed[0]} bytes, over the {browser_pool.JOB_MAX_RSS} byte job limit") from e
+
+        # the HAR is parsed whole and the WARC is built in memory, refuse oversized ones
+        har_bytes = os.path.getsize(har_path) if os.path.exists(har_path) else 0
+        memory["har_bytes"] = har_bytes
+        if self.HAR_MAX_BYTES and har_bytes > self.HAR_MAX_BYTES:
+            os.remove(har_path)
+            raise MemoryError(f"HAR of {har_bytes} bytes is over the {self.HAR_MAX_BYTES} byte limit")
+
+        async def build_warc():
+            warc_buffer = await self.warc(har_path)
+            memory["warc_bytes"] = warc_buffer.getbuffer().nbytes
+            return warc_buffer
+
+        # the WARC is built on the io pool while the HTML, screenshot and single file are written
+        await snap.store(html, shot, build_warc(), mhtml)
+        return snap
+
+
+    async def record_validators(self, response):
+        """
+        Store the main document's ETag, Last-Modified and fingerprint on the job.
+
+        :param response: Playwright response of the navigation, None for same-document navigations
+        """
+        if response is None:
+            return
+        try:
+            body = await response.body()
+        except Exception:
+            body = None  # e.g. a redirect without a body
+        self.job["validators"] = bwa_recrawl.validators(response.status, response.headers, body)
+
+
+    async def unchanged(self, url):
+        """
+        Complete the job as "unchanged" if the site says the page is the same as last time.
+
+        :param url: target URL
+        :returns: True if the job completed without a crawl
+        """
+        if self.job.get("force"):
+            return False
+        previous = await io_pool.run(bwa_cache().get_validators, self.job["url_hash"])
+        if not bwa_recrawl.reusable(previous):
+            return False
+        with stage("revalidate"):
+            reason = await net_pool.run(bwa_recrawl.check, url, previous, self.user_agent)
+        if not reason:
+            return False
+
+        self.job["content_hash"] = previous["content_hash"]
+        self.job["unchanged_since"] = previous.get("captured_at")
+        self.job["previous_job"] = previous.get("job_id")
+        # the existing version's screenshots, so job lists can show its thumbnail
+        previous_job = await io_pool.run(self.jobs.get_job, previous["job_id"]) if previous.get("job_id") else None
+        if previous_job and previous_job.get("images"):
+            self.job["images"] = previous_job["images"]
+        await self.status("unchanged", f"Unchanged ({reason}), already archived as {previous['content_hash']}: {url}")
+        JOBS_FINISHED.inc(status="unchanged")
+        return True
+
+
     async def run(self):
-        self.status("start",f"Starting crawl for URL: {self.job['url']}")
+        # everything logged for this job from here on also goes to metadata/crawl.log
+        async with job_log(self.job_id, os.path.join(self.basedir, "metadata", "crawl.log")):
+            result = await self._run()
+        if self.job.get("status") == "unchanged":
+            # nothing was captured, nothing will be published
+            await io_pool.run(shutil.rmtree, self.basedir, True)
+        else:
+            # hand the job over to the publish stage only now that crawl.log is complete,
+            # the publisher zips metadata/ and removes the job folder
+            self.job["crawled_at"] = time.time()
+            await self.status("crawled", f"Crawl finished, waiting to publish: {self.job['url']}")
+        return result
+
+
+    async def _run(self):
+        await self.status("start",f"Starting crawl for URL: {self.job['url']}")
         
         try:
             url = self.job["url"]
             if not self.validate_url(url):
                 raise ValueError(f"Invalid URL format: {url}")
-        
-            async with async_playwright() as pw:
-                browser = await pw.chromium.launch()
-                page = await browser.new_page()
-                
-                try:
-                    snap = snapshot(self.job_id, self.basedir)
-                    await page.goto(url)
-                    
-                    warc_buffer = await self.warc(url)
-                    
-                    await snap.store_warc(warc_buffer)
-                    await snap.store_html(page)
-                    await snap.store_image(page)
-                    snap.store_job()
-                
-                except Exception as e:
-                    self.fault("failed",f"Crawl failed for URL {url}: {e}")
-                    raise
-                
-                finally:
-                    await page.close()
-                    await browser.close()
+
+            if await self.unchanged(url):
+                return self.job_id
+
+            trace = job_trace()
+            profile = job_profile() if self.job.get("profile") else None
+            try:
+                with trace.activate():
+                    async with trace.watch():
+                        if profile:
+                            await profile.start()
+                        try:
+                            snap = await self.capture(url)
+                        finally:
+                            if profile:
+                                await profile.stop(os.path.join(self.basedir, "metadata"))
+            except Exception as e:
+                trace.record(self.job)
+                await self.fault("failed",f"Crawl failed for URL {url}: {e}")
+                raise
+
+            # timings go into job.json too, so they travel with the published bundle
+            trace.record(self.job)
+            await snap.store_job()
 
         except Exception as e:
-            self.fault("failed",f"Crawl initialization failed: {e}")
+            JOBS_FINISHED.inc(status="failed")
+            # a failed capture already recorded its own message
+            if self.job.get("status") != "failed":
+                await self.fault("failed",f"Crawl initialization failed: {e}")
             raise
         
         return self.job_id
@@ -0,0 +1,296 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import io
+import logging
+import tempfile
+from collections import OrderedDict
+from warcio import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.archiveiterator import ArchiveIterator
+
+# A delta bundle carries warc/delta.warc.gz instead of warc/crawl.warc.gz:
+#   - response records whose payload is new since the previous version, copied byte for byte
+#   - revisit records (identical-payload-digest profile) for payloads already on QDN, with
+#     WARC-Refers-To-Bundle naming the bundle that holds the full response record
+# Artifacts that did not change are left out and listed under "inherited" in the manifest.
+# Revisits and inherited artifacts always point at the bundle holding the bytes, never at
+# another delta, so reassembly needs at most one lookup per record. A payload digest can be
+# shared by different URLs (empty redirects, 204s, the same asset twice), so reassembly turns
+# a revisit back into a response with its own WARC and HTTP headers and takes only the
+# payload from the origin record.
+
+REFERS_TO_BUNDLE = "WARC-Refers-To-Bundle"
+DELTA_WARC = "warc/delta.warc.gz"
+
+# WARC headers of a revisit that describe the revisit itself, not the response it stands for
+REVISIT_HEADERS = {
+    "warc-type", "warc-profile", "warc-refers-to-target-uri", "warc-refers-to-date",
+    REFERS_TO_BUNDLE.lower(), "warc-block-digest", "content-type", "content-length",
+}
+
+class bwa_delta:
+    MAX_CHAIN = int(os.environ.get("BWA_DELTA_MAX_CHAIN", 10))
+    INDEX_MAX = 32
+
+    def __init__(self, bundles):
+        """
+        Build and reassemble incremental archive bundles.
+
+        :param bundles: bwa_bundle reader used to open earlier versions
+        """
+        self.bundles = bundles
+        self.indexes = OrderedDict()
+        self.logger = logging.getLogger("bwa_delta")
+
+
+    @staticmethod
+    def scan(stream):
+        """
+        List the records of a WARC with their raw offsets.
+
+        :param stream: Binary file object positioned at the start of a WARC
+        :returns: List of dicts with type, uri, date, record_id, digest, status, offset, length,
+                  http_headers and refers
+        """
+        records = []
+        it = ArchiveIterator(stream)
+        for record in it:
+            headers = record.rec_headers
+            entry = {
+                "type": record.rec_type,
+                "uri": headers.get_header("WARC-Target-URI"),
+                "date": headers.get_header("WARC-Date"),
+                "record_id": headers.get_header("WARC-Record-ID"),
+                "digest": headers.get_header("WARC-Payload-Digest"),
+                "refers": headers.get_header(REFERS_TO_BUNDLE),
+                "refers_uri": headers.get_header("WARC-Refers-To-Target-URI"),
+                "refers_date": headers.get_header("WARC-Refers-To-Date"),
+                "http_headers": record.http_headers,
+                "status": record.http_headers.get_statuscode() if record.http_headers else None,
+            }
+            record.content_stream().read()
+            entry["offset"] = it.get_record_offset()
+            entry["length"] = it.get_record_length()
+            records.append(entry)
+        return records
+
+
+    def payloads(self, content_hash):
+        """
+        Map every payload digest of a version to the bundle that stores it.
+
+        :param content_hash: Content hash of a published version
+        :returns: dict digest -> (origin content hash, uri, date)
+        """
+        manifest = self.bundles.manifest(content_hash)
+        origin_hash = self.bundles.cache.strip_hash(content_hash)
+        index = {}
+        with self.bundles.open_member(content_hash, manifest.get("warc", "warc/crawl.warc.gz"), raw=True) as f:
+            for entry in self.scan(f):
+                if not entry["digest"]:
+                    continue
+                if entry["type"] == "response":
+                    index[entry["digest"]] = (origin_hash, entry["uri"], entry["date"])
+                elif entry["type"] == "revisit" and entry["refers"]:
+                    index[entry["digest"]] = (entry["refers"], entry["refers_uri"], entry["refers_date"])
+        return index
+
+
+    def chain_depth(self, manifest):
+        """
+        Return how many deltas a new version would sit on top of.
+        """
+        delta = manifest.get("delta")
+        return delta["depth"] + 1 if delta else 1
+
+
+    def build(self, warc_path, previous_hash, out):
+        """
+        Write a delta WARC of warc_path against a previous version.
+
+        Purpose: Uploads only the payloads that changed since the last capture.
+
+        Inputs:
+        - warc_path (str): Path to the full WARC of the new capture.
+        - previous_hash (str): Content hash of the previous published version.
+        - out (file): Binary file object receiving the delta WARC.
+
+        Outputs: dict: Counts of copied and revisit records.
+
+        Means: Indexes the payload digests of the previous version, copies the raw gzip member of
+        every response with an unseen digest and writes a revisit record for the rest.
+        """
+        known = self.payloads(previous_hash)
+        writer = WARCWriter(out, gzip=True)
+        stats = {"records": 0, "revisits": 0}
+
+        with open(warc_path, "rb") as f:
+            records = self.scan(f)
+            for entry in records:
+                stats["records"] += 1
+                origin = known.get(entry["digest"]) if entry["type"] == "response" else None
+                if origin is None:
+                    f.seek(entry["offset"])
+                    out.write(f.read(entry["length"]))
+                    continue
+
+                origin_hash, origin_uri, origin_date = origin
+                revisit = writer.create_revisit_record(
+                    entry["uri"],
+                    entry["digest"],
+                    origin_uri,
+                    origin_date,
+                    http_headers=entry["http_headers"],
+                    warc_headers_dict={"WARC-Record-ID": entry["record_id"], "WARC-Date": entry["date"], REFERS_TO_BUNDLE: origin_hash}
+                )
+                writer.write_record(revisit)
+                stats["revisits"] += 1
+        return stats
+
+
+    def _origin_index(self, origin_hash):
+        # digest -> (offset, length) of full response records in an origin bundle
+        index = self.indexes.get(origin_hash)
+        if index is not None:
+            self.indexes.move_to_end(origin_hash)
+            return index
+        manifest = self.bundles.manifest(origin_hash)
+        with self.bundles.open_member(origin_hash, manifest.get("warc", "warc/crawl.warc.gz"), raw=True) as f:
+            index = {
+                entry["digest"]: (entry["offset"], entry["length"])
+                for entry in self.scan(f) if entry["type"] == "response" and entry["digest"]
+            }
+        self.indexes[origin_hash] = index
+        while len(self.indexes) > self.INDEX_MAX:
+            self.indexes.popitem(last=False)
+        return index
+
+
+    def origin_payload(self, origin_hash, digest):
+        """
+        Return the payload of the response record a revisit points at.
+
+        :param origin_hash: Content hash of the bundle holding the payload
+        :param digest: WARC-Payload-Digest of the payload
+        :returns: The payload bytes as stored (after the HTTP headers), or None if it cannot be found
+        """
+        location = self._origin_index(origin_hash).get(digest)
+        if location is None:
+            return None
+        offset, length = location
+        manifest = self.bundles.manifest(origin_hash)
+        with self.bundles.open_member(origin_hash, manifest.get("warc", "warc/crawl.warc.gz"), raw=True) as f:
+            f.seek(offset)
+            raw = f.read(length)
+        for record in ArchiveIterator(io.BytesIO(raw)):
+            return record.raw_stream.read()
+        return None
+
+
+    @staticmethod
+    def response(revisit, payload):
+        """
+        Turn a parsed revisit record back into the response it stands for.
+
+        :param revisit: warcio record of the revisit
+        :param payload: Payload bytes of the origin response
+        :returns: bytes of one gzip-compressed response record
+        """
+        headers = [(name, value) for name, value in revisit.rec_headers.headers
+                   if name.lower() not in REVISIT_HEADERS]
+        out = io.BytesIO()
+        writer = WARCWriter(out, gzip=True)
+        http_headers = revisit.http_headers or StatusAndHeaders("200 OK", [], protocol="HTTP/1.1")
+        record = writer.create_warc_record(
+            revisit.rec_headers.get_header("WARC-Target-URI"),
+            "response",
+            payload=io.BytesIO(payload),
+            length=len(payload),
+            warc_headers_dict=dict(headers),
+            http_headers=http_headers,
+        )
+        writer.write_record(record)
+        return out.getvalue()
+
+
+    def reassemble(self, content_hash, out):
+        """
+        Write the complete WARC of a delta version.
+
+        Purpose: Gives readers a self-contained WARC no matter how the version was stored.
+
+        Inputs:
+        - content_hash (str): Content hash of a delta version.
+        - out (file): Binary file object receiving the WARC.
+
+        Outputs: int: Number of revisit records that were resolved.
+
+        Means: Streams the delta WARC, turning each revisit record that names its origin bundle
+        back into a response: the revisit's own URI, WARC and HTTP headers with the payload of the
+        origin record. Revisits that cannot be resolved are kept so the reader still sees every URI.
+        """
+        return self.resolve(lambda: self.bundles.open_member(content_hash, DELTA_WARC, raw=True), out)
+
+
+    def resolve(self, open_delta, out):
+        """
+        Write the complete WARC of a delta WARC, see reassemble().
+
+        :param open_delta: Returns a fresh binary file object of the delta WARC on every call
+        :param out: Binary file object receiving the WARC
+        :returns: Number of revisit records that were resolved
+        """
+        resolved = 0
+        with open_delta() as f:
+            records = self.scan(f)
+
+        # records are contiguous, so a second sequential pass copies them without seeking
+        with open_delta() as f:
+            for entry in records:
+                record = f.read(entry["length"])
+                if entry["type"] == "revisit" and entry["refers"]:
+                    payload = self.origin_payload(entry["refers"], entry["digest"])
+                    if payload is not None:
+                        revisit = next(iter(ArchiveIterator(io.BytesIO(record))))
+                        record = self.response(revisit, payload)
+                        resolved += 1
+                out.write(record)
+        return resolved
+
+
+    @staticmethod
+    def identity(records):
+        # what a reader of the WARC sees of every record
+        return [(entry["uri"], entry["status"], entry["digest"]) for entry in records
+                if entry["type"] in ("response", "revisit")]
+
+
+    def verify(self, warc_path, delta_warc):
+        """
+        Check that a delta WARC reassembles into the capture it was built from.
+
+        :param warc_path: Path to the full WARC of the capture
+        :param delta_warc: bytes of the delta WARC built by build()
+        :raises ValueError: if a record's URI, status or payload digest differs after reassembly
+        """
+        with open(warc_path, "rb") as f:
+            expected = self.identity(self.scan(f))
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as out:
+            self.resolve(lambda: io.BytesIO(delta_warc), out)
+            out.seek(0)
+            records = self.scan(out)
+        if any(entry["type"] == "revisit" for entry in records):
+            raise ValueError("delta WARC has revisits that do not resolve")
+        if self.identity(records) != expected:
+            raise ValueError("reassembled WARC does not match the capture")
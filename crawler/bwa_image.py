@@ -0,0 +1,139 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import io
+import os
+from .bwa_pool import bwa_pool
+
+# Pillow is loaded by pillow() on first use, API processes that only validate options never pay for it
+Image = features = None
+_pillow_loaded = False
+
+# Screenshot profiles, chosen per job with "screenshot": "<profile>" or a dict of overrides
+# ({"profile": "webp", "quality": 60, "max_height": 8000}); BWA_SCREENSHOT is the default.
+#
+#   png    lossless, the largest and slowest to encode
+#   jpeg   Chromium encodes it directly
+#   webp   captured as PNG, re-encoded on the image pool (needs Pillow, else jpeg)
+#
+# Pages are captured down to max_height pixels, in tiles of tile_height so very long
+# pages never become one huge image:
+#   metadata/snapshot.jpg, metadata/snapshot-1.jpg, ...    top to bottom
+#   metadata/thumb.webp                                    thumbnail of the top, for job lists
+# Thumbnails need Pillow and are skipped without it.
+
+PROFILES = {
+    "png": {"format": "png"},
+    "jpeg": {"format": "jpeg", "quality": 80},
+    "webp": {"format": "webp", "quality": 75},
+}
+DEFAULT_PROFILE = os.environ.get("BWA_SCREENSHOT", "jpeg")
+MAX_HEIGHT = int(os.environ.get("BWA_SCREENSHOT_MAX_HEIGHT", 20000))
+TILE_HEIGHT = int(os.environ.get("BWA_SCREENSHOT_TILE", 4000))
+THUMB_WIDTH = int(os.environ.get("BWA_THUMB_WIDTH", 320))
+
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# transcoding and thumbnails are CPU bound, keep them off the io pool
+image_pool = bwa_pool("image", os.environ.get("BWA_IMAGE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+
+def pillow():
+    """
+    Return PIL.Image, importing Pillow on the first call, or None without it.
+    """
+    global Image, features, _pillow_loaded
+    if not _pillow_loaded:
+        try:
+            from PIL import Image, features
+        except ImportError:  # optional, only needed for WebP and thumbnails
+            pass
+        _pillow_loaded = True
+    return Image
+
+
+def webp_supported():
+    return pillow() is not None and features.check("webp")
+
+
+def options(spec = None):
+    """
+    Resolve a job's "screenshot" field into capture options.
+
+    :param spec: Profile name, dict of overrides (optionally with "profile"), or None for the default
+    :returns: dict with format, quality, max_height, tile_height and thumbnail (width, 0 for none)
+    :raises ValueError: on an unknown profile or format, or an out of range setting
+    """
+    if isinstance(spec, str) or not spec:
+        spec = {"profile": spec or DEFAULT_PROFILE}
+    if not isinstance(spec, dict):
+        raise ValueError(f"screenshot must be a profile name or an object, not {type(spec).__name__}")
+    name = spec.get("profile") or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown screenshot profile {name!r}, expected one of {', '.join(PROFILES)}")
+
+    resolved = {"quality": None, "max_height": MAX_HEIGHT, "tile_height": TILE_HEIGHT, "thumbnail": THUMB_WIDTH}
+    resolved.update(PROFILES[name])
+    resolved.update({key: value for key, value in spec.items() if key in resolved or key == "format"})
+
+    if resolved["format"] not in EXTENSIONS:
+        raise ValueError(f"Unknown screenshot format {resolved['format']!r}")
+    if resolved["format"] == "png":
+        resolved["quality"] = None
+    else:
+        resolved["quality"] = int(resolved["quality"] or 0)
+        if not 1 <= resolved["quality"] <= 100:
+            raise ValueError("screenshot quality must be between 1 and 100")
+    for key in ("max_height", "tile_height", "thumbnail"):
+        resolved[key] = int(resolved[key])
+        if resolved[key] < 0:
+            raise ValueError(f"screenshot {key} must not be negative")
+    return resolved
+
+
+def transcode(data, fmt, quality):
+    """
+    Re-encode one captured image.
+
+    :param data: Encoded image bytes, e.g. a PNG from Chromium
+    :param fmt: "webp", "jpeg" or "png"
+    :param quality: 1-100 for the lossy formats
+    :returns: The encoded bytes
+    """
+    with pillow().open(io.BytesIO(data)) as image:
+        out = io.BytesIO()
+        if fmt == "png":
+            image.save(out, "PNG", optimize=True)
+        elif fmt == "webp":
+            image.convert("RGB").save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.convert("RGB").save(out, "JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def thumbnail(data, width):
+    """
+    Scale the top of a screenshot down to a 4:3 thumbnail.
+
+    :param data: Encoded image bytes, normally the first tile
+    :param width: Thumbnail width in pixels
+    :returns: (bytes, extension), or None without Pillow
+    """
+    if pillow() is None or not width:
+        return None
+    fmt = "webp" if webp_supported() else "jpeg"
+    with Image.open(io.BytesIO(data)) as image:
+        crop = image.crop((0, 0, image.width, min(image.height, image.width * 3 // 4)))
+        crop.thumbnail((width, width * 3 // 4))
+        out = io.BytesIO()
+        crop.convert("RGB").save(out, fmt.upper(), quality=70)
+        return out.getvalue(), EXTENSIONS[fmt]
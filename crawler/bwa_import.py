@@ -0,0 +1,437 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+# Bulk import of existing WARCs, without refetching anything.
+#
+#   python -m crawler.bwa_import /data/warcs --out /data/run1 --workers 8
+#   python -m crawler.bwa_import a.warc.gz b.warc --out /data/run1 --resume
+#
+# Records are grouped into per-URL captures: a response (or resource) record with the
+# request and metadata records written next to it for the same URL. By default only
+# 2xx HTML pages become captures, --all imports every response and resource.
+#
+# Each capture becomes a job exactly like a crawl leaves it: its records, copied as the
+# raw gzip members they are in the source (records of plain .warc files are gzipped one
+# by one), in <out>/jobs/manifest/<job_id>.d/warc/crawl.warc.gz, the page in
+# metadata/snapshot.html and a "crawled" job record, so the publish stage of the API
+# publishes them to QDN through bwa_manifest. The capture index (bwa_cdx) gets a row for
+# every capture right away.
+#
+# WARC files are spread over WORKERS processes, which parse, hash and write in parallel.
+# Each process checkpoints its file every BWA_IMPORT_CHECKPOINT captures to
+# <out>/jobs/import/<file>.json; --resume carries on from the checkpoints, and job ids
+# derive from the file and offset of a capture so redone captures replace themselves.
+# <out>/import-report.json sums the run up.
+
+import os
+import sys
+import json
+import time
+import gzip
+import hashlib
+import argparse
+import calendar
+import concurrent.futures
+from datetime import datetime
+from urllib.parse import urlparse
+
+CHECKPOINT = int(os.environ.get("BWA_IMPORT_CHECKPOINT", 100))
+STATE_DIR = "jobs/import"
+BASEDIR = "jobs/manifest"
+WARC_MEMBER = "warc/crawl.warc.gz"
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+MAIN_TYPES = ("response", "resource")
+# records that open a capture
+CAPTURE_TYPES = ("request", "response", "resource", "revisit")
+
+
+def url_key(url):
+    # same key as backend.api.url_key
+    return "url-sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def warc_files(paths):
+    """
+    Expand files and directories into the WARC files under them, largest first.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, name) for name in names if name.endswith((".warc", ".warc.gz"))]
+        else:
+            files.append(path)
+    files = sorted({os.path.abspath(path) for path in files})
+    return sorted(files, key=os.path.getsize, reverse=True)
+
+
+def state_path(path):
+    return os.path.join(STATE_DIR, hashlib.sha256(path.encode("utf-8")).hexdigest()[:16] + ".json")
+
+
+def load_state(path):
+    """
+    Return the checkpoint of a WARC file, or a fresh one if it has none or the file changed.
+    """
+    stat = os.stat(path)
+    fresh = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "offset": 0,
+             "captures": 0, "skipped": 0, "bytes_written": 0, "done": False, "error": None}
+    try:
+        with open(state_path(path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return fresh
+    if state.get("size") != stat.st_size or state.get("mtime") != stat.st_mtime:
+        return fresh
+    return state
+
+
+def save_state(state):
+    path = state_path(state["path"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def warc_timestamp(value):
+    """
+    Return a WARC-Date as epoch seconds, or None.
+    """
+    try:
+        return calendar.timegm(datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").timetuple())
+    except (TypeError, ValueError):
+        return None
+
+
+def charset(content_type):
+    for param in (content_type or "").split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset" and value:
+            return value.strip("\"'")
+    return "utf-8"
+
+
+class capture_group:
+    def __init__(self, uri, offset):
+        """
+        Consecutive records of one fetch of one URL.
+        """
+        self.uri = uri
+        self.start = offset
+        self.end = offset
+        self.records = []
+        self.main = None
+
+
+    def accepts(self, rec_type, uri):
+        if uri != self.uri:
+            return False
+        if rec_type in MAIN_TYPES or rec_type == "revisit":
+            return self.main is None
+        if rec_type == "request":
+            # a second request for the URL is the next fetch
+            return not any(entry["type"] == "request" for entry in self.records)
+        return True
+
+
+class importer:
+    def __init__(self, path, all_records = False):
+        """
+        Imports the captures of one WARC file, in the process it runs in.
+
+        :param path: Absolute path of the .warc or .warc.gz file
+        :param all_records: Import every response and resource, not only 2xx HTML pages
+        """
+        from .bwa_jobqueue import job_queue
+        from .bwa_cdx import cdx_index
+
+        self.path = path
+        self.all_records = all_records
+        self.jobs = job_queue()
+        self.cdx = cdx_index()
+        self.state = load_state(path)
+        self.pending = []
+        self.compressed = None
+
+
+    def wanted(self, record):
+        """
+        Return True if a response or resource record becomes a capture.
+        """
+        if self.all_records:
+            return True
+        if record.rec_type == "response":
+            if record.http_headers is None:
+                return False
+            status = record.http_headers.get_statuscode() or ""
+            content_type = record.http_headers.get_header("Content-Type") or ""
+        else:
+            status = "200"
+            content_type = record.rec_headers.get_header("Content-Type") or ""
+        return status.startswith("2") and content_type.split(";")[0].strip().lower() in HTML_TYPES
+
+
+    def copy_records(self, raw, group, out):
+        """
+        Copy a group's records from the source into a per-record gzip WARC, hashing as it goes.
+
+        :returns: (content_hash, bytes written)
+        """
+        digest = hashlib.sha256()
+        written = 0
+        for entry in group.records:
+            raw.seek(entry["offset"])
+            data = raw.read(entry["length"])
+            if self.compressed:
+                if data[:2] != b"\x1f\x8b":
+                    raise ValueError("not a per-record gzip WARC, decompress it and import the .warc")
+            else:
+                data = gzip.compress(data, compresslevel=6, mtime=0)
+            digest.update(data)
+            out.write(data)
+            written += len(data)
+        return "sha256:" + digest.hexdigest(), written
+
+
+    def finish(self, raw, group):
+        """
+        Write one capture, or count it as skipped.
+        """
+        if group is None:
+            return
+        main = group.main
+        if main is None or not main["wanted"]:
+            self.state["skipped"] += 1
+            return
+
+        job_id = hashlib.sha256(f"{self.path}:{group.start}".encode("utf-8")).hexdigest()[:32]
+        if self.jobs.get_job(job_id) is not None:
+            # imported by an earlier run, possibly published and cleaned up since
+            self.state["skipped"] += 1
+            return
+        folder = os.path.join(BASEDIR, f"{job_id}.d")
+        os.makedirs(os.path.join(folder, "warc"), exist_ok=True)
+        os.makedirs(os.path.join(folder, "metadata"), exist_ok=True)
+        with open(os.path.join(folder, WARC_MEMBER), "wb") as out:
+            content_hash, written = self.copy_records(raw, group, out)
+
+        from .bwa_recrawl import validators
+        url = group.uri
+        job = {
+            "id": job_id,
+            "status": "crawled",
+            "message": f"Imported from {os.path.basename(self.path)}",
+            "url": url,
+            "url_hash": url_key(url),
+            "domain": urlparse(url).netloc,
+            "depth": 1,
+            "assets": False,
+            "profile": False,
+            "screenshot": None,
+            "crawled_at": warc_timestamp(main["date"]) or time.time(),
+            "imported_from": {"path": self.path, "offset": group.start},
+            "validators": validators(main["status"], main["headers"], main["body"]),
+        }
+        if main["body"] is not None:
+            with open(os.path.join(folder, "metadata", "snapshot.html"), "w", encoding="utf-8") as f:
+                f.write(main["body"].decode(charset(main["headers"].get("content-type")), errors="replace"))
+        with open(os.path.join(folder, "metadata", "job.json"), "w") as f:
+            json.dump(job, f, indent=2)
+
+        self.pending.append((job, content_hash))
+        self.state["captures"] += 1
+        self.state["bytes_written"] += written
+
+
+    def checkpoint(self, offset):
+        """
+        Create the job records and index rows of the captures written so far, then
+        move the checkpoint past them.
+        """
+        from .bwa_metrics import JOBS_FINISHED
+
+        if self.pending:
+            for job, _ in self.pending:
+                self.jobs.create_job({key: value for key, value in job.items() if key != "id"}, job_id=job["id"])
+            self.cdx.add([{
+                "capture": job["id"],
+                "url": job["url"],
+                "url_key": job["url_hash"],
+                "timestamp": job["crawled_at"],
+                "status": "crawled",
+                "http_status": job["validators"]["status"],
+                "content_hash": content_hash,
+                "job_id": job["id"],
+                "source": "local",
+            } for job, content_hash in self.pending])
+            JOBS_FINISHED.inc(len(self.pending), status="imported")
+            self.pending = []
+        self.state["offset"] = offset
+        save_state(self.state)
+
+
+    def run(self):
+        """
+        Import the file from its checkpoint to the end.
+
+        :returns: The final checkpoint state
+        """
+        from warcio.archiveiterator import ArchiveIterator
+
+        if self.state["done"]:
+            return self.state
+        with open(self.path, "rb") as stream, open(self.path, "rb") as raw:
+            self.compressed = raw.read(2) == b"\x1f\x8b"
+            # record offsets from the iterator are file positions, resumed or not
+            stream.seek(self.state["offset"])
+            it = ArchiveIterator(stream, no_record_parse=False)
+            group = None
+            for record in it:
+                rec_type = record.rec_type
+                uri = record.rec_headers.get_header("WARC-Target-URI")
+                main = None
+                if rec_type in MAIN_TYPES and uri:
+                    wanted = self.wanted(record)
+                    headers = {}
+                    status = 200
+                    if record.http_headers is not None:
+                        headers = {name.lower(): value for name, value in record.http_headers.headers}
+                        status = int(record.http_headers.get_statuscode() or 0) or 200
+                    content_type = headers.get("content-type") or record.rec_headers.get_header("Content-Type") or ""
+                    # only HTML is read, everything else is copied without being decoded
+                    body = record.content_stream().read() if wanted and content_type.split(";")[0].strip().lower() in HTML_TYPES else None
+                    main = {"wanted": wanted, "status": status, "headers": headers, "body": body,
+                            "date": record.rec_headers.get_header("WARC-Date")}
+                offset = it.get_record_offset()
+                length = it.get_record_length()
+
+                if rec_type not in CAPTURE_TYPES and rec_type != "metadata" or not uri:
+                    # warcinfo and the like belong to no capture
+                    self.finish(raw, group)
+                    group = None
+                elif group is None or not group.accepts(rec_type, uri):
+                    self.finish(raw, group)
+                    group = capture_group(uri, offset)
+                if group is not None and uri:
+                    group.records.append({"type": rec_type, "offset": offset, "length": length})
+                    group.end = offset + length
+                    if main is not None:
+                        group.main = main
+
+                if len(self.pending) >= CHECKPOINT:
+                    # the open group is redone after a resume
+                    self.checkpoint(group.start if group is not None else offset + length)
+            self.finish(raw, group)
+        self.state["done"] = True
+        self.checkpoint(self.state["size"])
+        return self.state
+
+
+def import_file(path, all_records = False):
+    """
+    Import one WARC file (runs in a worker process).
+
+    :returns: Its final checkpoint state, with "error" set if it failed
+    """
+    try:
+        return importer(path, all_records).run()
+    except Exception as e:
+        state = load_state(path)
+        state["error"] = f"{type(e).__name__}: {e}"
+        save_state(state)
+        return state
+
+
+def progress(files):
+    states = [load_state(path) for path in files]
+    return sum(state["offset"] for state in states), sum(state["captures"] for state in states)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m crawler.bwa_import", description="Import existing WARC files as captures")
+    parser.add_argument("paths", nargs="+", help=".warc / .warc.gz files, or directories to search for them")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 2, help="processes importing at once (default: CPUs)")
+    parser.add_argument("--out", default=".", help="directory the jobs/ tree and the report are written to")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoints of an earlier run in --out")
+    parser.add_argument("--all", action="store_true", help="import every response and resource, not only 2xx HTML pages")
+    parser.add_argument("--report", help="summary report path (default: <out>/import-report.json)")
+    args = parser.parse_args()
+
+    files = warc_files(args.paths)
+    if not files:
+        parser.error("no .warc or .warc.gz files found")
+    report_path = os.path.abspath(args.report or os.path.join(args.out, "import-report.json"))
+    os.makedirs(args.out, exist_ok=True)
+    # every pipeline path is relative to the working directory
+    os.chdir(args.out)
+    os.makedirs(STATE_DIR, exist_ok=True)
+    if not args.resume:
+        for path in files:
+            if os.path.exists(state_path(path)):
+                os.remove(state_path(path))
+
+    total = sum(os.path.getsize(path) for path in files)
+    done_before, captures_before = progress(files)
+    started = time.perf_counter()
+    interrupted = False
+    states = {}
+    pool = concurrent.futures.ProcessPoolExecutor(max(1, min(args.workers, len(files))))
+    try:
+        futures = {pool.submit(import_file, path, args.all): path for path in files}
+        while futures:
+            finished, _ = concurrent.futures.wait(futures, timeout=2)
+            for future in finished:
+                states[futures.pop(future)] = future.result()
+            done, captures = progress(files)
+            seconds = time.perf_counter() - started
+            print(f"\r{done / 2**30:.2f}/{total / 2**30:.2f} GiB, {captures} captures, "
+                  f"{(done - done_before) / 2**20 / seconds:.1f} MiB/s", end="", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        interrupted = True
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        pool.shutdown()
+    print(file=sys.stderr)
+
+    seconds = time.perf_counter() - started
+    states = [states.get(path) or load_state(path) for path in files]
+    done, captures = progress(files)
+    summary = {
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "interrupted": interrupted,
+        "workers": args.workers,
+        "seconds": round(seconds, 3),
+        "files": len(files),
+        "files_done": sum(1 for state in states if state["done"]),
+        "bytes_read": done - done_before,
+        "bytes_written": sum(state["bytes_written"] for state in states),
+        "captures": captures - captures_before,
+        "skipped": sum(state["skipped"] for state in states),
+        "mib_per_sec": round((done - done_before) / 2**20 / seconds, 3) if seconds else None,
+        "captures_per_sec": round((captures - captures_before) / seconds, 3) if seconds else None,
+        "failures": [{"path": state["path"], "error": state["error"]} for state in states if state.get("error")],
+    }
+    with open(report_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"{summary['captures']} captures from {summary['files_done']}/{summary['files']} files, {summary['skipped']} records skipped "
+          f"in {summary['seconds']}s ({summary['mib_per_sec']} MiB/s), report in {report_path}")
+    if interrupted:
+        print("Interrupted, run again with --resume to continue", file=sys.stderr)
+        sys.exit(130)
+    sys.exit(1 if summary["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
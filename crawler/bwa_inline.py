@@ -0,0 +1,210 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import re
+import html
+import base64
+import hashlib
+import email
+from email import policy
+from urllib.parse import urljoin, urldefrag
+from .bwa_replay import HTML_ATTR, SRCSET_ATTR, CSS_URL, CSS_IMPORT, SKIP_SCHEMES
+
+# Single-file rendering of a captured page, metadata/snapshot.inline.html, which the viewer
+# shows with one request instead of fetching every subresource from the live web:
+#   - Chromium saves the rendered page as MHTML (CDP Page.captureSnapshot)
+#   - every stylesheet, image, font and frame in it becomes a data: URI in the HTML; CSS is
+#     inlined recursively, identical resources are encoded once and shared
+#   - scripts are dropped (the DOM is already rendered) and a Content-Security-Policy stops
+#     the page from loading anything that was not captured
+# References the MHTML has no resource for are made absolute, so links still navigate.
+# The artifact is plain HTML: bundles compress it with their codec and /archive-content
+# serves it with the precompressed br/gzip variants. BWA_INLINE=0 turns it off, pages whose
+# MHTML is over BWA_INLINE_MAX_BYTES (32 MiB) go without one.
+
+ENABLED = os.environ.get("BWA_INLINE", "1") != "0"
+MAX_BYTES = int(os.environ.get("BWA_INLINE_MAX_BYTES", 32 * 1024 * 1024))
+
+MEMBER = "metadata/snapshot.inline.html"
+
+CSP = (b"default-src 'none'; img-src data:; style-src 'unsafe-inline' data:; font-src data:; "
+       b"media-src data:; frame-src data:")
+HEADER = b'<meta charset="utf-8"><meta http-equiv="Content-Security-Policy" content="' + CSP + b'">'
+
+SCRIPT = re.compile(rb"<script\b[^>]*>.*?</script\s*>|<script\b[^>]*/>", re.I | re.S)
+META_CSP = re.compile(rb"""<meta\b[^>]*http-equiv\s*=\s*["']?content-security-policy[^>]*>""", re.I)
+BASE = re.compile(rb"""<base\b[^>]*?\shref\s*=\s*(["']?)([^"'\s>]+)\1[^>]*>""", re.I)
+HEAD = re.compile(rb"<head\b[^>]*>", re.I)
+
+
+def parts(mhtml):
+    """
+    Split an MHTML document into its resources.
+
+    :param mhtml: MHTML bytes as Chromium writes them
+    :returns: (key of the page, {Content-Location or "cid:<Content-ID>": (content_type, charset, body, location)})
+    """
+    message = email.message_from_bytes(mhtml, policy=policy.compat32)
+    resources, page = {}, None
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        location = (part.get("Content-Location") or "").strip()
+        entry = (part.get_content_type(), part.get_content_charset(), part.get_payload(decode=True) or b"", location)
+        keys = [location] if location else []
+        if part.get("Content-ID"):
+            keys.append("cid:" + part.get("Content-ID").strip().strip("<>"))
+        for key in keys:
+            resources.setdefault(key, entry)
+        # the page is the first part
+        page = page or next(iter(keys), None)
+    return page, resources
+
+
+class inliner:
+
+    def __init__(self, resources):
+        """
+        Turns MHTML resources into data: URIs, each distinct one encoded once.
+
+        :param resources: As returned by parts()
+        """
+        self.resources = resources
+        self.uris = {}
+        self.by_digest = {}
+        # resources being inlined, so an @import or frame cycle ends instead of recursing
+        self.pending = set()
+
+
+    def uri(self, key):
+        """
+        Return the data: URI of a resource, None if the MHTML does not hold it.
+        """
+        if key in self.uris:
+            return self.uris[key]
+        if key not in self.resources or key in self.pending:
+            return None
+        content_type, charset, body, location = self.resources[key]
+        # frames are referenced by cid:, their links are relative to their own URL
+        base = location or key
+        self.pending.add(key)
+        try:
+            if content_type == "text/css":
+                body = self.css(body, base)
+            elif content_type == "text/html":
+                body, charset = self.html(body, charset, base), "utf-8"
+        finally:
+            self.pending.discard(key)
+
+        kind = content_type.encode("ascii", "ignore")
+        if charset and content_type.startswith("text/"):
+            kind += b";charset=" + charset.encode("ascii", "ignore")
+        digest = hashlib.sha256(kind + b"\0" + body).digest()
+        if digest not in self.by_digest:
+            self.by_digest[digest] = b"data:" + kind + b";base64," + base64.b64encode(body)
+        self.uris[key] = self.by_digest[digest]
+        return self.uris[key]
+
+
+    def link(self, link, base, escaped):
+        """
+        Return what a reference in a document is replaced with.
+
+        :param link: The reference as written in the document
+        :param base: URL the document was captured from
+        :param escaped: True inside HTML attributes, where & is written &amp;
+        :returns: The resource's data: URI, else the reference made absolute
+        """
+        link = link.strip()
+        if not link or link.lower().startswith(SKIP_SCHEMES):
+            return link
+        raw = link.decode("utf-8", "ignore")
+        if escaped:
+            raw = html.unescape(raw)
+        target, fragment = urldefrag(urljoin(base, raw))
+        found = self.uri(target)
+        if found is not None:
+            return found + (b"#" + fragment.encode("utf-8") if fragment else b"")
+        if target == raw.split("#")[0] or not target.startswith(("http://", "https://")):
+            return link
+        absolute = target + ("#" + fragment if fragment else "")
+        return (html.escape(absolute) if escaped else absolute).encode("utf-8")
+
+
+    def css(self, body, base):
+        def css_url(m):
+            return m.group(1) + m.group(2) + self.link(m.group(3), base, False) + m.group(2) + m.group(4)
+
+        def css_import(m):
+            return m.group(1) + m.group(2) + self.link(m.group(3), base, False) + m.group(2)
+
+        body = CSS_URL.sub(css_url, body)
+        return CSS_IMPORT.sub(css_import, body)
+
+
+    def html(self, body, charset, base):
+        """
+        Inline the resources of one HTML document (the page or a frame).
+
+        :returns: The document as UTF-8 bytes, with the charset and CSP meta tags first in <head>
+        """
+        body = body.decode(charset or "utf-8", "replace").encode("utf-8")
+        body = SCRIPT.sub(b"", body)
+        # the page's own policy could forbid the data: URIs
+        body = META_CSP.sub(b"", body)
+        found = BASE.search(body)
+        if found:
+            base = urljoin(base, html.unescape(found.group(2).decode("utf-8", "ignore")))
+            body = BASE.sub(b"", body)
+
+        def attr(m):
+            return m.group(1) + m.group(2) + self.link(m.group(3), base, True) + m.group(2)
+
+        def srcset(m):
+            candidates = []
+            for candidate in m.group(3).split(b","):
+                bits = candidate.strip().split(None, 1)
+                if bits:
+                    bits[0] = self.link(bits[0], base, True)
+                candidates.append(b" ".join(bits))
+            return m.group(1) + m.group(2) + b", ".join(candidates) + m.group(2)
+
+        body = HTML_ATTR.sub(attr, body)
+        body = SRCSET_ATTR.sub(srcset, body)
+        # style attributes and <style> blocks
+        body = self.css(body, base)
+
+        head = HEAD.search(body)
+        if head:
+            return body[:head.end()] + HEADER + body[head.end():]
+        return HEADER + body
+
+
+def inline(mhtml):
+    """
+    Turn a page saved as MHTML into one self-contained HTML document.
+
+    :param mhtml: MHTML bytes or str
+    :returns: (HTML bytes, number of distinct resources inlined)
+    :raises ValueError: if the MHTML holds no HTML page
+    """
+    if isinstance(mhtml, str):
+        mhtml = mhtml.encode("utf-8")
+    page, resources = parts(mhtml)
+    if page is None or resources[page][0] != "text/html":
+        raise ValueError("MHTML has no HTML page")
+    content_type, charset, body, location = resources[page]
+    converter = inliner(resources)
+    converter.pending.add(page)
+    document = converter.html(body, charset, page)
+    return document, len(converter.by_digest)
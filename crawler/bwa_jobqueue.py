@@ -11,24 +11,28 @@
 #*******************************************************************************/
 
 import os
+import time
 import uuid
 import pickle
-from typing import Any
+import threading
+from typing import Any, Callable
+from .bwa_pool import io_pool
 
 class job_queue:
     def __init__(self, jobs_dir: str = "jobs/queue"):
+        # created by the first job, so constructing a queue at import touches no disk
         self.jobs_dir = jobs_dir
-        os.makedirs(self.jobs_dir, exist_ok=True)
 
     def _job_path(self, job_id: str) -> str:
         """Return the job filename with .job suffix."""
         return os.path.join(self.jobs_dir, f"{job_id}.job")
 
-    def create_job(self, job_data: dict[str, Any]) -> str:
-        """Create a new job, save to a .job file, return the UUID key."""
-        job_id = uuid.uuid4().hex
+    def create_job(self, job_data: dict[str, Any], job_id: str | None = None) -> str:
+        """Create a new job, save to a .job file, return the UUID key (or job_id, for idempotent writers)."""
+        job_id = job_id or uuid.uuid4().hex
         job_dict = {"id": job_id, **job_data}
 
+        os.makedirs(self.jobs_dir, exist_ok=True)
         job_path = self._job_path(job_id)
         tmp_path = job_path + ".tmp"
 
@@ -58,6 +62,8 @@ class job_queue:
     def list_jobs(self) -> list[dict[str, Any]]:
         """Return the contents of every job file in the jobs directory."""
         jobs = []
+        if not os.path.isdir(self.jobs_dir):
+            return jobs
         for fname in os.listdir(self.jobs_dir):
             # Only count .job files
             if not fname.endswith(".job"):
@@ -75,6 +81,8 @@ class job_queue:
 
     def count_jobs(self) -> int:
         """Return the number of job files stored."""
+        if not os.path.isdir(self.jobs_dir):
+            return 0
         return len([
             name for name in os.listdir(self.jobs_dir)
             if name.endswith(".job") and os.path.isfile(os.path.join(self.jobs_dir, name))
@@ -106,3 +114,132 @@ class job_queue:
 
         os.replace(tmp_path, job_path)
         return job
+
+
+class job_feed:
+    # job files are replaced by rename, which sets their ctime, so a file with a ctime after the
+    # previous scan started has been written since; file times come from the kernel's coarse
+    # clock, the margin covers its lag behind time.time_ns() and writes racing the scan
+    MARGIN_NS = 1_000_000_000
+
+    def __init__(self, accept: Callable[[dict[str, Any]], bool], queue: job_queue | None = None):
+        """Keep the jobs accept(job) is true for, rereading only job files written since the last refresh.
+
+        Background stages poll with this instead of list_jobs(): an idle queue costs one
+        stat of the directory, a busy one a stat per job file and an unpickle per changed job.
+        """
+        self.accept = accept
+        self.queue = queue or job_queue()
+        self.jobs: dict[str, dict[str, Any]] = {}
+        self.since = 0
+        self.dir_mtime = None
+
+    def refresh(self) -> dict[str, dict[str, Any]]:
+        """Bring the matching jobs up to date and return them, keyed by id."""
+        started = time.time_ns()
+        try:
+            dir_mtime = os.stat(self.queue.jobs_dir).st_mtime_ns
+        except FileNotFoundError:
+            return self.jobs
+        # nothing was created, replaced or removed since a scan that saw everything before it
+        if dir_mtime == self.dir_mtime and dir_mtime < self.since:
+            return self.jobs
+
+        present = set()
+        with os.scandir(self.queue.jobs_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".job"):
+                    continue
+                job_id = entry.name[:-len(".job")]
+                present.add(job_id)
+                try:
+                    if entry.stat().st_ctime_ns < self.since:
+                        continue
+                except FileNotFoundError:
+                    continue
+                job = self.queue.get_job(job_id)
+                if job is not None and self.accept(job):
+                    self.keep(job_id, job)
+                else:
+                    self.discard(job_id)
+        for job_id in set(self.jobs) - present:
+            self.discard(job_id)
+
+        self.dir_mtime = dir_mtime
+        self.since = started - self.MARGIN_NS
+        return self.jobs
+
+    def keep(self, job_id: str, job: dict[str, Any]) -> None:
+        """Store a matching job that was read since the last refresh."""
+        self.jobs[job_id] = job
+
+    def discard(self, job_id: str) -> None:
+        """Forget a job the caller is handling; it comes back if its file is written and still matches."""
+        self.jobs.pop(job_id, None)
+
+
+class job_status_counts(job_feed):
+    def __init__(self, queue: job_queue | None = None):
+        """Count jobs by status, updating the counts from the job files written since the last call.
+
+        Keeps only each job's status, so /metrics costs a directory stat when the queue is idle.
+        """
+        super().__init__(lambda job: True, queue)
+        self.by_status: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def keep(self, job_id: str, job: dict[str, Any]) -> None:
+        """Move a job to the count of its current status."""
+        self.discard(job_id)
+        status = job.get("status", "unknown")
+        self.jobs[job_id] = status
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def discard(self, job_id: str) -> None:
+        """Take a job out of the counts."""
+        status = self.jobs.pop(job_id, None)
+        if status is None:
+            return
+        self.by_status[status] -= 1
+        if not self.by_status[status]:
+            del self.by_status[status]
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of jobs with each status."""
+        with self.lock:
+            self.refresh()
+            return dict(self.by_status)
+
+
+class async_job_queue:
+    def __init__(self, queue: job_queue | None = None):
+        """Await job_queue operations without blocking the event loop.
+
+        Every call runs on the bounded io pool, so pickle reads and fsync'd
+        writes never stall other requests.
+        """
+        self.queue = queue or job_queue()
+
+    async def create_job(self, job_data: dict[str, Any]) -> str:
+        """Create a new job, return its UUID key."""
+        return await io_pool.run(self.queue.create_job, job_data)
+
+    async def get_job(self, job_id: str) -> dict[str, Any] | None:
+        """Retrieve a saved job by its UUID key."""
+        return await io_pool.run(self.queue.get_job, job_id)
+
+    async def list_jobs(self) -> list[dict[str, Any]]:
+        """Return the contents of every job file."""
+        return await io_pool.run(self.queue.list_jobs)
+
+    async def count_jobs(self) -> int:
+        """Return the number of job files stored."""
+        return await io_pool.run(self.queue.count_jobs)
+
+    async def remove_job(self, job_id: str) -> bool:
+        """Remove a job file by UUID key."""
+        return await io_pool.run(self.queue.remove_job, job_id)
+
+    async def update_job(self, job_id: str, new_data: dict[str, Any]) -> dict[str, Any] | None:
+        """Update an existing job with new data."""
+        return await io_pool.run(self.queue.update_job, job_id, new_data)
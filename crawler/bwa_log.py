@@ -0,0 +1,259 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+import contextvars
+import logging.handlers
+from contextlib import contextmanager, asynccontextmanager
+from .bwa_metrics import REGISTRY, counter
+
+# Process-wide logging through a queue:
+#   - loggers only enqueue (never block on a full queue, records are dropped and counted),
+#     one listener thread formats and writes them
+#   - every record carries the id of the job whose context emitted it, so the crawler,
+#     snapshot and manifest share one logger per module instead of one per job
+#   - while a job runs, its records are also written to <job>.d/metadata/crawl.log, the
+#     artifact the manifest publishes
+#
+#   BWA_LOG_LEVEL    INFO       level for stdout and crawl.log
+#   BWA_LOG_FORMAT   text       "json" for one JSON object per line
+#   BWA_LOG_QUEUE    10000      records buffered before dropping
+
+LEVEL = os.environ.get("BWA_LOG_LEVEL", "INFO").upper()
+FORMAT = os.environ.get("BWA_LOG_FORMAT", "text")
+QUEUE_SIZE = int(os.environ.get("BWA_LOG_QUEUE", 10000))
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s %(job)s: %(message)s"
+
+DROPPED = REGISTRY.register(counter("bwa_log_dropped_total", "Log records dropped because the log queue was full"))
+
+_job = contextvars.ContextVar("bwa_job", default=None)
+
+# fields every LogRecord has, everything else was passed with extra=
+_STANDARD = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "job"}
+
+
+def current_job():
+    """
+    Return the id of the job running in this context, or None.
+    """
+    return _job.get()
+
+
+@contextmanager
+def job_context(job_id):
+    """
+    Tag every record logged in this context (and in pool calls started from it) with job_id.
+    """
+    token = _job.set(job_id)
+    try:
+        yield
+    finally:
+        _job.reset(token)
+
+
+class job_filter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "job"):
+            record.job = _job.get() or "-"
+        return True
+
+
+class json_formatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "job": getattr(record, "job", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in record.__dict__.items() if key not in _STANDARD and not key.startswith("_")})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def formatter():
+    return json_formatter() if FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+class queue_handler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class job_files(logging.Handler):
+    def __init__(self):
+        """
+        Writes each job's records to that job's crawl.log; runs on the listener thread.
+        """
+        super().__init__()
+        self.files = {}
+
+    def open(self, job_id, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, "a", encoding="utf-8")
+        # the handler's own lock, handle() holds it around emit()
+        with self.lock:
+            self.files[job_id] = f
+
+    def close_job(self, job_id):
+        with self.lock:
+            f = self.files.pop(job_id, None)
+        if f is not None:
+            f.close()
+
+    def emit(self, record):
+        barrier = getattr(record, "_barrier", None)
+        if barrier is not None:
+            barrier.set()
+            return
+        f = self.files.get(getattr(record, "job", None))
+        if f is None:
+            return
+        try:
+            f.write(self.format(record) + "\n")
+            f.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class queue_listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the queue is bounded, wait for room instead of failing on shutdown
+        try:
+            self.queue.put(self._sentinel, timeout=5)
+        except queue.Full:
+            pass
+
+
+class barrier_filter(logging.Filter):
+    # flush markers only concern job_files
+    def filter(self, record):
+        return not hasattr(record, "_barrier")
+
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue = None
+_files = job_files()
+
+
+def setup(stream = None, console_level = None):
+    """
+    Route all logging through the queue, once per process.
+
+    :param stream: Where records are written, defaults to stdout
+    :param console_level: Level for the stream only, crawl.log keeps BWA_LOG_LEVEL
+    """
+    global _listener, _queue
+    with _setup_lock:
+        if _listener is not None:
+            return
+        _queue = queue.Queue(QUEUE_SIZE)
+
+        console = logging.StreamHandler(stream or sys.stdout)
+        console.setFormatter(formatter())
+        if console_level is not None:
+            console.setLevel(console_level)
+        console.addFilter(barrier_filter())
+        _files.setFormatter(formatter())
+
+        handler = queue_handler(_queue)
+        handler.addFilter(job_filter())
+        root = logging.getLogger()
+        root.handlers.clear()
+        root.addHandler(handler)
+        root.setLevel(LEVEL)
+
+        # uvicorn logs through the same queue
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            uv_logger = logging.getLogger(name)
+            uv_logger.handlers.clear()
+            uv_logger.propagate = True
+
+        _listener = queue_listener(_queue, console, _files, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """
+    Write every queued record and stop the listener thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def flush(timeout = 5.0):
+    """
+    Block until every record queued before the call has been written.
+
+    :returns: False if the listener did not catch up within timeout
+    """
+    if _listener is None:
+        return True
+    barrier = threading.Event()
+    record = logging.LogRecord("bwa_log", logging.DEBUG, __file__, 0, "flush", None, None)
+    record._barrier = barrier
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _queue.put(record, timeout=max(deadline - time.monotonic(), 0.01))
+            break
+        except queue.Full:
+            if time.monotonic() >= deadline:
+                return False
+    return barrier.wait(max(deadline - time.monotonic(), 0))
+
+
+@asynccontextmanager
+async def job_log(job_id, path):
+    """
+    Tag records with job_id and copy them into a crawl.log for the duration of the block.
+
+        async with job_log(job_id, "jobs/manifest/<id>.d/metadata/crawl.log"):
+            ...
+
+    The file is complete when the block exits. Without setup() only the tagging happens.
+
+    :param job_id: The job's id
+    :param path: Path of the job's crawl.log
+    """
+    capturing = _listener is not None
+    if capturing:
+        await asyncio.to_thread(_files.open, job_id, path)
+    try:
+        with job_context(job_id):
+            yield
+    finally:
+        if capturing:
+            # wait off the event loop for the listener to write this job's last records
+            await asyncio.to_thread(flush)
+            _files.close_job(job_id)
@@ -13,7 +13,6 @@
 import os
 import io
 import json
-import sys
 import datetime
 import logging
 import hashlib
@@ -23,6 +22,12 @@ import requests
 import shutil
 from datetime import datetime, timezone
 from .bwa_jobqueue import job_queue
+from .bwa_cache import bwa_cache
+from .bwa_bundle import bwa_bundle
+from .bwa_delta import bwa_delta, DELTA_WARC
+from .bwa_metrics import stage, add_bytes
+from . import bwa_codec
+from . import bwa_chunks
 
 # {
 #   "schema": "big-web-archive/v1",
@@ -33,23 +38,50 @@ from .bwa_jobqueue import job_queue
 #   "content_hash": "sha256:abcd1234...",
 #   "previous_hash": "sha256:prev5678...",
 #   "warc": "warc/crawl.warc.gz",
+#   "codec": {"warc": "gzip", "bundle": "deflate"},
 #   "artifacts": {
 #     "log": "metadata/crawl.log",
 #     "html": "metadata/snapshot.html",
-#     "png": "metadata/snapshot.png"
-#   }
+#     "screenshot": "metadata/snapshot.jpg",
+#     "screenshot_1": "metadata/snapshot-1.jpg",
+#     "thumbnail": "metadata/thumb.webp",
+#     "single_file": "metadata/snapshot.inline.html"
+#   },
+#   "digests": {"metadata/snapshot.html": "sha256:...", ...},
+#   "inherited": {"metadata/snapshot.jpg": "prev5678..."},
+#   "delta": {"base": "sha256:prev5678...", "depth": 1, "warc_sha256": "sha256:...",
+#             "records": 42, "revisits": 40}
 # }
+#
+# "digests" covers every logical member of the capture. Members listed in "inherited" were
+# unchanged and are read from the named bundle. "delta" is present when the bundle carries
+# warc/delta.warc.gz (new records plus revisits) instead of the full warc/crawl.warc.gz.
+# "codec" records how the WARC was written and how small members were packed; with the
+# zstd bundle codec those members are stored as <member>.zst (see bwa_codec).
+# Profiled crawls add "profile", "profile_stats" and "tracemalloc" artifacts (see bwa_trace).
+# Long pages are screenshotted in tiles, "screenshot_<n>" continue "screenshot" down the
+# page; format and thumbnail follow the job's screenshot profile (see bwa_image).
+# "single_file" is the page with its assets inlined, for viewing without replay (see bwa_inline).
+# Bundles over BWA_CHUNK_SIZE are published as pieces under a small head resource whose
+# manifest adds "chunks" (see bwa_chunks); fetching reassembles them transparently.
 
 class bwa_manifest:
     QDN_SERVICE = "WEBSITE_ARCHIVE"
     QDN_NAME = "big-web-archive"
-    QDN_API_BASE = "http://localhost:62392"  # Qortal QDN API base 
+    QDN_API_BASE = os.environ.get("QORTAL_API_URL", "http://localhost:62392")  # Qortal QDN API base
+    # artifacts only some captures have, e.g. the report of a profiled crawl
+    OPTIONAL_ARTIFACTS = {
+        "profile": "metadata/profile.txt",
+        "profile_stats": "metadata/profile.prof",
+        "tracemalloc": "metadata/tracemalloc.txt",
+        "single_file": "metadata/snapshot.inline.html",
+    }
 
     def __init__(self, job_id, basedir = "jobs/manifest"):
         """
         Initialize the bwa_manifest instance.
 
-        Purpose: Sets up the manifest handler for a specific job, including logging configuration and job queue access.
+        Purpose: Sets up the manifest handler for a specific job, including job queue access.
 
         Inputs:
         - job_id (str): The unique identifier for the job.
@@ -57,33 +89,43 @@ class bwa_manifest:
 
         Outputs: None
 
-        Means: Initializes instance variables, configures logging for the application and Uvicorn, retrieves the job from the queue, and sets up a logger for the snapshot process.
+        Means: Initializes instance variables, retrieves the job from the queue, and takes the module logger (configured once by bwa_log.setup).
         """
         self.job_id = job_id
         self.basedir = os.path.join(basedir, f"{job_id}.d")
         self.jobs = job_queue()
         self.job = self.jobs.get_job(self.job_id)
-        logging.basicConfig(
-            level=logging.INFO,
-            stream=sys.stdout,
-            format="%(asctime)s %(levelname)s %(message)s"
-        )
+        self.cache = bwa_cache()
+        self.bundles = bwa_bundle(self.cache, fetch=self.fetch_bundle)
+        # chunks already on QDN, so a retried publish only sends what is missing
+        self.published_chunks = set()
+        self.published_bytes = 0
+        self.logger = logging.getLogger("bwa_manifest")
 
-        # configure root logger *first*
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-            handlers=[logging.StreamHandler(sys.stdout)]
-        )
 
-        # ensure Uvicorn loggers propagate
-        for name in ("uvicorn.error", "uvicorn.access"):
-            uv_logger = logging.getLogger(name)
-            uv_logger.handlers.clear()
-            uv_logger.propagate = True
+    def image_artifacts(self):
+        """
+        List the job's screenshot tiles and thumbnail as manifest artifacts.
+
+        Purpose: Screenshot members depend on the job's screenshot profile and page length.
+
+        Inputs: None (reads the "images" the snapshot recorded on the job)
 
-        self.logger = logging.getLogger("bwa_snapshot")
-        self.logger.setLevel(logging.DEBUG)
+        Outputs: dict: artifact name -> bundle member
+
+        Means: Names the first tile "screenshot" and the rest "screenshot_<n>"; jobs captured
+        before screenshot profiles had a single metadata/snapshot.png.
+        """
+        images = (self.job or {}).get("images")
+        if not images:
+            return {"screenshot": "metadata/snapshot.png"}
+        artifacts = {
+            "screenshot" if index == 0 else f"screenshot_{index}": member
+            for index, member in enumerate(images["tiles"])
+        }
+        if images.get("thumbnail"):
+            artifacts["thumbnail"] = images["thumbnail"]
+        return artifacts
 
 
     def fault(self, state, msg):
@@ -159,6 +201,17 @@ class bwa_manifest:
         url = url.lower()
         return url
 
+    @staticmethod
+    def file_hash(path):
+        """
+        Return the "sha256:" digest of a file, read in chunks.
+        """
+        digest = hashlib.sha256()
+        with stage("hash"), open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return "sha256:" + digest.hexdigest()
+
     def content_hash(self):
         """
         Compute SHA256 hash of the WARC file.
@@ -171,11 +224,42 @@ class bwa_manifest:
 
         Means: Reads the WARC file from the job's basedir and computes its SHA256 hash.
         """
-        warc_path = os.path.join(self.basedir, "warc", "crawl.warc.gz")
-        if not os.path.exists(warc_path):
+        member = self.warc_member()
+        if not member:
+            return None
+        return self.file_hash(os.path.join(self.basedir, member))
+
+    def warc_member(self):
+        """
+        Return the path of the job's WARC inside its basedir, whichever codec wrote it.
+
+        :returns: e.g. "warc/crawl.warc.gz", or None if the crawl produced no WARC
+        """
+        for member in bwa_codec.WARC_MEMBERS.values():
+            if os.path.exists(os.path.join(self.basedir, member)):
+                return member
+        return None
+
+    @staticmethod
+    def latest_manifest(manifests):
+        """
+        Pick the newest manifest out of a version chain.
+
+        Purpose: Identifies the most recent archive version for a URL.
+
+        Inputs:
+        - manifests (list): List of tuples (identifier, manifest_dict, zip_path).
+
+        Outputs: tuple or None: The entry for the newest version, or None if manifests is empty.
+
+        Means: The newest version is the one no other manifest names as its previous_hash; the
+        timestamp breaks ties when the chain is forked or incomplete.
+        """
+        if not manifests:
             return None
-        with open(warc_path, "rb") as f:
-            return "sha256:" + hashlib.sha256(f.read()).hexdigest()
+        referenced = {manifest.get('previous_hash') for _, manifest, _ in manifests}
+        heads = [entry for entry in manifests if entry[1].get('content_hash') not in referenced]
+        return max(heads or manifests, key=lambda entry: entry[1].get('timestamp', ''))
 
     def get_previous_hash_from_qdn(self, url_key):
         """
@@ -188,19 +272,14 @@ class bwa_manifest:
 
         Outputs: str or None: The content hash of the latest manifest, or None if no manifests exist.
 
-        Means: Fetches all manifests for the url_key, identifies the head of the hash chain (no previous_hash), and returns its content_hash.
+        Means: Fetches all manifests for the url_key and returns the content_hash of the newest one.
         """
-        manifests = self.get_manifests_for_url_key(url_key)
-        if manifests:
-            # Find the latest: the one with no previous_hash
-            for ident, manifest, _ in manifests:
-                if not manifest.get('previous_hash'):
-                    return manifest.get('content_hash')
-            # If none found, return the first one's content_hash
-            return manifests[0][1].get('content_hash')
+        latest = self.latest_manifest(self.get_manifests_for_url_key(url_key))
+        if latest:
+            return latest[1].get('content_hash')
         return None
 
-    def publish(self, url_key):
+    def publish(self, url_key, previous_hash = None, scan = True):
         """
         Publish the manifest and ZIP bundle to QDN if content has changed.
 
@@ -208,85 +287,202 @@ class bwa_manifest:
 
         Inputs:
         - url_key (str): The normalized URL key for the archive.
+        - previous_hash (str, optional): Content hash of the latest published version, used when scan is False.
+        - scan (bool, optional): Look the previous hash up on QDN, defaults to True.
 
-        Outputs: dict or None: The published manifest if successful, or None if unchanged or failed.
+        Outputs: dict or None: The published manifest if successful, or None if unchanged or the WARC is missing.
 
-        Means: Computes content hash, compares with previous, creates ZIP bundle with manifest and files, publishes to QDN, and cleans up source directory.
+        Raises: requests.RequestException if the upload fails; the source directory is kept so the publish can be retried.
+
+        Means: Computes content hash, compares with previous, creates ZIP bundle with manifest and files, publishes to QDN,
+        seeds the shared cache with the bundle and cleans up source directory.
         """
+        self.published_bytes = 0
+
         # Compute current content hash
         current_hash = self.content_hash()
         if not current_hash:
             self.logger.error("WARC file not found, cannot publish")
             return None
 
-        # Get previous hash from QDN
-        previous_hash = self.get_previous_hash_from_qdn(url_key)
+        # Get previous hash from QDN unless the caller already knows it
+        if scan:
+            previous_hash = self.get_previous_hash_from_qdn(url_key)
 
         # Compare hashes - only publish if the content hash has chnaged
-        if previous_hash != current_hash:
-
-            # Content changed or new, proceed to publish
-            manifest = {
-                "schema": "big-web-archive/v1",
-                "url_key": url_key,
-                "target_url": self.job["url"],
-                "domain": self.job["domain"],
-                "crawl_depth": self.job.get("depth", 2),
-                "timestamp": self.get_iso_timestamp(),
-                "content_hash": current_hash,
-                "previous_hash": previous_hash,
-                "warc": "warc/crawl.warc.gz",
-                "artifacts": {
-                    "log": "metadata/crawl.log",
-                    "html": "metadata/snapshot.html",
-                    "png": "metadata/snapshot.png"
-                }
-            }
+        if previous_hash == current_hash:
+            self.logger.info("Content unchanged, skipping QDN publish")
+            self.cleanup_source()
+            return None
 
-            # Create ZIP bundle
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                # Add manifest JSON
-                zip_file.writestr("manifest.json", json.dumps(manifest, indent=2))
-                # Add files
-                files_to_add = [
-                    ("warc/crawl.warc.gz", "warc/crawl.warc.gz"),
-                    ("metadata/crawl.log", "metadata/crawl.log"),
-                    ("metadata/snapshot.html", "metadata/snapshot.html"),
-                    ("metadata/snapshot.png", "metadata/snapshot.png")
-                ]
-                for src, dst in files_to_add:
-                    src_path = os.path.join(self.basedir, src)
-                    if os.path.exists(src_path):
-                        zip_file.write(src_path, dst)
-
-            # Base64 encode the ZIP
-            zip_base64 = base64.b64encode(zip_buffer.getvalue()).decode('utf-8')
-
-            # Publish to QDN
-            identifier = current_hash.replace("sha256:", "")
-            publish_url = f"{self.QDN_API_BASE}/arbitrary/{self.QDN_SERVICE}/{self.QDN_NAME}/{identifier}/zip"
-            data = {"data": zip_base64}
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json"
+        # Content changed or new, proceed to publish
+        manifest = {
+            "schema": "big-web-archive/v1",
+            "url_key": url_key,
+            "target_url": self.job["url"],
+            "domain": self.job["domain"],
+            "crawl_depth": self.job.get("depth", 2),
+            "timestamp": self.get_iso_timestamp(),
+            "content_hash": current_hash,
+            "previous_hash": previous_hash,
+            "warc": self.warc_member(),
+            "codec": {
+                "warc": "zstd" if self.warc_member().endswith(".zst") else "gzip",
+                "bundle": bwa_codec.BUNDLE_CODEC
+            },
+            "artifacts": {
+                "log": "metadata/crawl.log",
+                "html": "metadata/snapshot.html",
+                **self.image_artifacts()
             }
-            try:
-                response = requests.post(publish_url, json=data, headers=headers, timeout=10)  # 10 second timeout
-                if response.status_code == 200:
-                    self.logger.info("Successfully published to QDN")
-                    return manifest
+        }
+        for name, member in self.OPTIONAL_ARTIFACTS.items():
+            if os.path.exists(os.path.join(self.basedir, member)):
+                manifest["artifacts"][name] = member
+        if bwa_codec.BUNDLE_CODEC == "zstd":
+            manifest["codec"]["level"] = bwa_codec.ZSTD_LEVEL
+        manifest["digests"] = {
+            member: self.file_hash(os.path.join(self.basedir, member))
+            for member in [manifest["warc"], *manifest["artifacts"].values()]
+            if os.path.exists(os.path.join(self.basedir, member))
+        }
+
+        # Against a previous version only the changed records and artifacts are shipped
+        delta_warc = None
+        if previous_hash:
+            delta_warc = self.build_delta(manifest, previous_hash)
+
+        # Create ZIP bundle; already-compressed members are stored, not deflated again
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            # Add manifest JSON
+            zip_file.writestr("manifest.json", json.dumps(manifest, indent=2))
+            if delta_warc is not None:
+                zip_file.writestr(DELTA_WARC, delta_warc, compress_type=bwa_codec.compress_type(DELTA_WARC))
+            else:
+                warc_path = os.path.join(self.basedir, manifest["warc"])
+                zip_file.write(warc_path, manifest["warc"], compress_type=bwa_codec.compress_type(manifest["warc"]))
+            # Add files
+            for member in manifest["artifacts"].values():
+                src_path = os.path.join(self.basedir, member)
+                if member in manifest.get("inherited", {}) or not os.path.exists(src_path):
+                    continue
+                if bwa_codec.compress_type(member) == zipfile.ZIP_STORED:
+                    zip_file.write(src_path, member, compress_type=zipfile.ZIP_STORED)
                 else:
-                    self.logger.error(f"Failed to publish to QDN: {response.status_code} {response.text}")
-            except Exception as e:
-                self.logger.error(f"Error publishing to QDN: {e}")
+                    with open(src_path, "rb") as f:
+                        bwa_codec.write_member(zip_file, member, f.read())
 
-        else:
-            
-            self.logger.info("Content unchanged, skipping QDN publish")
+        zip_bytes = zip_buffer.getvalue()
+
+        # Publish to QDN; large bundles go up in parallel pieces, their head last
+        identifier = current_hash.replace("sha256:", "")
+        try:
+            with stage("publish"):
+                if len(zip_bytes) > bwa_chunks.CHUNK_SIZE:
+                    chunks, pieces = bwa_chunks.split(zip_bytes)
+                    self.published_bytes += bwa_chunks.upload(chunks, pieces, self._publish_resource, self.published_chunks)
+                    self.published_bytes += self._publish_resource(identifier, bwa_chunks.head(manifest, chunks))
+                    self.logger.info(f"Published {len(pieces)} chunks of {len(zip_bytes)} bytes")
+                else:
+                    self.published_bytes += self._publish_resource(identifier, zip_bytes)
+        except requests.RequestException as e:
+            self.logger.error(f"Error publishing to QDN: {e}")
+            raise
+
+        self.logger.info("Successfully published to QDN")
+
+        # Views of the new version are served from the cache without a QDN round trip
+        self.cache.put(current_hash, zip_bytes)
+        self.cache.set_key(url_key, current_hash)
+        self.cleanup_source()
+        return manifest
+
+    def build_delta(self, manifest, previous_hash):
+        """
+        Turn a manifest into a delta against the previous version.
+
+        Purpose: Recurring captures upload only what changed since the last published version.
+
+        Inputs:
+        - manifest (dict): The manifest being published; "inherited", "delta" and "warc" are filled in.
+        - previous_hash (str): Content hash of the previous version.
+
+        Outputs: bytes or None: The delta WARC, or None if the full WARC should be shipped.
+
+        Means: Artifacts whose digest matches the previous version are inherited from the bundle
+        that stores them. The WARC is rebuilt with revisit records for known payloads and kept
+        only if it is smaller than the full WARC and reassembles into the same records. Once a chain is BWA_DELTA_MAX_CHAIN deltas deep
+        a full, self-contained bundle is published instead.
+        """
+        try:
+            previous = self.bundles.manifest(previous_hash)
+            if not previous:
+                self.logger.info(f"Previous version {previous_hash} unavailable, publishing full bundle")
+                return None
+            # revisits copy raw gzip members, so deltas are only built between gzip WARCs
+            if manifest["warc"] != "warc/crawl.warc.gz" or previous.get("warc") not in ("warc/crawl.warc.gz", DELTA_WARC):
+                return None
+            depth = self.bundles.delta.chain_depth(previous)
+            if depth > bwa_delta.MAX_CHAIN:
+                self.logger.info(f"Delta chain of {previous_hash} is {depth - 1} deep, publishing full bundle")
+                return None
+
+            previous_digests = previous.get("digests", {})
+            previous_inherited = previous.get("inherited", {})
+            inherited = {
+                member: previous_inherited.get(member, self.cache.strip_hash(previous_hash))
+                for member, digest in manifest["digests"].items()
+                if member != manifest["warc"] and previous_digests.get(member) == digest
+            }
+            if inherited:
+                manifest["inherited"] = inherited
+
+            warc_path = os.path.join(self.basedir, "warc", "crawl.warc.gz")
+            out = io.BytesIO()
+            stats = self.bundles.delta.build(warc_path, previous_hash, out)
+            delta_warc = out.getvalue()
+            if len(delta_warc) >= os.path.getsize(warc_path):
+                return None
+            # round trip: readers must get back every record of this capture
+            self.bundles.delta.verify(warc_path, delta_warc)
+
+            manifest["warc"] = DELTA_WARC
+            manifest["delta"] = {
+                "base": previous_hash,
+                "depth": depth,
+                "warc_sha256": "sha256:" + hashlib.sha256(delta_warc).hexdigest(),
+                **stats
+            }
+            self.logger.info(f"Delta against {previous_hash}: {stats['revisits']}/{stats['records']} records unchanged")
+            return delta_warc
+        except Exception as e:
+            self.logger.error(f"Failed to build delta against {previous_hash}, publishing full bundle: {e}")
+            manifest.pop("inherited", None)
             return None
 
-        # Cleanup: remove the source directory regardless of publish outcome
+    def fetch_bundle(self, content_hash):
+        """
+        Pull one published bundle into the shared cache.
+
+        :param content_hash: Content hash (and QDN identifier) of the bundle
+        :returns: Path to the cached ZIP, or None if it could not be fetched
+        """
+        resource = {
+            "service": self.QDN_SERVICE,
+            "name": self.QDN_NAME,
+            "identifier": self.cache.strip_hash(content_hash)
+        }
+        try:
+            return self.cache.fill(content_hash, lambda: self._download_resource(resource))
+        except Exception as e:
+            self.logger.error(f"Error fetching bundle {content_hash}: {e}")
+            return None
+
+    def cleanup_source(self):
+        """
+        Remove the job's source directory once its content is on QDN.
+        """
         try:
             if os.path.exists(self.basedir):
                 shutil.rmtree(self.basedir)
@@ -294,20 +490,99 @@ class bwa_manifest:
         except Exception as e:
             self.logger.error(f"Failed to clean up source directory {self.basedir}: {e}")
 
-        return None
+    def _publish_resource(self, identifier, data):
+        """
+        Publish one QDN resource.
 
-    def get_manifests_for_url_key(self, url_key):
+        :param identifier: QDN identifier
+        :param data: The bytes to publish
+        :returns: Bytes sent (base64)
+        :raises requests.RequestException: if the upload fails
         """
-        Get all manifests for a given url_key from QDN.
+        publish_url = f"{self.QDN_API_BASE}/arbitrary/{self.QDN_SERVICE}/{self.QDN_NAME}/{identifier}/zip"
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        encoded = base64.b64encode(data).decode('utf-8')
+        response = requests.post(publish_url, json={"data": encoded}, headers=headers, timeout=bwa_chunks.timeout(len(encoded)))
+        response.raise_for_status()
+        add_bytes("uploaded", len(encoded))
+        return len(encoded)
 
-        Purpose: Retrieves all archived versions for a URL from the decentralized network.
+    def _fetch_resource(self, identifier, size = 0):
+        """
+        Download the bytes of one QDN resource of this service and name.
+
+        :param identifier: QDN identifier
+        :param size: Expected size, if known, to allow for its transfer time
+        :returns: The bytes
+        :raises requests.RequestException: if the download fails
+        """
+        data_url = f"{self.QDN_API_BASE}/arbitrary/{self.QDN_SERVICE}/{self.QDN_NAME}/{identifier}"
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        response = requests.post(data_url, timeout=bwa_chunks.timeout(size), headers=headers)  # Use POST instead of GET
+        response.raise_for_status()
+        add_bytes("downloaded", len(response.content))
+        return response.content
+
+    def _download_resource(self, resource):
+        """
+        Download the ZIP bundle of one QDN resource.
+
+        Purpose: Single place where archive bundles are fetched from QDN.
 
         Inputs:
-        - url_key (str): The normalized URL key to search for.
+        - resource (dict): A QDN resource listing entry with service, name and identifier.
+
+        Outputs: bytes, str or None: The ZIP bytes; for a chunked bundle the path of the cache
+        spool file it was reassembled in; None if the download failed.
+
+        Means: Fetches the resource; if it is the head of a chunked bundle, fetches the chunks
+        it lists in parallel, verifying each, into a spool file next to the cache.
+        """
+        try:
+            with stage("fetch"):
+                data = self._fetch_resource(resource['identifier'])
+                chunks = bwa_chunks.read_head(data)
+                if chunks:
+                    return bwa_chunks.download(chunks, self._fetch_resource, self.cache.spool_path(resource['identifier']))
+                return data
+        except (requests.RequestException, ValueError, OSError) as e:
+            self.logger.error(f"Failed to download resource {resource['identifier']}: {e}")
+            return None
+
+    @staticmethod
+    def read_manifest(zip_source):
+        """
+        Read manifest.json out of a bundle.
+
+        :param zip_source: Path or file object of the ZIP bundle
+        :returns: The manifest dict, or None if the bundle has no manifest
+        """
+        with zipfile.ZipFile(zip_source, 'r') as zip_file:
+            if 'manifest.json' not in zip_file.namelist():
+                return None
+            return json.loads(zip_file.read('manifest.json').decode('utf-8'))
+
+    def scan_manifests(self, url_keys = None, skip = None):
+        """
+        Get the manifests of every archive published on QDN.
+
+        Purpose: Lists archived versions for many URLs with a single QDN resource listing.
 
-        Outputs: list: List of tuples (identifier, manifest_dict, zip_bytes) for matching resources.
+        Inputs:
+        - url_keys (set, optional): Only keep manifests for these url_keys, defaults to all.
+        - skip (callable, optional): Called with each resource identifier; resources it returns True for
+          are neither read nor downloaded, e.g. versions a caller has already seen.
 
-        Means: Queries QDN resources, downloads and parses ZIP files to extract manifests matching the url_key.
+        Outputs: list: List of tuples (identifier, manifest_dict, zip_path) for matching resources.
+
+        Means: Lists QDN resources; bundles already in the shared cache are read from disk, the rest
+        are downloaded once, verified and added to the cache before their manifests are parsed.
         """
         url = f"{self.QDN_API_BASE}/arbitrary/resources?service={self.QDN_SERVICE}&name={self.QDN_NAME}"  # Try query string format
         params = {
@@ -316,188 +591,142 @@ class bwa_manifest:
         }
         manifests = []
         try:
-            response = requests.get(url, params=params, timeout=10)  # 10 second timeout
+            with stage("list"):
+                response = requests.get(url, params=params, timeout=10)  # 10 second timeout
             if response.status_code == 200:
                 resources = response.json()
                 self.logger.info(f"Successfully retrieved {len(resources)} resources from QDN")
                 for resource in resources:
-                    data_url = f"{self.QDN_API_BASE}/arbitrary/{resource['service']}/{resource['name']}/{resource['identifier']}"
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Accept": "application/json"
-                    }
-                    data_response = requests.post(data_url, timeout=10, headers=headers)  # Use POST instead of GET
-                    if data_response.status_code == 200:
-                        zip_data = io.BytesIO(data_response.content)
-                        with zipfile.ZipFile(zip_data, 'r') as zip_file:
-                            if 'manifest.json' in zip_file.namelist():
-                                manifest_data = zip_file.read('manifest.json')
-                                manifest = json.loads(manifest_data.decode('utf-8'))
-                                if manifest.get('url_key') == url_key:
-                                    manifests.append((resource['identifier'], manifest, zip_data.getvalue()))
+                    # pieces of chunked bundles are read through their head
+                    if bwa_chunks.is_chunk(resource['identifier']):
+                        continue
+                    if skip is not None and skip(resource['identifier']):
+                        continue
+                    # bundles are published under their content hash, so a hit skips the download
+                    zip_path = self.cache.get(resource['identifier'])
+                    if zip_path:
+                        manifest = self.read_manifest(zip_path)
                     else:
-                        self.logger.error(f"Failed to download resource: {data_response.status_code} {data_response.text}")
+                        zip_bytes = self._download_resource(resource)
+                        if not zip_bytes:
+                            continue
+                        # chunked bundles arrive as a spool file, whole ones as bytes
+                        manifest = self.read_manifest(zip_bytes if isinstance(zip_bytes, str) else io.BytesIO(zip_bytes))
+                        if not manifest or not manifest.get('content_hash'):
+                            if isinstance(zip_bytes, str):
+                                os.remove(zip_bytes)
+                            continue
+                        zip_path = self.cache.fill(manifest['content_hash'], lambda: zip_bytes)
+                        if isinstance(zip_bytes, str) and os.path.exists(zip_bytes):
+                            # another filler cached the bundle first
+                            os.remove(zip_bytes)
+                        if not zip_path:
+                            continue
+                    if manifest and (url_keys is None or manifest.get('url_key') in url_keys):
+                        manifests.append((resource['identifier'], manifest, zip_path))
             else:
                 self.logger.error(f"Failed to get resources: {response.status_code} {response.text}")
         except Exception as e:
             self.logger.error(f"Error getting manifests: {e}")
         return manifests
 
-    def get_most_recent_zip(self, url_key):
+    def get_manifests_for_url_key(self, url_key):
         """
-        Retrieve the most recent archive ZIP file for the given url_key and save it to disk.
+        Get all manifests for a given url_key from QDN.
 
-        Purpose: Downloads the latest version of the web archive for viewing or processing.
+        Purpose: Retrieves all archived versions for a URL from the decentralized network.
 
         Inputs:
-        - url_key (str): The normalized URL key.
-
-        Outputs: str or None: The content hash of the saved ZIP, or None if no manifests found.
+        - url_key (str): The normalized URL key to search for.
 
-        Means: Identifies the head of the hash chain, saves the corresponding ZIP to jobs/manifest/dl/{job_id}/{url_key}/{content_hash}.zip.
+        Outputs: list: List of tuples (identifier, manifest_dict, zip_path) for matching resources.
         """
-        manifests = self.get_manifests_for_url_key(url_key)
-        if not manifests:
-            return None
-        # Find the one with no previous_hash (the head of the chain)
-        for ident, manifest, zip_bytes in manifests:
-            if not manifest.get('previous_hash'):
-                content_hash = manifest.get('content_hash', 'unknown').replace('sha256:', '')
-                save_path = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, f"{content_hash}.zip")
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                with open(save_path, 'wb') as f:
-                    f.write(zip_bytes)
-                self.logger.info(f"Saved most recent ZIP to {save_path}")
-                return content_hash
-        # If none, save the first one
-        if manifests:
-            ident, manifest, zip_bytes = manifests[0]
-            content_hash = manifest.get('content_hash', 'unknown').replace('sha256:', '')
-            save_path = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, f"{content_hash}.zip")
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, 'wb') as f:
-                f.write(zip_bytes)
-            self.logger.info(f"Saved most recent ZIP to {save_path}")
-            return content_hash
-        return None
+        return self.scan_manifests({url_key})
 
-    def get_all_zips_sorted(self, url_key):
+    def get_latest_hashes(self, url_keys):
         """
-        Retrieve a list of all ZIP files for the url_key, sorted by content_hash link order, and save them to disk.
+        Return the latest published content hash of several url_keys.
 
-        Purpose: Downloads the entire version history of the web archive in chronological order.
+        Purpose: Lets a batch of publishes share one QDN scan for change detection.
 
         Inputs:
-        - url_key (str): The normalized URL key.
-
-        Outputs: list: List of content hashes for the saved ZIPs.
+        - url_keys (iterable): The url_keys to look up.
 
-        Means: Builds the hash chain from head to tail, saves each ZIP to jobs/manifest/dl/{job_id}/{url_key}/{content_hash}.zip in order.
+        Outputs: dict: url_key -> content hash of its newest version, None when never published.
         """
-        manifests = self.get_manifests_for_url_key(url_key)
-        if not manifests:
-            return []
-        
-        # Build the chain: start from the one with no previous_hash
-        chain = {}
-        for ident, manifest, zip_bytes in manifests:
-            chash = manifest.get('content_hash')
-            prev_hash = manifest.get('previous_hash')
-            chain[chash] = (manifest, zip_bytes)
-        
-        # Find the head (no previous_hash)
-        head = None
-        for chash, (manifest, _) in chain.items():
-            if not manifest.get('previous_hash'):
-                head = chash
-                break
-        
-        saved_hashes = []
-        if not head:
-            # If no head, save all
-            for ident, manifest, zip_bytes in manifests:
-                content_hash = manifest.get('content_hash', 'unknown').replace('sha256:', '')
-                save_path = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, f"{content_hash}.zip")
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                with open(save_path, 'wb') as f:
-                    f.write(zip_bytes)
-                saved_hashes.append(content_hash)
-        else:
-            # Follow the chain
-            current = head
-            while current:
-                if current in chain:
-                    manifest, zip_bytes = chain[current]
-                    content_hash = current.replace('sha256:', '')
-                    save_path = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, f"{content_hash}.zip")
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                    with open(save_path, 'wb') as f:
-                        f.write(zip_bytes)
-                    saved_hashes.append(content_hash)
-                    # Find next: the one whose previous_hash is current
-                    next_chash = None
-                    for chash, (m, _) in chain.items():
-                        if m.get('previous_hash') == current:
-                            next_chash = chash
-                            break
-                    current = next_chash
-                else:
-                    break
-        
-        self.logger.info(f"Saved {len(saved_hashes)} ZIPs to jobs/manifest/dl/{self.job_id}/{url_key}/")
-        return saved_hashes
+        url_keys = set(url_keys)
+        by_key = {key: [] for key in url_keys}
+        for entry in self.scan_manifests(url_keys):
+            by_key[entry[1]['url_key']].append(entry)
+        latest = {}
+        for key, manifests in by_key.items():
+            head = self.latest_manifest(manifests)
+            latest[key] = head[1].get('content_hash') if head else None
+        return latest
 
-    def extract_zip(self, url_key, content_hash):
+    def get_most_recent_zip(self, url_key):
         """
-        Extract the ZIP file for the given url_key and content_hash, and return the path to the extracted directory.
+        Retrieve the most recent archive ZIP file for the given url_key into the shared cache.
 
-        Purpose: Unpacks the archive for GUI viewing or further processing.
+        Purpose: Downloads the latest version of the web archive for viewing or processing.
 
         Inputs:
         - url_key (str): The normalized URL key.
-        - content_hash (str): The content hash of the ZIP to extract.
 
-        Outputs: str or None: Path to the extracted directory, or None if extraction fails.
+        Outputs: str or None: The content hash of the cached ZIP, or None if no manifests found.
 
-        Means: Extracts the ZIP to jobs/manifest/dl/{job_id}/{url_key}/{content_hash}/ and returns the path.
+        Means: Answers from the cached url_key mapping when it is fresh; otherwise scans QDN, picks
+        the newest version of the chain and records it as the url_key's latest content hash.
         """
-        zip_path = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, f"{content_hash}.zip")
-        extract_dir = os.path.join("jobs", "manifest", "dl", self.job_id, url_key, content_hash)
-        
-        if not os.path.exists(zip_path):
-            self.logger.error(f"ZIP file not found: {zip_path}")
-            return None
-        
-        try:
-            os.makedirs(extract_dir, exist_ok=True)
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-            self.logger.info(f"Extracted ZIP to {extract_dir}")
-            return extract_dir
-        except Exception as e:
-            self.logger.error(f"Failed to extract ZIP {zip_path}: {e}")
+        content_hash = self.cache.get_key(url_key)
+        if content_hash:
+            self.logger.info(f"Cache hit for {url_key}: {content_hash}")
+            return content_hash
+
+        latest = self.latest_manifest(self.get_manifests_for_url_key(url_key))
+        if not latest:
             return None
+        ident, manifest, zip_path = latest
+        content_hash = self.cache.strip_hash(manifest.get('content_hash', ident))
+        self.cache.set_key(url_key, content_hash)
+        self.logger.info(f"Most recent ZIP cached at {zip_path}")
+        return content_hash
 
-    def cleanup(self):
+    def get_all_zips_sorted(self, url_key):
         """
-        Clean up all downloaded and extracted files for this job_id.
+        Retrieve all ZIP files for the url_key into the shared cache, sorted by content_hash link order.
 
-        Purpose: Removes temporary files to free disk space without affecting shared resources.
+        Purpose: Downloads the entire version history of the web archive in chronological order.
 
-        Inputs: None
+        Inputs:
+        - url_key (str): The normalized URL key.
 
-        Outputs: None
+        Outputs: list: List of content hashes for the cached ZIPs, oldest first.
 
-        Means: Deletes the jobs/manifest/dl/{job_id} directory and its contents.
+        Means: Builds the hash chain from its first version (no previous_hash) and follows
+        previous_hash links forward; every bundle already sits in the cache after the scan.
         """
-        dl_dir = os.path.join("jobs", "manifest", "dl", self.job_id)
-        try:
-            if os.path.exists(dl_dir):
-                shutil.rmtree(dl_dir)
-                self.logger.info(f"Cleaned up directory: {dl_dir}")
-            else:
-                self.logger.info(f"No directory to clean: {dl_dir}")
-        except Exception as e:
-            self.logger.error(f"Failed to clean up {dl_dir}: {e}")
+        manifests = self.get_manifests_for_url_key(url_key)
+        if not manifests:
+            return []
 
+        chain = {}
+        successors = {}
+        for ident, manifest, zip_path in manifests:
+            chash = manifest.get('content_hash')
+            chain[chash] = manifest
+            successors[manifest.get('previous_hash')] = chash
 
+        # Find the first version (no previous_hash)
+        current = successors.get(None)
+        if not current:
+            # If no first version, return all
+            return [self.cache.strip_hash(m.get('content_hash', i)) for i, m, _ in manifests]
+
+        saved_hashes = []
+        while current in chain and self.cache.strip_hash(current) not in saved_hashes:
+            saved_hashes.append(self.cache.strip_hash(current))
+            current = successors.get(current)
+
+        self.logger.info(f"Cached {len(saved_hashes)} ZIPs for {url_key}")
+        return saved_hashes
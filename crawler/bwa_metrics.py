@@ -0,0 +1,242 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from .bwa_trace import current as current_trace
+
+# Process-wide metrics in the Prometheus text format (GET /metrics).
+#
+# Instruments are plain counters and fixed-bucket histograms behind one lock each, so the
+# hot path costs a dict lookup, a bisect and an add. Values that are expensive to compute
+# (jobs by status, pool and cache usage) are produced by collectors only when scraped.
+#
+#   bwa_stage_seconds{stage}            histogram of pipeline stage durations
+#   bwa_stage_total{stage,outcome}      stage runs, outcome "ok" or "error"
+#   bwa_bytes_total{direction}          bytes captured, uploaded and downloaded
+#   bwa_cache_requests_total{cache,result}
+#
+# Stages: revalidate, navigate, idle, har, warc, html, screenshot, encode, store, hash,
+# publish, fetch, list, extract, replay.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra = None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels = ()):
+        """
+        A monotonically increasing value per label set.
+
+        :param name: Metric name
+        :param help: One-line description
+        :param labels: Label names, values are passed to inc() as keyword arguments
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels = (), buckets = DURATION_BUCKETS):
+        """
+        Observations counted into fixed buckets, with their sum and count.
+
+        :param name: Metric name
+        :param help: One-line description
+        :param labels: Label names
+        :param buckets: Upper bounds, ascending; +Inf is added
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # per-bucket counts (not cumulative), then sum
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self.lock:
+            values = [(key, list(series)) for key, series in self.values.items()]
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+class registry:
+    def __init__(self):
+        """
+        Holds instruments and scrape-time collectors.
+        """
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """
+        Register a callable run at scrape time.
+
+        :param fn: Returns an iterable of (name, kind, help, [(labels dict, value), ...])
+        :returns: fn, so it can be used as a decorator
+        """
+        with self.lock:
+            self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in list(self.metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for fn in list(self.collectors):
+            try:
+                families = list(fn())
+            except Exception as e:
+                lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {_escape(e)}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = registry()
+
+STAGE_SECONDS = REGISTRY.register(histogram("bwa_stage_seconds", "Duration of pipeline stages", ["stage"]))
+STAGE_TOTAL = REGISTRY.register(counter("bwa_stage_total", "Pipeline stage runs by outcome", ["stage", "outcome"]))
+BYTES = REGISTRY.register(counter("bwa_bytes_total", "Bytes captured, uploaded to and downloaded from QDN", ["direction"]))
+CACHE = REGISTRY.register(counter("bwa_cache_requests_total", "Cache lookups by result", ["cache", "result"]))
+JOBS_FINISHED = REGISTRY.register(counter("bwa_jobs_finished_total", "Jobs reaching a final status", ["status"]))
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage, and add it to the running job's trace if there is one.
+
+    Works around both blocking code and awaits:
+
+        with stage("screenshot"):
+            await page.screenshot(...)
+
+    :param name: Stage name
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage=name)
+        STAGE_TOTAL.inc(stage=name, outcome=outcome)
+        trace = current_trace()
+        if trace is not None:
+            trace.add(name, started, seconds)
+
+
+def add_bytes(direction, amount):
+    """
+    Count bytes moved by the pipeline.
+
+    :param direction: "captured", "uploaded" or "downloaded"
+    :param amount: Number of bytes
+    """
+    if amount:
+        BYTES.inc(amount, direction=direction)
+
+
+def cache_result(cache, hit):
+    """
+    Count one cache lookup.
+
+    :param cache: Cache name, e.g. "archive", "bundle", "index", "variant", "key"
+    :param hit: True for a hit
+    """
+    CACHE.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@REGISTRY.collector
+def cache_ratios():
+    # hit ratio per cache since start, derived from the lookup counter
+    totals = {}
+    for (cache, result), value in list(CACHE.values.items()):
+        hits, lookups = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == "hit" else 0), lookups + value)
+    yield ("bwa_cache_hit_ratio", "gauge", "Cache hits divided by lookups since start",
+           [({"cache": cache}, round(hits / lookups, 4)) for cache, (hits, lookups) in totals.items() if lookups])
@@ -0,0 +1,157 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .bwa_metrics import REGISTRY
+
+# Bounded worker pools for blocking work started from the event loop:
+#   io  - job files, cache and bundle reads, local artifacts   (BWA_IO_WORKERS, default 8)
+#   net - QDN lookups and downloads                             (BWA_NET_WORKERS, default 8)
+# Other stages (e.g. publishing) create their own pool so a backlog there cannot starve
+# the API. Every pool counts running and waiting calls so saturation shows up in metrics.
+
+IO_WORKERS = int(os.environ.get("BWA_IO_WORKERS", 8))
+NET_WORKERS = int(os.environ.get("BWA_NET_WORKERS", 8))
+
+class bwa_pool:
+    registry = {}
+
+    def __init__(self, name, max_workers):
+        """
+        A named, bounded thread pool with saturation counters.
+
+        :param name: Pool name used in metrics
+        :param max_workers: Number of worker threads
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"bwa-{name}")
+        self.lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+        bwa_pool.registry[name] = self
+
+
+    def _call(self, submitted, fn, args, kwargs):
+        started = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_seconds += started - submitted
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.failed += 0 if ok else 1
+                self.busy_seconds += time.monotonic() - started
+
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking callable in the pool and await its result.
+
+        :param fn: The callable
+        :returns: Whatever fn returns; exceptions are re-raised in the caller
+        """
+        with self.lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._call, time.monotonic(), fn, args, kwargs)
+        # carry context variables (the job trace) into the worker thread
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, call)
+
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Start a blocking callable in the pool from another thread, without an event loop.
+
+        :param fn: The callable
+        :returns: A concurrent.futures.Future of its result
+        """
+        with self.lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        call = functools.partial(self._call, time.monotonic(), fn, args, kwargs)
+        return self.executor.submit(contextvars.copy_context().run, call)
+
+
+    def stats(self):
+        """
+        Return the pool's counters.
+
+        :returns: dict with workers, active, queued, peak_queued, completed, failed,
+                  wait_seconds, busy_seconds and saturation (active / workers)
+        """
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "busy_seconds": round(self.busy_seconds, 6),
+                "saturation": round(self.active / self.max_workers, 3),
+            }
+
+
+    def shutdown(self, wait = True):
+        """
+        Stop the pool's threads once queued calls have finished.
+        """
+        self.executor.shutdown(wait=wait)
+        bwa_pool.registry.pop(self.name, None)
+
+
+    @classmethod
+    def all_stats(cls):
+        """
+        Return the counters of every live pool, keyed by name.
+        """
+        return {name: pool.stats() for name, pool in list(cls.registry.items())}
+
+
+@REGISTRY.collector
+def pool_metrics():
+    stats = bwa_pool.all_stats()
+    for field, kind, help in (
+        ("workers", "gauge", "Threads in the pool"),
+        ("active", "gauge", "Calls running"),
+        ("queued", "gauge", "Calls waiting for a thread"),
+        ("saturation", "gauge", "Running calls divided by threads"),
+        ("completed", "counter", "Calls finished"),
+        ("wait_seconds", "counter", "Time calls spent waiting for a thread"),
+    ):
+        suffix = "_total" if kind == "counter" and not field.endswith("seconds") else ""
+        yield (f"bwa_pool_{field}{suffix}", kind, help, [({"pool": name}, pool[field]) for name, pool in stats.items()])
+
+
+io_pool = bwa_pool("io", IO_WORKERS)
+net_pool = bwa_pool("net", NET_WORKERS)
@@ -0,0 +1,251 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import time
+import asyncio
+import logging
+import requests
+from .bwa_jobqueue import job_queue, job_feed
+from .bwa_manifest import bwa_manifest
+from .bwa_pool import bwa_pool, io_pool, net_pool
+from .bwa_metrics import REGISTRY, counter, JOBS_FINISHED
+from .bwa_trace import job_trace
+from .bwa_log import job_context
+
+# Job status flow through the publish stage:
+#   crawled -> publish_queued -> publishing -> complete
+#                                          \-> failed   (permanent error or retries exhausted)
+# Crawled jobs are picked up from the job files written since the last scan (see job_feed).
+
+PUBLISH_RETRIES = REGISTRY.register(counter("bwa_publish_retries_total", "Uploads retried after a transient QDN error"))
+
+class rate_limiter:
+
+    def __init__(self, rate, burst = 1):
+        """
+        Token bucket limiting how often an operation may start.
+
+        :param rate: Operations per second
+        :param burst: Operations allowed back to back after an idle period
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class publisher:
+    CONCURRENCY = int(os.environ.get("BWA_PUBLISH_CONCURRENCY", 2))
+    RATE = float(os.environ.get("BWA_PUBLISH_RATE", 0.5))
+    RETRIES = int(os.environ.get("BWA_PUBLISH_RETRIES", 5))
+    BACKOFF = float(os.environ.get("BWA_PUBLISH_BACKOFF", 5.0))
+    BATCH_SIZE = int(os.environ.get("BWA_PUBLISH_BATCH", 16))
+    POLL_INTERVAL = float(os.environ.get("BWA_PUBLISH_POLL", 2.0))
+
+    def __init__(self, basedir = "jobs/manifest", concurrency = None, rate = None):
+        """
+        Background stage that publishes finished crawls to QDN.
+
+        :param basedir: Base directory of crawl output
+        :param concurrency: Number of uploads in flight, defaults to BWA_PUBLISH_CONCURRENCY (2)
+        :param rate: Uploads started per second against the local node, defaults to BWA_PUBLISH_RATE (0.5)
+        """
+        self.basedir = basedir
+        self.concurrency = concurrency or self.CONCURRENCY
+        self.limiter = rate_limiter(rate or self.RATE)
+        # uploads get their own threads so a QDN backlog never holds up API fetches
+        self.pool = bwa_pool("publish", self.concurrency)
+        self.jobs = job_queue()
+        self.feed = job_feed(lambda job: job.get("status") == "crawled", self.jobs)
+        self.queue = asyncio.Queue(maxsize=self.BATCH_SIZE)
+        self.latest = {}
+        self.key_locks = {}
+        self.tasks = []
+        self.logger = logging.getLogger("bwa_publish")
+
+
+    @staticmethod
+    def transient(error):
+        """
+        Return True if a failed upload is worth retrying.
+
+        :param error: The requests exception raised by the upload
+        """
+        response = getattr(error, "response", None)
+        if response is None:
+            return True  # connection refused, timeout, reset
+        return response.status_code == 429 or response.status_code >= 500
+
+
+    def start(self):
+        """
+        Start the scanner and upload workers on the running event loop.
+        """
+        self.tasks = [asyncio.create_task(self.scan())]
+        self.tasks += [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+        return self.tasks
+
+
+    async def stop(self):
+        """
+        Cancel the scanner and workers.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+    def pending(self):
+        """
+        Return crawled jobs waiting to be published, oldest first.
+        """
+        return sorted(self.feed.refresh().values(), key=lambda job: job.get("crawled_at", 0))
+
+
+    async def scan(self):
+        """
+        Feed batches of crawled jobs to the upload workers.
+
+        The backlog stays on disk in the job queue; only one batch at a time is
+        held in memory, so a slow node grows the backlog instead of stalling crawls.
+        """
+        # jobs caught mid-publish by a restart go back to the backlog
+        for job in await io_pool.run(self.jobs.list_jobs):
+            if job.get("status") in ("publish_queued", "publishing"):
+                await io_pool.run(self.jobs.update_job, job["id"], {"status": "crawled"})
+
+        while True:
+            try:
+                batch = (await io_pool.run(self.pending))[:self.BATCH_SIZE]
+                if not batch:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    continue
+
+                for job in batch:
+                    await io_pool.run(self.jobs.update_job, job["id"], {"status": "publish_queued"})
+                    self.feed.discard(job["id"])
+
+                # one QDN scan answers change detection for the whole batch; keys with a
+                # publish in flight keep the hash this process is about to publish
+                busy = {key for key, lock in self.key_locks.items() if lock.locked()}
+                self.key_locks = {key: self.key_locks[key] for key in busy}
+                url_keys = {job["url_hash"] for job in batch} - busy
+                if url_keys:
+                    await self.limiter.acquire()
+                    scanner = bwa_manifest(None, self.basedir)
+                    self.latest.update(await net_pool.run(scanner.get_latest_hashes, url_keys))
+
+                for job in batch:
+                    await self.queue.put(job["id"])
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Publish scan failed: {e}")
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+
+    async def worker(self):
+        """
+        Publish queued jobs one at a time.
+        """
+        while True:
+            job_id = await self.queue.get()
+            try:
+                with job_context(job_id):
+                    await self.publish_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Publish of job {job_id} failed: {e}")
+                await io_pool.run(self.jobs.update_job, job_id, {"status": "failed", "message": f"Publish failed: {e}"})
+                JOBS_FINISHED.inc(status="failed")
+            finally:
+                self.queue.task_done()
+
+
+    async def publish_job(self, job_id):
+        """
+        Publish one crawled job, retrying transient failures with exponential backoff.
+
+        :param job_id: The job to publish
+        :returns: The published manifest, or None if the content was unchanged
+        """
+        job = await io_pool.run(self.jobs.get_job, job_id)
+        url_key = job["url_hash"]
+        lock = self.key_locks.setdefault(url_key, asyncio.Lock())
+
+        # versions of one URL are published in order so each links to the last
+        async with lock:
+            await io_pool.run(self.jobs.update_job, job_id, {"status": "publishing", "message": "Publishing to QDN"})
+            started = time.monotonic()
+            manifest = bwa_manifest(job_id, self.basedir)
+            trace = job_trace()
+
+            for attempt in range(1, self.RETRIES + 1):
+                await self.limiter.acquire()
+                try:
+                    with trace.activate():
+                        result = await self.pool.run(manifest.publish, url_key, self.latest.get(url_key), False)
+                    break
+                except requests.RequestException as e:
+                    if not self.transient(e) or attempt == self.RETRIES:
+                        raise
+                    PUBLISH_RETRIES.inc()
+                    delay = self.BACKOFF * 2 ** (attempt - 1)
+                    self.logger.info(f"Publish of job {job_id} failed ({e}), retry {attempt} in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+
+            # unchanged means the job's content is the latest published version
+            if result is not None:
+                self.latest[url_key] = result["content_hash"]
+
+            await io_pool.run(self.jobs.update_job, job_id, {
+                "status": "complete",
+                "message": "Published to QDN" if result else "Content unchanged, already on QDN",
+                "content_hash": self.latest.get(url_key),
+                "publish_latency": round(time.monotonic() - started, 3),
+                "publish_attempts": attempt,
+                "publish_bytes": manifest.published_bytes,
+                # hash and upload spans join the crawl's stage timings
+                "timings": {**job.get("timings", {}), **{
+                    name: seconds for name, seconds in trace.timings().items() if name != "total"
+                }}
+            })
+            # the next crawl of this URL can ask the site whether this version is still current
+            if job.get("validators") and self.latest.get(url_key):
+                await io_pool.run(manifest.cache.set_validators, url_key, {
+                    **job["validators"],
+                    "content_hash": self.latest[url_key],
+                    "job_id": job_id,
+                    "captured_at": job.get("crawled_at", time.time()),
+                })
+            JOBS_FINISHED.inc(status="complete")
+            return result
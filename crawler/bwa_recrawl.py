@@ -0,0 +1,108 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import time
+import hashlib
+import requests
+
+# Conditional re-crawls. Every crawl records validators of its main document on the job:
+#   "validators": {"etag": "\"abc\"", "last_modified": "Tue, ...", "fingerprint": "sha256:...", "status": 200}
+# and the publish stage keeps those of the last published version per url_key (bwa_cache).
+# Before the next crawl of the URL renders anything, one plain GET asks the site:
+#   304 Not Modified to If-None-Match / If-Modified-Since   -> unchanged
+#   200 with a main document hashing to the same fingerprint -> unchanged
+#   anything else, or an error                             -> full crawl
+# An unchanged job completes as "unchanged" with the content_hash of the existing version.
+# Only the main document is compared, so captures older than BWA_RECRAWL_MAX_AGE are
+# redone in full to pick up changed subresources; "force": true always crawls.
+#
+#   BWA_CONDITIONAL_RECRAWL   1         0 turns the check off
+#   BWA_RECRAWL_MAX_AGE       604800    seconds a capture may be reused
+#   BWA_RECRAWL_TIMEOUT       10        seconds for the check request
+
+ENABLED = os.environ.get("BWA_CONDITIONAL_RECRAWL", "1") != "0"
+MAX_AGE = int(os.environ.get("BWA_RECRAWL_MAX_AGE", 7 * 24 * 3600))
+TIMEOUT = float(os.environ.get("BWA_RECRAWL_TIMEOUT", 10))
+# documents larger than this are never fingerprint-compared
+MAX_BYTES = 16 * 1024 * 1024
+
+
+def fingerprint(body):
+    """
+    Return the fingerprint of a main document body.
+
+    :param body: Decoded response body bytes
+    """
+    return "sha256:" + hashlib.sha256(body).hexdigest()
+
+
+def validators(status, headers, body):
+    """
+    Build the validators of a captured main document.
+
+    :param status: HTTP status
+    :param headers: Response headers, names lowercased
+    :param body: Response body bytes, or None if unavailable
+    """
+    return {
+        "status": status,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "fingerprint": fingerprint(body) if body is not None and len(body) <= MAX_BYTES else None,
+    }
+
+
+def reusable(previous, now = None):
+    """
+    Return True if a previous capture is recent and complete enough to revalidate.
+
+    :param previous: Validators stored by the publish stage, or None
+    """
+    if not ENABLED or not previous or not previous.get("content_hash"):
+        return False
+    if not (previous.get("etag") or previous.get("last_modified") or previous.get("fingerprint")):
+        return False
+    return (now or time.time()) - previous.get("captured_at", 0) <= MAX_AGE
+
+
+def check(url, previous, user_agent = None):
+    """
+    Ask the site whether the main document changed since the previous capture (blocking).
+
+    :param url: The URL to re-crawl
+    :param previous: Validators of the previous capture
+    :param user_agent: User agent of the crawl, if it sets one
+    :returns: Why the page is unchanged, or None if it changed or that is unknown
+    """
+    headers = {"Accept": "text/html,application/xhtml+xml,*/*;q=0.8"}
+    if user_agent:
+        headers["User-Agent"] = user_agent
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+
+    try:
+        with requests.get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                return "not modified"
+            if response.status_code != previous.get("status", 200) or not previous.get("fingerprint"):
+                return None
+            body = b""
+            for chunk in response.iter_content(1024 * 1024):
+                body += chunk
+                if len(body) > MAX_BYTES:
+                    return None
+    except requests.RequestException:
+        return None
+    return "same main document" if fingerprint(body) == previous["fingerprint"] else None
@@ -0,0 +1,292 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import io
+import os
+import re
+import json
+import struct
+import logging
+import zipfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin, urldefrag
+from warcio.archiveiterator import ArchiveIterator
+from .bwa_delta import REFERS_TO_BUNDLE
+from .bwa_metrics import stage, cache_result
+from . import bwa_codec
+
+# Offset index of one bundle's WARC, cached as jobs/cache/index/<content_hash>.json:
+#   {"member": "warc/crawl.warc.gz",
+#    "records": [[uri, offset, length, type, status, content_type, digest, refers], ...]}
+# Offsets are positions of the compressed record (gzip member or zstd frame) inside the WARC,
+# so serving one URL reads and decompresses exactly one record.
+
+# Response headers that describe the original transfer, not the body we send back
+HOP_HEADERS = {
+    "content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive",
+    "content-security-policy", "content-security-policy-report-only", "strict-transport-security",
+    "set-cookie", "alt-svc",
+}
+
+HTML_ATTR = re.compile(rb'''(\s(?:href|src|action|poster|data-src|background)\s*=\s*)(["']?)([^"'\s>]+)\2''', re.I)
+SRCSET_ATTR = re.compile(rb'''(\ssrcset\s*=\s*)(["'])(.*?)\2''', re.I | re.S)
+CSS_URL = re.compile(rb'''(url\(\s*)(["']?)([^"')]+)\2(\s*\))''', re.I)
+CSS_IMPORT = re.compile(rb'''(@import\s+)(["'])([^"']+)\2''', re.I)
+SKIP_SCHEMES = (b"data:", b"javascript:", b"mailto:", b"tel:", b"about:", b"blob:", b"#")
+
+class bwa_replay:
+    INDEX_MAX = 64
+
+    def __init__(self, bundles):
+        """
+        Serve captured URLs out of archive bundles, Wayback style.
+
+        :param bundles: bwa_bundle reader over the shared cache
+        """
+        self.bundles = bundles
+        self.index_dir = os.path.join(bundles.cache.cache_dir, "index")
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("bwa_replay")
+
+
+    @staticmethod
+    def scan_records(f, member):
+        """
+        Walk a WARC and return one index row per record.
+
+        :param f: Binary file object of the WARC as stored in the bundle
+        :param member: Path of the WARC member, used to pick the codec
+        :returns: list of [uri, offset, length, type, status, content_type, digest, refers]
+        """
+        rows = []
+        if member.endswith(".zst"):
+            # one zstd frame per record: walk the frames, parse each record on its own
+            bwa_codec.require_zstd()
+            data = memoryview(f.read())
+            offset = 0
+            while offset < len(data):
+                dobj = bwa_codec.zstandard.ZstdDecompressor().decompressobj()
+                record_bytes = dobj.decompress(data[offset:])
+                length = len(data) - offset - len(dobj.unused_data)
+                for record in ArchiveIterator(io.BytesIO(record_bytes)):
+                    rows.append(bwa_replay._row(record, offset, length))
+                offset += length
+            return rows
+
+        it = ArchiveIterator(f)
+        for record in it:
+            record.raw_stream.read()
+            rows.append(bwa_replay._row(record, it.get_record_offset(), it.get_record_length()))
+        return rows
+
+
+    @staticmethod
+    def _row(record, offset, length):
+        headers = record.rec_headers
+        http = record.http_headers
+        return [
+            headers.get_header("WARC-Target-URI"),
+            offset,
+            length,
+            record.rec_type,
+            http.get_statuscode() if http else None,
+            http.get_header("Content-Type") if http else None,
+            headers.get_header("WARC-Payload-Digest"),
+            headers.get_header(REFERS_TO_BUNDLE),
+        ]
+
+
+    def index(self, content_hash):
+        """
+        Return the offset index of a bundle's WARC, building it on first use.
+
+        :param content_hash: The content hash of the bundle
+        :returns: dict with member, uris (uri -> row) and digests (digest -> row), or None
+        """
+        key = self.bundles.cache.strip_hash(content_hash)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+                cache_result("index", True)
+                return index
+
+        path = os.path.join(self.index_dir, f"{key}.json")
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+            cache_result("index", True)
+        except (FileNotFoundError, ValueError):
+            cache_result("index", False)
+            manifest = self.bundles.manifest(key)
+            if not manifest:
+                return None
+            member = manifest.get("warc", "warc/crawl.warc.gz")
+            f = self.bundles.open_member(key, member, raw=True)
+            if f is None:
+                return None
+            with f:
+                stored = {"member": member, "records": self.scan_records(f, member)}
+            os.makedirs(self.index_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as out:
+                json.dump(stored, out)
+            os.replace(tmp_path, path)
+            self.logger.info(f"Indexed {len(stored['records'])} records of {key}")
+
+        index = {"member": stored["member"], "uris": {}, "digests": {}}
+        for row in stored["records"]:
+            if row[3] not in ("response", "revisit"):
+                continue
+            # first capture of a URI wins, later duplicates are redirects or retries
+            index["uris"].setdefault(row[0], row)
+            if row[3] == "response" and row[6]:
+                index["digests"].setdefault(row[6], row)
+
+        with self.lock:
+            self.indexes[key] = index
+            while len(self.indexes) > self.INDEX_MAX:
+                self.indexes.popitem(last=False)
+        return index
+
+
+    def _read_raw(self, content_hash, member, offset, length):
+        # Stored WARCs are read straight from the ZIP file at their absolute offset;
+        # deflated ones (older bundles) fall back to seeking inside the member.
+        zip_file = self.bundles.open(content_hash)
+        info = zip_file.getinfo(member)
+        if info.compress_type == zipfile.ZIP_STORED:
+            with open(zip_file.filename, "rb") as f:
+                f.seek(info.header_offset)
+                header = f.read(30)
+                name_len, extra_len = struct.unpack("<HH", header[26:30])
+                f.seek(info.header_offset + 30 + name_len + extra_len + offset)
+                return f.read(length)
+        with zip_file.open(member, "r") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+    def _parse(self, raw, member):
+        if member.endswith(".zst"):
+            raw = bwa_codec.zstandard.ZstdDecompressor().decompress(raw)
+        for record in ArchiveIterator(io.BytesIO(raw)):
+            http = record.http_headers
+            body = record.content_stream().read()
+            return http, body
+        return None, b""
+
+
+    def lookup(self, index, url):
+        """
+        Find the index row for a URL, trying the common spelling variants.
+        """
+        url = urldefrag(url)[0]
+        candidates = [url, url.rstrip("/"), url + "/"]
+        if url.startswith("http://"):
+            candidates.append("https://" + url[7:])
+        elif url.startswith("https://"):
+            candidates.append("http://" + url[8:])
+        for candidate in candidates:
+            row = index["uris"].get(candidate)
+            if row:
+                return row
+        return None
+
+
+    def record(self, content_hash, url):
+        """
+        Return one captured response.
+
+        Purpose: Decompresses only the record that was asked for.
+
+        Inputs:
+        - content_hash (str): The content hash of the version to replay.
+        - url (str): The captured URL.
+
+        Outputs: tuple or None: (status, headers, body, digest), or None if the URL was not captured.
+
+        Means: Looks the URL up in the offset index, reads its compressed record from the bundle
+        and, for revisit records of delta versions, reads the payload from the origin bundle.
+        """
+        with stage("replay"):
+            return self._record(content_hash, url)
+
+    def _record(self, content_hash, url):
+        key = self.bundles.cache.strip_hash(content_hash)
+        index = self.index(key)
+        if index is None:
+            return None
+        row = self.lookup(index, url)
+        if row is None:
+            return None
+        _, offset, length, rec_type, status, _, digest, refers = row
+
+        http, body = self._parse(self._read_raw(key, index["member"], offset, length), index["member"])
+        if rec_type == "revisit" and refers:
+            origin = self.index(refers)
+            origin_row = origin["digests"].get(digest) if origin else None
+            if origin_row is None:
+                return None
+            _, body = self._parse(self._read_raw(refers, origin["member"], origin_row[1], origin_row[2]), origin["member"])
+
+        headers = [(name, value) for name, value in (http.headers if http else []) if name.lower() not in HOP_HEADERS]
+        return int(status or 200), headers, body, digest
+
+
+    @staticmethod
+    def rewrite(body, content_type, base_url, prefix):
+        """
+        Point the links of an archived HTML or CSS document back into the archive.
+
+        :param body: The document bytes
+        :param content_type: Its Content-Type
+        :param base_url: The URL the document was captured from
+        :param prefix: Replay prefix, e.g. b"/replay/<content_hash>/"
+        :returns: The rewritten bytes
+        """
+        content_type = (content_type or "").lower()
+
+        def absolute(link):
+            link = link.strip()
+            if not link or link.lower().startswith(SKIP_SCHEMES) or link.startswith(prefix):
+                return link
+            target = urljoin(base_url, link.decode("utf-8", "ignore"))
+            if not target.startswith(("http://", "https://")):
+                return link
+            return prefix + target.encode("utf-8")
+
+        def attr(m):
+            return m.group(1) + m.group(2) + absolute(m.group(3)) + m.group(2)
+
+        def srcset(m):
+            parts = []
+            for candidate in m.group(3).split(b","):
+                bits = candidate.strip().split(None, 1)
+                if bits:
+                    bits[0] = absolute(bits[0])
+                parts.append(b" ".join(bits))
+            return m.group(1) + m.group(2) + b", ".join(parts) + m.group(2)
+
+        def css_url(m):
+            return m.group(1) + m.group(2) + absolute(m.group(3)) + m.group(2) + m.group(4)
+
+        if "html" in content_type:
+            body = HTML_ATTR.sub(attr, body)
+            body = SRCSET_ATTR.sub(srcset, body)
+            body = CSS_URL.sub(css_url, body)
+        elif "css" in content_type:
+            body = CSS_URL.sub(css_url, body)
+            body = CSS_IMPORT.sub(attr, body)
+        return body
@@ -0,0 +1,433 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from urllib.parse import urlparse
+from .bwa_jobqueue import async_job_queue
+from .bwa_pool import io_pool, net_pool
+from .bwa_metrics import REGISTRY, counter
+
+# Recurring captures of watched URLs, one JSON file per URL in jobs/watch/<url_key>.json.
+#
+# Every watch has its own interval between min_interval and max_interval. When a capture
+# finishes, the interval adapts to what it found:
+#   changed   (new content_hash)                 interval * BWA_WATCH_SPEEDUP  (0.5)
+#   unchanged ("unchanged", or the same hash)    interval * BWA_WATCH_SLOWDOWN (1.5)
+#   failed                                       retried with backoff, interval kept
+# New watches start from the change history on QDN: the median time between published
+# versions (each one a change, the chain follows previous_hash), halved.
+#
+# Due times get +-BWA_WATCH_JITTER (10%) of the interval and new watches are spread over
+# BWA_WATCH_SPREAD seconds, so a watch list never fires all at once. Due watches become
+# normal crawl jobs under one budget: BWA_WATCH_BUDGET captures per hour and at most
+# BWA_WATCH_MAX_ACTIVE running; when that is short, the watches that change most and are
+# most overdue go first.
+
+WATCH_CAPTURES = REGISTRY.register(counter("bwa_watch_captures_total", "Scheduled captures of watched URLs by outcome", ["outcome"]))
+
+
+def url_key(url):
+    # same key as backend.api.url_key
+    return "url-sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def change_interval(manifests):
+    """
+    Estimate how often a URL changes from its published versions.
+
+    :param manifests: (identifier, manifest, zip_path) tuples of one url_key
+    :returns: Median seconds between versions, or None with fewer than two
+    """
+    times = sorted(filter(None, (parse_timestamp(manifest.get("timestamp")) for _, manifest, _ in manifests)))
+    gaps = sorted(later - earlier for earlier, later in zip(times, times[1:]) if later > earlier)
+    if not gaps:
+        return None
+    return gaps[len(gaps) // 2]
+
+
+class watch_list:
+    def __init__(self, watch_dir = "jobs/watch"):
+        """
+        Watched URLs on disk, one JSON file each.
+
+        :param watch_dir: Directory of the watch files
+        """
+        self.watch_dir = watch_dir
+        os.makedirs(self.watch_dir, exist_ok=True)
+
+
+    def _path(self, key):
+        return os.path.join(self.watch_dir, f"{key.replace(':', '_')}.json")
+
+
+    def load(self):
+        """
+        Return every watch, keyed by url_key.
+        """
+        watches = {}
+        for name in os.listdir(self.watch_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.watch_dir, name), "r") as f:
+                    watch = json.load(f)
+            except (OSError, ValueError):
+                continue
+            watches[watch["url_key"]] = watch
+        return watches
+
+
+    def version(self):
+        """
+        Return a value that changes whenever a watch file is written or removed.
+        """
+        return os.stat(self.watch_dir).st_mtime_ns
+
+
+    def save(self, watch):
+        path = self._path(watch["url_key"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(watch, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class scheduler:
+    INTERVAL = float(os.environ.get("BWA_WATCH_INTERVAL", 24 * 3600))
+    MIN_INTERVAL = float(os.environ.get("BWA_WATCH_MIN_INTERVAL", 3600))
+    MAX_INTERVAL = float(os.environ.get("BWA_WATCH_MAX_INTERVAL", 7 * 24 * 3600))
+    SPEEDUP = float(os.environ.get("BWA_WATCH_SPEEDUP", 0.5))
+    SLOWDOWN = float(os.environ.get("BWA_WATCH_SLOWDOWN", 1.5))
+    JITTER = float(os.environ.get("BWA_WATCH_JITTER", 0.1))
+    SPREAD = float(os.environ.get("BWA_WATCH_SPREAD", 3600))
+    BUDGET = float(os.environ.get("BWA_WATCH_BUDGET", 120))
+    MAX_ACTIVE = int(os.environ.get("BWA_WATCH_MAX_ACTIVE", 4))
+    RETRY = float(os.environ.get("BWA_WATCH_RETRY", 600))
+    POLL_INTERVAL = float(os.environ.get("BWA_WATCH_POLL", 5.0))
+    HISTORY = 20
+
+    def __init__(self, watch_dir = "jobs/watch"):
+        """
+        Background stage that turns due watches into crawl jobs.
+
+        :param watch_dir: Directory of the watch files
+        """
+        self.store = watch_list(watch_dir)
+        self.jobs = async_job_queue()
+        self.limiter = None
+        self.watches = None
+        self.loaded = None
+        self.crawls = set()
+        self.tasks = []
+        self.logger = logging.getLogger("bwa_schedule")
+
+
+    async def load(self):
+        if self.watches is None:
+            self.loaded = await io_pool.run(self.store.version)
+            self.watches = await io_pool.run(self.store.load)
+        return self.watches
+
+
+    async def refresh(self):
+        """
+        Reload the watches if their files changed, e.g. written by an API replica.
+        """
+        if await io_pool.run(self.store.version) != self.loaded:
+            self.watches = None
+        return await self.load()
+
+
+    def jitter(self, seconds):
+        return seconds * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+
+    async def add(self, url, options = None, interval = None, min_interval = None, max_interval = None):
+        """
+        Watch a URL, or change the settings of an existing watch.
+
+        :param url: The URL to capture
+        :param options: Job fields for its crawls, e.g. depth, assets, screenshot
+        :param interval: Starting interval in seconds, defaults to the QDN history or BWA_WATCH_INTERVAL
+        :returns: The watch
+        """
+        watches = await self.refresh()
+        key = url_key(url)
+        now = time.time()
+        watch = watches.get(key) or {
+            "url": url,
+            "url_key": key,
+            "created_at": now,
+            # spread a batch of new watches instead of crawling them all now
+            "next_due": now + random.uniform(0, self.SPREAD),
+            "seeded": interval is not None,
+            "job_id": None,
+            "content_hash": None,
+            "captures": 0,
+            "changes": 0,
+            "failures": 0,
+            "change_rate": None,
+            "history": [],
+        }
+        watch["options"] = options or watch.get("options", {})
+        watch["min_interval"] = float(min_interval or watch.get("min_interval", self.MIN_INTERVAL))
+        watch["max_interval"] = float(max_interval or watch.get("max_interval", self.MAX_INTERVAL))
+        if watch["min_interval"] > watch["max_interval"]:
+            raise ValueError("min_interval must not be larger than max_interval")
+        watch["interval"] = self.clamp(watch, float(interval or watch.get("interval", self.INTERVAL)))
+        if interval is not None:
+            watch["seeded"] = True
+        watches[key] = watch
+        await io_pool.run(self.store.save, watch)
+        return watch
+
+
+    async def remove(self, url):
+        """
+        Stop watching a URL; a capture already running still finishes.
+        """
+        watches = await self.refresh()
+        key = url_key(url)
+        watches.pop(key, None)
+        return await io_pool.run(self.store.remove, key)
+
+
+    async def list(self):
+        """
+        Return every watch, soonest due first.
+        """
+        return sorted((await self.refresh()).values(), key=lambda watch: watch["next_due"])
+
+
+    def clamp(self, watch, seconds):
+        return min(max(seconds, watch["min_interval"]), watch["max_interval"])
+
+
+    def priority(self, watch, now):
+        # overdue by whole intervals, plus how likely a capture is to find a change
+        overdue = (now - watch["next_due"]) / watch["interval"]
+        change_rate = watch["change_rate"] if watch["change_rate"] is not None else 0.5
+        return overdue + change_rate
+
+
+    async def seed(self, watches):
+        """
+        Start new watches at the change rate their published history shows.
+        """
+        from .bwa_manifest import bwa_manifest
+
+        keys = {watch["url_key"] for watch in watches}
+        scanner = bwa_manifest(None)
+        manifests = await net_pool.run(scanner.scan_manifests, keys)
+        by_key = {key: [] for key in keys}
+        for entry in manifests:
+            by_key[entry[1]["url_key"]].append(entry)
+
+        for watch in watches:
+            history = by_key[watch["url_key"]]
+            head = scanner.latest_manifest(history)
+            if head:
+                watch["content_hash"] = head[1].get("content_hash")
+            gap = change_interval(history)
+            if gap:
+                # capture about twice per observed change
+                watch["interval"] = self.clamp(watch, gap / 2)
+                watch["change_rate"] = 0.5
+            watch["seeded"] = True
+            self.logger.info(f"Watching {watch['url']} every {watch['interval']:.0f}s ({len(history)} published versions)")
+            await io_pool.run(self.store.save, watch)
+
+
+    def adapt(self, watch, outcome, job, now):
+        """
+        Move a watch's interval and due time after one of its captures finished.
+
+        :param outcome: "changed", "unchanged", "first" or "failed"
+        :param job: The finished job record
+        """
+        watch["job_id"] = None
+        watch["history"] = (watch["history"] + [[round(now), outcome]])[-self.HISTORY:]
+        if outcome == "failed":
+            watch["failures"] += 1
+            watch["next_due"] = now + self.jitter(min(watch["interval"], self.RETRY * 2 ** (watch["failures"] - 1)))
+            return
+
+        watch["failures"] = 0
+        watch["captures"] += 1
+        watch["last_capture"] = now
+        if outcome == "changed":
+            watch["changes"] += 1
+            watch["interval"] = self.clamp(watch, watch["interval"] * self.SPEEDUP)
+        elif outcome == "unchanged":
+            watch["interval"] = self.clamp(watch, watch["interval"] * self.SLOWDOWN)
+        if outcome != "first":
+            seen = 1.0 if outcome == "changed" else 0.0
+            rate = watch["change_rate"]
+            watch["change_rate"] = round(seen if rate is None else 0.7 * rate + 0.3 * seen, 4)
+        watch["content_hash"] = job.get("content_hash") or watch["content_hash"]
+        watch["next_due"] = now + self.jitter(watch["interval"])
+
+
+    def outcome(self, watch, job):
+        """
+        Classify a finished capture, or return None while it is still running.
+        """
+        if job is None or job.get("fault") or job.get("status") == "failed":
+            return "failed"
+        status = job.get("status")
+        if status == "unchanged":
+            return "unchanged"
+        if status != "complete":
+            return None
+        if not watch["content_hash"]:
+            return "first"
+        return "unchanged" if job.get("content_hash") == watch["content_hash"] else "changed"
+
+
+    async def collect(self):
+        """
+        Adapt every watch whose capture finished since the last tick.
+        """
+        now = time.time()
+        for watch in list(self.watches.values()):
+            if not watch["job_id"]:
+                continue
+            job = await self.jobs.get_job(watch["job_id"])
+            outcome = self.outcome(watch, job)
+            if outcome is None:
+                continue
+            self.adapt(watch, outcome, job, now)
+            WATCH_CAPTURES.inc(outcome=outcome)
+            self.logger.info(f"{watch['url']}: {outcome}, next capture in {watch['next_due'] - now:.0f}s")
+            await io_pool.run(self.store.save, watch)
+
+
+    def active(self):
+        return sum(1 for watch in self.watches.values() if watch["job_id"])
+
+
+    def due(self, now):
+        """
+        Return the due watches without a capture running, most deserving first.
+        """
+        due = [watch for watch in self.watches.values() if not watch["job_id"] and watch["next_due"] <= now]
+        return sorted(due, key=lambda watch: self.priority(watch, now), reverse=True)
+
+
+    async def submit(self, watch):
+        """
+        Queue a capture of a watch as a normal crawl job.
+        """
+        from .bwa_crawl import crawler
+
+        url = watch["url"]
+        job_id = await self.jobs.create_job({
+            "status": "queued",
+            "message": "",
+            "url": url,
+            "url_hash": watch["url_key"],
+            "domain": urlparse(url).netloc,
+            "depth": 1,
+            "assets": False,
+            "profile": False,
+            **watch["options"],
+            "watch": watch["url_key"],
+        })
+        watch["job_id"] = job_id
+        await io_pool.run(self.store.save, watch)
+        await self.jobs.update_job(job_id, {"status": "started"})
+
+        crawl = await io_pool.run(crawler, job_id)
+        task = asyncio.create_task(crawl.run())
+        self.crawls.add(task)
+        task.add_done_callback(self.finished)
+        return job_id
+
+
+    def finished(self, task):
+        self.crawls.discard(task)
+        if not task.cancelled():
+            # a failed crawl is on its job record, collect() picks it up
+            task.exception()
+
+
+    async def run(self):
+        """
+        Seed, collect and submit until cancelled.
+        """
+        from .bwa_publish import rate_limiter
+
+        self.limiter = self.limiter or rate_limiter(self.BUDGET / 3600, burst=self.MAX_ACTIVE)
+        await self.load()
+        while True:
+            try:
+                await self.refresh()
+                unseeded = [watch for watch in self.watches.values() if not watch["seeded"]]
+                if unseeded:
+                    await self.seed(unseeded)
+                await self.collect()
+
+                due = self.due(time.time())
+                if not due or self.active() >= self.MAX_ACTIVE:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    continue
+                await self.limiter.acquire()
+                # the list may have changed while waiting for budget
+                due = self.due(time.time())
+                if due:
+                    await self.submit(due[0])
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Watch scheduling failed: {e}")
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+
+    def start(self):
+        """
+        Start the scheduler on the running event loop.
+        """
+        self.tasks = [asyncio.create_task(self.run())]
+        return self.tasks
+
+
+    async def stop(self):
+        """
+        Cancel the scheduler and the captures it started.
+        """
+        for task in [*self.tasks, *self.crawls]:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *self.crawls, return_exceptions=True)
+        self.tasks = []
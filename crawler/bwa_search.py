@@ -0,0 +1,406 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+from html.parser import HTMLParser
+from .bwa_jobqueue import job_queue, job_feed
+from .bwa_bundle import bwa_bundle
+from .bwa_pool import bwa_pool, io_pool
+from .bwa_metrics import REGISTRY, counter
+
+# Full-text search over archived captures, a SQLite FTS5 index in jobs/search/search.db.
+#
+# The indexer runs beside the publisher: the snapshot.html of completed jobs is read back
+# from their published bundle, reduced to title and visible text and added in batches,
+# once per version (content_hash). Each job is marked "indexed" with the generation of the index
+# it went into, so a deleted index is rebuilt from the jobs on disk. Only job files written
+# since the last scan are read (see job_feed). A capture whose bundle cannot be read, e.g. QDN
+# is down, is left unmarked and retried with a backoff doubling up to BWA_SEARCH_RETRY_MAX.
+#
+# Queries are words, all of which must match, word* prefixes of at least three letters
+# and "quoted phrases". Hits are ranked by BM25 with title and URL weighing more than text.
+# Scoring costs time per matching version, so a query matching more than
+# BWA_SEARCH_CANDIDATES versions ranks only the newest that many; rare terms stay exact
+# and common ones stay fast however large the archive grows.
+#
+#   BWA_SEARCH_DB          jobs/search/search.db
+#   BWA_SEARCH_MAX_CHARS   200000    characters of page text indexed per version
+#   BWA_SEARCH_BATCH       64        versions written per transaction
+#   BWA_SEARCH_POLL        5         seconds between scans for new captures
+#   BWA_SEARCH_RETRY_MAX   3600      longest wait before a failed capture is tried again
+#   BWA_SEARCH_CANDIDATES  1000      matching versions ranked per query
+
+DB_PATH = os.environ.get("BWA_SEARCH_DB", "jobs/search/search.db")
+MAX_CHARS = int(os.environ.get("BWA_SEARCH_MAX_CHARS", 200000))
+CANDIDATES = int(os.environ.get("BWA_SEARCH_CANDIDATES", 1000))
+
+# BM25 weights of the title, url and body columns
+RANK = "bm25(10.0, 5.0, 1.0)"
+# the page text is returned as is, so snippets mark hits with plain text
+MARKS = ("[", "]")
+
+INDEXED = REGISTRY.register(counter("bwa_search_indexed_total", "Captured versions added to the search index"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT UNIQUE NOT NULL,
+    url_key TEXT,
+    url TEXT,
+    job_id TEXT,
+    captured_at REAL
+);
+CREATE INDEX IF NOT EXISTS versions_url_key ON versions (url_key, captured_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5 (title, url, body, tokenize = 'porter unicode61 remove_diacritics 2', prefix = '3');
+"""
+
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "object"}
+# tags that separate words; text inside inline tags (<b>, <a>, ...) runs on
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav",
+    "ol", "option", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+}
+
+
+class text_extractor(HTMLParser):
+    def __init__(self, max_chars = MAX_CHARS):
+        """
+        Collects the title and visible text of an HTML document.
+
+        :param max_chars: Stop collecting text after this many characters
+        """
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.title = []
+        self.text = []
+        self.size = 0
+        self.skip = 0
+        self.in_title = False
+
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self.in_title = True
+        elif tag in BLOCK_TAGS:
+            self.text.append(" ")
+        elif tag in SKIP_TAGS:
+            self.skip += 1
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if (attrs.get("name") or attrs.get("property") or "").lower() in ("description", "og:description"):
+                self.text.append(f" {attrs.get('content') or ''} ")
+
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag in BLOCK_TAGS:
+            self.text.append(" ")
+        elif tag in SKIP_TAGS and self.skip:
+            self.skip -= 1
+
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+        elif not self.skip and self.size < self.max_chars:
+            self.text.append(data)
+            self.size += len(data)
+
+
+def extract(html, max_chars = MAX_CHARS):
+    """
+    Return the title and visible text of an HTML document.
+
+    :param html: The document as a string
+    :returns: (title, text), whitespace collapsed
+    """
+    parser = text_extractor(max_chars)
+    parser.feed(html)
+    parser.close()
+    title = " ".join("".join(parser.title).split())
+    text = " ".join("".join(parser.text).split())
+    return title, text[:max_chars]
+
+
+def fts_query(text):
+    """
+    Turn a user query into an FTS5 expression that cannot be a syntax error.
+
+    :param text: Words, word* prefixes and "quoted phrases"
+    :raises ValueError: if the query has no terms
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        # word* matches as a prefix; shorter prefixes than the prefix index match too much
+        prefix = word.endswith("*") and len(word.rstrip("*")) >= 3
+        term = phrase or word.rstrip("*")
+        if term.strip():
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise ValueError("Empty search query")
+    return " ".join(terms)
+
+
+class search_index:
+    def __init__(self, path = None):
+        """
+        SQLite FTS5 index of captured versions.
+
+        Each thread gets its own connection; writes are serialized, reads never wait
+        for them (WAL).
+
+        :param path: Database file, defaults to BWA_SEARCH_DB
+        """
+        self.path = path or DB_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+
+        db = self.connect()
+        with self.write_lock, db:
+            db.executescript(SCHEMA)
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', ?)", (uuid.uuid4().hex,))
+            db.execute("INSERT INTO pages (pages, rank) VALUES ('rank', ?)", (RANK,))
+        self.generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+
+    def connect(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            self.local.db = db
+        return db
+
+
+    def add(self, docs):
+        """
+        Add versions in one transaction; versions already indexed are skipped.
+
+        :param docs: dicts with content_hash, url_key, url, job_id, captured_at, title and text
+        :returns: Number of versions added
+        """
+        db = self.connect()
+        added = 0
+        with self.write_lock, db:
+            for doc in docs:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO versions (content_hash, url_key, url, job_id, captured_at) VALUES (?, ?, ?, ?, ?)",
+                    (doc["content_hash"], doc["url_key"], doc["url"], doc["job_id"], doc["captured_at"]),
+                )
+                if cursor.rowcount:
+                    db.execute("INSERT INTO pages (rowid, title, url, body) VALUES (?, ?, ?, ?)",
+                               (cursor.lastrowid, doc["title"], doc["url"], doc["text"]))
+                    added += 1
+        return added
+
+
+    def search(self, query, limit = 20, offset = 0, url_key = None):
+        """
+        Return the best matching versions, best first.
+
+        :param query: Words and "quoted phrases", see fts_query()
+        :param limit: Maximum number of hits
+        :param offset: Hits to skip, for paging
+        :param url_key: Only search the versions of this URL
+        :returns: list of dicts with url_key, content_hash, url, job_id, captured_at, title, snippet and score
+        :raises ValueError: if the query has no terms
+        """
+        expression = fts_query(query)
+        where = "pages MATCH ?"
+        args = [expression]
+        if url_key:
+            where += " AND pages.rowid IN (SELECT id FROM versions WHERE url_key = ?)"
+            args.append(url_key)
+        db = self.connect()
+        # walking rowids is cheap, scoring is not: cap the versions that get scored
+        cutoff = db.execute(f"SELECT rowid FROM pages WHERE {where} ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                            [*args, CANDIDATES]).fetchone()
+        if cutoff:
+            where += " AND pages.rowid > ?"
+            args.append(cutoff[0])
+        # rank the FTS table alone so FTS5 only scores, snippets and sorts what it returns
+        rows = db.execute(f"""
+            SELECT versions.url_key, versions.content_hash, versions.url, versions.job_id, versions.captured_at,
+                   hits.title, hits.snippet, hits.score
+            FROM (
+                SELECT rowid, title, rank AS score,
+                       snippet(pages, 2, ?, ?, '...', 24) AS snippet
+                FROM pages WHERE {where}
+                ORDER BY rank LIMIT ? OFFSET ?
+            ) AS hits
+            JOIN versions ON versions.id = hits.rowid
+            ORDER BY hits.score
+        """, [*MARKS, *args, limit, offset]).fetchall()
+        # FTS5 ranks best first by negated BM25, report the BM25 score itself
+        return [{**dict(row), "score": -row["score"]} for row in rows]
+
+
+    def count(self):
+        """
+        Return the number of indexed versions.
+        """
+        return self.connect().execute("SELECT count(*) FROM versions").fetchone()[0]
+
+
+class indexer:
+    BATCH_SIZE = int(os.environ.get("BWA_SEARCH_BATCH", 64))
+    POLL_INTERVAL = float(os.environ.get("BWA_SEARCH_POLL", 5.0))
+    RETRY_MAX = float(os.environ.get("BWA_SEARCH_RETRY_MAX", 3600))
+
+    def __init__(self, bundles = None, index = None):
+        """
+        Background stage that adds completed captures to the search index.
+
+        :param bundles: bwa_bundle the published captures are read from, defaults to one over the archive cache
+        :param index: The search_index, defaults to one at BWA_SEARCH_DB
+        """
+        self.bundles = bundles or bwa_bundle()
+        self.index = index or search_index()
+        self.jobs = job_queue()
+        self.feed = job_feed(self.unindexed, self.jobs)
+        # job id -> (failed attempts, monotonic time of the next attempt)
+        self.retries = {}
+        # SQLite has one writer; one thread also keeps extraction off the io pool
+        self.pool = bwa_pool("index", 1)
+        self.tasks = []
+        self.logger = logging.getLogger("bwa_search")
+
+
+    def start(self):
+        """
+        Start the indexer on the running event loop.
+        """
+        self.tasks = [asyncio.create_task(self.run())]
+        return self.tasks
+
+
+    async def stop(self):
+        """
+        Cancel the indexer.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+    def unindexed(self, job):
+        return (job.get("status") == "complete" and job.get("content_hash") and job.get("url_hash")
+                and job.get("indexed") != self.index.generation)
+
+
+    def pending(self):
+        """
+        Return published captures not yet in this index and not waiting for a retry, oldest first.
+        """
+        now = time.monotonic()
+        waiting = self.feed.refresh()
+        self.retries = {job_id: retry for job_id, retry in self.retries.items() if job_id in waiting}
+        jobs = [job for job in waiting.values() if self.retries.get(job["id"], (0, 0))[1] <= now]
+        # the first capture of a version is the one it is indexed under
+        return sorted(jobs, key=lambda job: job.get("crawled_at", 0))
+
+
+    def retry(self, job, reason):
+        """
+        Leave a job unmarked and hold it back for a while before the next attempt.
+        """
+        attempts = self.retries.get(job["id"], (0, 0))[0] + 1
+        delay = min(self.RETRY_MAX, self.POLL_INTERVAL * 2 ** attempts)
+        self.retries[job["id"]] = (attempts, time.monotonic() + delay)
+        self.logger.warning(f"Could not index job {job['id']} ({reason}), retrying in {delay:.0f}s")
+
+
+    def document(self, job):
+        """
+        Read one job's capture back as a search document, or None if it has no HTML.
+        """
+        # publishing removes the job's directory, the bundle is what stays
+        f = self.bundles.open_member(job["content_hash"], "metadata/snapshot.html")
+        if f is None:
+            return None
+        with f:
+            title, text = extract(f.read().decode("utf-8", errors="replace"))
+        return {
+            "content_hash": job["content_hash"],
+            "url_key": job["url_hash"],
+            "url": job.get("url", ""),
+            "job_id": job["id"],
+            "captured_at": job.get("crawled_at"),
+            "title": title,
+            "text": text,
+        }
+
+
+    def index_batch(self, batch):
+        """
+        Index a batch of jobs and mark the ones that are done indexed (blocking).
+
+        Jobs whose text was added, or whose bundle has no HTML to add, are marked; jobs whose
+        bundle could not be read stay unmarked and are retried later.
+
+        :returns: Number of versions added
+        """
+        docs, done = [], []
+        for job in batch:
+            try:
+                doc = self.document(job)
+            except Exception as e:
+                self.retry(job, e)
+                continue
+            if doc is None and not self.bundles.manifest(job["content_hash"]):
+                # evicted from the cache and not fetched again
+                self.retry(job, "bundle unavailable")
+                continue
+            if doc:
+                docs.append(doc)
+            done.append(job)
+        added = self.index.add(docs)
+        for job in done:
+            self.jobs.update_job(job["id"], {"indexed": self.index.generation})
+            self.feed.discard(job["id"])
+            self.retries.pop(job["id"], None)
+        INDEXED.inc(added)
+        return added
+
+
+    async def run(self):
+        """
+        Index new captures in batches until cancelled.
+        """
+        while True:
+            try:
+                batch = (await io_pool.run(self.pending))[:self.BATCH_SIZE]
+                if not batch:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    continue
+                added = await self.pool.run(self.index_batch, batch)
+                self.logger.info(f"Indexed {added} new versions from {len(batch)} jobs")
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Search indexing failed: {e}")
+                await asyncio.sleep(self.POLL_INTERVAL)
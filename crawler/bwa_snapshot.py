@@ -12,13 +12,18 @@
 
 import io
 import os
-import sys
 import json
 import asyncio
 import logging
 import aiofiles
 from pathlib import Path
 from .bwa_jobqueue import job_queue
+from .bwa_pool import io_pool
+from .bwa_metrics import stage, add_bytes
+from . import bwa_codec
+from . import bwa_image
+from . import bwa_inline
+from .bwa_image import image_pool
 
 class snapshot:
 
@@ -28,36 +33,20 @@ class snapshot:
         self.job = self.jobs.get_job(self.job_id)
         self.dirpath = dirpath
         
-        # configure logger for this instance only (don't configure globally)
-        self.logger = logging.getLogger(f"bwa_snapshot.{job_id}")
-        self.logger.setLevel(logging.DEBUG)
-        
-        # Only add handler if logger doesn't already have one
-        if not self.logger.handlers:
-            handler = logging.StreamHandler(sys.stdout)
-            handler.setFormatter(logging.Formatter(
-                "%(asctime)s %(levelname)s %(message)s"
-            ))
-            self.logger.addHandler(handler)
-
-        # ensure Uvicorn loggers propagate
-        for name in ("uvicorn.error", "uvicorn.access"):
-            uv_logger = logging.getLogger(name)
-            uv_logger.handlers.clear()
-            uv_logger.propagate = True
-
-
-    def fault(self, state, msg):
+        self.logger = logging.getLogger("bwa_snapshot")
+
+
+    async def fault(self, state, msg):
         self.job["fault"] = state
         self.job["message"] = msg
-        self.jobs.update_job(self.job_id,self.job)
+        await io_pool.run(self.jobs.update_job, self.job_id, self.job)
         self.logger.error(msg)
 
 
-    def status(self, state,  msg):
+    async def status(self, state,  msg):
         self.job["status"] = state
         self.job["message"] = msg
-        self.jobs.update_job(self.job_id,self.job)
+        await io_pool.run(self.jobs.update_job, self.job_id, self.job)
         self.logger.info(msg)
 
 
@@ -73,7 +62,8 @@ class snapshot:
             path.mkdir(parents=True, exist_ok=True)
             return path
         except OSError as e:
-            self.fault("mkdir",f"Failed to create directory {dirpath}: {e}")
+            # the store_* caller records the fault on the job
+            self.logger.error(f"Failed to create directory {dirpath}: {e}")
             raise
 
 
@@ -90,81 +80,199 @@ class snapshot:
         return os.path.join(metadata_dirpath, filename)
 
 
-    async def store_warc(self, warc_buffer):
+    async def screenshot(self, page):
         """
-        Generate WARC file from buffer.
+        Capture the page as the job's screenshot profile asks (see bwa_image).
 
-        :param warc_buffer: Buffer containing WARC data
+        :param page: Playwright page object
+        :returns: dict with the format, the encoded tiles top to bottom and the thumbnail (bytes, extension) or None
         """
-        try:
-            self.status("warc",f"WARC file generation started.")
-
-            # Ensure warc_buffer is resolved
-            if asyncio.iscoroutine(warc_buffer):
-                buffer_content = await warc_buffer
-            elif isinstance(warc_buffer, io.BytesIO):
-                buffer_content = warc_buffer
-            else:
-                raise TypeError(f"Unexpected buffer type: {type(warc_buffer)}")
-
-            warc_filepath = self.mk_filepath("warc", "crawl.warc.gz")
-            
-            async with aiofiles.open(warc_filepath, "wb") as f:
-                await f.write(buffer_content.getvalue())
-            
-            self.status("warc",f"WARC file generated: {warc_filepath}")
-        except Exception as e:
-            self.fault("warc",f"WARC file generation failed: {e}")
-            raise
+        options = bwa_image.options(self.job.get("screenshot"))
+        fmt = options["format"]
+        if fmt == "webp" and not bwa_image.webp_supported():
+            self.logger.warning("WebP screenshots need Pillow with WebP support, taking JPEG instead")
+            fmt = "jpeg"
+        # Chromium encodes PNG and JPEG itself, WebP is transcoded from a PNG
+        capture = {"type": "png" if fmt == "webp" else fmt}
+        if fmt == "jpeg":
+            capture["quality"] = options["quality"]
+
+        with stage("screenshot"):
+            viewport = page.viewport_size or {"width": 1280, "height": 720}
+            height = await page.evaluate("() => document.documentElement.scrollHeight") or viewport["height"]
+            if options["max_height"]:
+                height = min(height, options["max_height"])
+            tile = options["tile_height"] or height
+            tiles = []
+            for top in range(0, height, tile):
+                clip = {"x": 0, "y": top, "width": viewport["width"], "height": min(tile, height - top)}
+                tiles.append(await page.screenshot(full_page=True, clip=clip, **capture))
 
+        thumbnail = None
+        with stage("encode"):
+            if fmt == "webp":
+                tiles = list(await asyncio.gather(*(
+                    image_pool.run(bwa_image.transcode, data, "webp", options["quality"]) for data in tiles
+                )))
+            if tiles and options["thumbnail"]:
+                thumbnail = await image_pool.run(bwa_image.thumbnail, tiles[0], options["thumbnail"])
+        return {"format": fmt, "tiles": tiles, "thumbnail": thumbnail}
 
-    async def store_html(self, page):
+
+    async def mhtml(self, page):
         """
-        Capture HTML content from page.
+        Save the rendered page as MHTML through Chromium's DevTools protocol (see bwa_inline).
 
         :param page: Playwright page object
+        :returns: MHTML bytes, or None if turned off, too large or not available
         """
+        if not bwa_inline.ENABLED:
+            return None
         try:
-            html_filepath = self.mk_filepath("metadata", "snapshot.html")
-            html = await page.content()
-            
-            async with aiofiles.open(html_filepath, "w") as f:
-                await f.write(html)
-            
-            self.status("html",f"HTML snapshot saved: {html_filepath}")
+            with stage("mhtml"):
+                session = await page.context.new_cdp_session(page)
+                try:
+                    data = (await session.send("Page.captureSnapshot", {"format": "mhtml"}))["data"].encode("utf-8")
+                finally:
+                    await session.detach()
         except Exception as e:
-            self.fault("html",f"HTML file generation failed: {e}")
-            raise
+            # only Chromium speaks CDP, the capture is complete without the single file
+            self.logger.warning(f"Single-file snapshot skipped: {e}")
+            return None
+        if len(data) > bwa_inline.MAX_BYTES:
+            self.logger.warning(f"Single-file snapshot skipped: MHTML of {len(data)} bytes is over the {bwa_inline.MAX_BYTES} byte limit")
+            return None
+        return data
 
 
-    async def store_image(self, page):
+    async def capture_page(self, page):
         """
-        Capture full-page screenshot.
+        Serialize the DOM, save the MHTML and take the screenshot at the same time.
 
         :param page: Playwright page object
+        :returns: (html, screenshot as returned by screenshot(), MHTML bytes or None)
+        """
+        async def html():
+            with stage("html"):
+                return await page.content()
+
+        html, shot, mhtml = await asyncio.gather(html(), self.screenshot(page), self.mhtml(page), return_exceptions=True)
+        if isinstance(html, BaseException):
+            await self.fault("html",f"HTML capture failed: {html}")
+            raise html
+        if isinstance(shot, BaseException):
+            await self.fault("image",f"Screenshot capture failed: {shot}")
+            raise shot
+        if isinstance(mhtml, BaseException):
+            raise mhtml  # mhtml() handles its own errors, this is a cancellation
+        return html, shot, mhtml
+
+
+    async def write(self, folder, filename, data):
+        """
+        Write one artifact and count its bytes as captured.
+
+        :param folder: Subfolder name
+        :param filename: Filename
+        :param data: str or bytes
+        :returns: The path written
+        """
+        filepath = self.mk_filepath(folder, filename)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with stage("store"):
+            async with aiofiles.open(filepath, "wb") as f:
+                await f.write(data)
+        add_bytes("captured", len(data))
+        return filepath
+
+
+    async def write_warc(self, warc_buffer):
+        """
+        Write the WARC, waiting for it first if it is still being built.
+
+        :param warc_buffer: BytesIO, or a coroutine resolving to one
+        """
+        if asyncio.iscoroutine(warc_buffer):
+            warc_buffer = await warc_buffer
+        if not isinstance(warc_buffer, io.BytesIO):
+            raise TypeError(f"Unexpected buffer type: {type(warc_buffer)}")
+        return await self.write(*bwa_codec.warc_member().split("/"), warc_buffer.getbuffer())
+
+
+    async def write_single_file(self, mhtml):
+        """
+        Inline the MHTML into metadata/snapshot.inline.html; a failure only loses that file.
+
+        :param mhtml: MHTML bytes from mhtml()
+        :returns: The path written, or None
         """
         try:
-            png_filepath = self.mk_filepath("metadata", "snapshot.png")
-            await page.screenshot(path=png_filepath, full_page=True)
-            
-            self.status("image",f"Screenshot saved: {png_filepath}")
+            with stage("inline"):
+                document, resources = await image_pool.run(bwa_inline.inline, mhtml)
+            filepath = await self.write(*bwa_inline.MEMBER.split("/"), document)
         except Exception as e:
-            self.fault("image",f"Screenshot generation failed: {e}")
-            raise
+            self.logger.warning(f"Single-file snapshot failed: {e}")
+            return None
+        self.job["single_file"] = {"member": bwa_inline.MEMBER, "bytes": len(document), "resources": resources}
+        return filepath
 
 
-    def store_job(self):
+    async def store(self, html, shot, warc_buffer, mhtml = None):
+        """
+        Write the HTML, screenshot and WARC in parallel and record one status when all are on disk.
+
+        The WARC may be passed as the coroutine building it, so the conversion overlaps the
+        other writes. The screenshot files are listed on the job as "images", the single-file
+        rendering built from the MHTML as "single_file".
+
+        :param html: Serialized DOM
+        :param shot: Screenshot tiles and thumbnail from screenshot()
+        :param warc_buffer: BytesIO, or a coroutine resolving to one
+        :param mhtml: MHTML bytes from mhtml(), or None
+        """
+        extension = bwa_image.EXTENSIONS[shot["format"]]
+        images = {"format": shot["format"], "tiles": [], "thumbnail": None, "bytes": 0}
+        writes = {
+            "html": self.write("metadata", "snapshot.html", html),
+            "warc": self.write_warc(warc_buffer),
+        }
+        for index, data in enumerate(shot["tiles"]):
+            filename = f"snapshot{extension}" if index == 0 else f"snapshot-{index}{extension}"
+            images["tiles"].append(f"metadata/{filename}")
+            images["bytes"] += len(data)
+            writes[f"image {index}"] = self.write("metadata", filename, data)
+        if shot["thumbnail"]:
+            data, thumb_extension = shot["thumbnail"]
+            images["thumbnail"] = f"metadata/thumb{thumb_extension}"
+            writes["thumbnail"] = self.write("metadata", f"thumb{thumb_extension}", data)
+        if mhtml:
+            writes["single file"] = self.write_single_file(mhtml)
+
+        results = await asyncio.gather(*writes.values(), return_exceptions=True)
+        for name, result in zip(writes, results):
+            if isinstance(result, BaseException):
+                await self.fault(name,f"Storing {name} failed: {result}")
+                raise result
+
+        self.job["images"] = images
+
+        await self.status("stored",f"Snapshot saved: {', '.join(filter(None, results))}")
+
+
+    async def store_job(self):
         """
         Save job metadata to JSON file.
         """
         try:
             log_filepath = self.mk_filepath("metadata", "job.json")
-            with open(log_filepath, "w") as f:
-                json.dump(self.job, f, indent=2)
-            
-            self.status("job",f"Job metadata saved: {log_filepath}")
+            async with aiofiles.open(log_filepath, "w") as f:
+                await f.write(json.dumps(self.job, indent=2))
+
+            # the crawler's status update follows right away, no need for one more job write
+            self.logger.info(f"Job metadata saved: {log_filepath}")
         except Exception as e:
-            self.fault("job",f"Job file generation failed: {e}")
+            await self.fault("job",f"Job file generation failed: {e}")
             raise
 
     def get_job(self):
@@ -0,0 +1,284 @@
+#********************************************************************************
+#          ___  _     _ _                  _                 _                  *
+#         / _ \| |   (_) |                | |               | |                 *
+#        | (_) | |__  _| |_ __ _  ___  ___| | __  _ __   ___| |_                *
+#         > _ <| '_ \| | __/ _` |/ _ \/ _ \ |/ / | '_ \ / _ \ __|               *
+#        | (_) | |_) | | || (_| |  __/  __/   < _| | | |  __/ |_                *
+#         \___/|_.__/|_|\__\__, |\___|\___|_|\_(_)_| |_|\___|\__|               *
+#                           __/ |                                               *
+#                          |___/                                                *
+#                                                                               *
+#*******************************************************************************/
+
+import os
+import io
+import time
+import pstats
+import asyncio
+import cProfile
+import resource
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+# Per-job stage spans and memory, stored on the job record:
+#   "timings": {"navigate": 1.92, "idle": 0.51, ..., "total": 4.87}   seconds per stage
+#   "spans":   [{"stage": "navigate", "start": 0.003, "seconds": 1.92}, ...]
+#   "peak_rss": 812646400   bytes, this process plus its children (the shared browsers)
+#
+# bwa_metrics.stage() adds a span to the trace of the job whose context it runs in; the
+# worker pools copy the context, so stages run on pool threads are attributed too.
+#
+# With "profile": true a job also gets
+#   metadata/profile.txt      cProfile, top functions by cumulative time
+#   metadata/profile.prof     raw cProfile stats for snakeviz / pstats
+#   metadata/tracemalloc.txt  top Python allocations while the job ran
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_current = contextvars.ContextVar("bwa_trace", default=None)
+
+
+def current():
+    """
+    Return the trace of the job running in this context, or None.
+    """
+    return _current.get()
+
+
+def rss(pid):
+    """
+    Return the resident set size of one process in bytes, or 0 if it is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def parent(pid):
+    """
+    Return the parent pid of a process, or None if it is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def memory_available():
+    """
+    Return (available, total) memory in bytes for this process, or None if unknown.
+
+    Inside a container with a cgroup v2 memory limit the limit counts, otherwise the host.
+    """
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current", "r") as f:
+                current = int(f.read().strip())
+            return max(int(limit) - current, 0), int(limit)
+    except (OSError, ValueError):
+        pass
+    try:
+        fields = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                fields[name] = int(value.split()[0]) * 1024
+        return fields["MemAvailable"], fields["MemTotal"]
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def children(pid):
+    """
+    Return the pids of every descendant of a process (Linux /proc only).
+    """
+    parents = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # the command name may contain spaces, the ppid follows its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def tree_rss(pid = None):
+    """
+    Return the resident memory of a process and all its descendants in bytes.
+
+    Falls back to this process' lifetime peak where /proc is unavailable.
+    """
+    pid = pid or os.getpid()
+    total = rss(pid)
+    if not total:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return total + sum(rss(child) for child in children(pid))
+
+
+class job_trace:
+    SAMPLE_INTERVAL = float(os.environ.get("BWA_TRACE_SAMPLE", 0.25))
+
+    def __init__(self):
+        """
+        Collect the stage spans and peak memory of one job.
+        """
+        self.started = time.perf_counter()
+        self.finished = None
+        self.spans = []
+        self.peak_rss = 0
+        self.lock = threading.Lock()
+
+
+    def add(self, stage, started, seconds):
+        """
+        Record one finished stage.
+
+        :param stage: Stage name
+        :param started: time.perf_counter() when the stage began
+        :param seconds: Duration of the stage
+        """
+        with self.lock:
+            self.spans.append({"stage": stage, "start": round(started - self.started, 4), "seconds": round(seconds, 4)})
+
+
+    def timings(self):
+        """
+        Return total seconds per stage, plus the wall time of the job as "total".
+        """
+        totals = {}
+        with self.lock:
+            for span in self.spans:
+                totals[span["stage"]] = round(totals.get(span["stage"], 0) + span["seconds"], 4)
+        totals["total"] = round((self.finished or time.perf_counter()) - self.started, 4)
+        return totals
+
+
+    def record(self, job):
+        """
+        Store timings, spans and peak memory on a job dict.
+        """
+        self.finished = self.finished or time.perf_counter()
+        job["timings"] = self.timings()
+        with self.lock:
+            job["spans"] = list(self.spans)
+        job["peak_rss"] = self.peak_rss
+
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the trace that stages in the current context report to.
+        """
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+    async def _sample(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, await asyncio.to_thread(tree_rss))
+            await asyncio.sleep(self.SAMPLE_INTERVAL)
+
+
+    @asynccontextmanager
+    async def watch(self):
+        """
+        Sample memory in the background while the body runs.
+        """
+        task = asyncio.create_task(self._sample())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self.peak_rss = max(self.peak_rss, tree_rss())
+
+
+class job_profile:
+    # cProfile and tracemalloc are process-wide, so profiled jobs take turns
+    lock = None
+    TOP = int(os.environ.get("BWA_PROFILE_TOP", 60))
+
+    def __init__(self):
+        """
+        Opt-in cProfile and tracemalloc capture for one job.
+
+        The profiler watches the event loop thread, so coroutines of other jobs that run
+        meanwhile show up too; compare against an unprofiled run when in doubt.
+        """
+        self.profiler = cProfile.Profile()
+        self.started_tracemalloc = False
+
+
+    async def start(self):
+        if job_profile.lock is None:
+            job_profile.lock = asyncio.Lock()
+        await job_profile.lock.acquire()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(16)
+            self.started_tracemalloc = True
+        self.profiler.enable()
+
+
+    def write(self, dirpath):
+        """
+        Write the profile artifacts into a job's metadata directory.
+
+        :param dirpath: The metadata directory
+        :returns: list of written paths
+        """
+        os.makedirs(dirpath, exist_ok=True)
+        text = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(self.TOP)
+        paths = [os.path.join(dirpath, name) for name in ("profile.txt", "profile.prof", "tracemalloc.txt")]
+        with open(paths[0], "w") as f:
+            f.write(text.getvalue())
+        stats.dump_stats(paths[1])
+        with open(paths[2], "w") as f:
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            if snapshot is None:
+                f.write("tracemalloc was not tracing\n")
+            else:
+                current, peak = tracemalloc.get_traced_memory()
+                f.write(f"current {current} bytes, peak {peak} bytes\n\n")
+                for stat in snapshot.statistics("lineno")[:self.TOP]:
+                    f.write(f"{stat}\n")
+        return paths
+
+
+    async def stop(self, dirpath):
+        """
+        Stop profiling and write the artifacts.
+
+        :param dirpath: The job's metadata directory
+        """
+        try:
+            self.profiler.disable()
+            return await asyncio.to_thread(self.write, dirpath)
+        finally:
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+            job_profile.lock.release()
@@ -297,6 +297,23 @@ document.getElementById('submitJob').onclick = async () => {
   loadJobs();
 };
 
+/**
+ * Returns the URL of a job's screenshot thumbnail, or null if it has none.
+ * Published jobs serve it from their bundle, others from the local job directory.
+ * 
+ * @function thumbnailUrl
+ * @param {Object} job - A job record from the API
+ * @returns {string|null}
+ */
+function thumbnailUrl(job) {
+  const thumb = job.images?.thumbnail;
+  if (!thumb) return null;
+  const path = job.content_hash
+    ? `archive/${job.content_hash}/${thumb}`
+    : `jobs/manifest/${job.id}.d/${thumb}`;
+  return `${API}/archive-content?path=${encodeURIComponent(path)}`;
+}
+
 /**
  * Fetches all jobs from the API and populates the jobs table with the results.
  * Clears the existing table body and creates table rows for each job with click handlers.
@@ -327,10 +344,12 @@ async function loadJobs() {
       const row = document.createElement('tr');
       row.className = 'job-row';
 
+      const thumb = thumbnailUrl(job);
       row.innerHTML = `
         <td>${job.id}</td>
         <td>${job.status ?? ''}</td>
         <td>${job.domain ?? ''}</td>
+        <td>${thumb ? `<img class="job-thumb" loading="lazy" src="${thumb}" alt="">` : ''}</td>
       `;
 
       const detailRow = document.createElement('tr');
@@ -338,7 +357,7 @@ async function loadJobs() {
       detailRow.style.display = 'none';
 
       detailRow.innerHTML = `
-        <td colspan="3">
+        <td colspan="4">
           <div class="detail-grid">
             <div><strong>URL</strong><br>${job.domain ?? ''}</div>
             <div><strong>URL</strong><br>${job.url ?? ''}</div>
@@ -515,11 +534,12 @@ async function loadArchiveContent(tabId, path, originalUrl) {
   const iframe = tabData.contentElement.querySelector('.archive-frame');
   
   try {
-    // Try to load the snapshot.html first, then fallback to index.html
-    let htmlPath = `${path}/metadata/snapshot.html`;
-    
-    // Check if snapshot.html exists, otherwise try index.html
-    const response = await fetch(`${API}/archive-content?path=${encodeURIComponent(htmlPath)}`);
+    // The single-file snapshot has every asset inlined, one request shows the whole page;
+    // older captures only have snapshot.html, then fallback to index.html
+    let response = await fetch(`${API}/archive-content?path=${encodeURIComponent(`${path}/metadata/snapshot.inline.html`)}`);
+    if (!response.ok) {
+      response = await fetch(`${API}/archive-content?path=${encodeURIComponent(`${path}/metadata/snapshot.html`)}`);
+    }
     
     if (response.ok) {
       const htmlContent = await response.text();